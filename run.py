@@ -22,6 +22,7 @@ elif MODE == "discord":
     import subprocess
     subprocess.run([sys.executable, "src/connectors/discord_connector.py"], check=True)
 else:
-    # Ejecutar API FastAPI
-    import uvicorn
-    uvicorn.run("src.app.server:app", host="0.0.0.0", port=8001)
+    # Ejecutar API FastAPI (SERVER_WORKERS > 1: modo prefork, 0 = un worker por CPU)
+    from src.app.prefork import serve
+    serve(host=os.getenv("SERVER_HOST", "0.0.0.0"), port=int(os.getenv("SERVER_PORT", "8001")),
+          workers=int(os.getenv("SERVER_WORKERS", "1")))
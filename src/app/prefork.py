@@ -0,0 +1,283 @@
+"""Modo multi-proceso (prefork) para la API del webhook.
+
+Un solo proceso Python no aprovecha más de un núcleo en el pipeline (reglas, regex, ML). Con
+SERVER_WORKERS > 1, run.py arranca N procesos que comparten el mismo socket de escucha:
+
+- El padre importa la app y precompila todo antes del fork: rules.yaml, planes de moderación
+  de cada chat (Aho-Corasick, regex) y modelos ML. Después hace gc.freeze() para que el GC de
+  los hijos no toque esos objetos y las páginas sigan compartidas (copy-on-write).
+- El padre no arranca hilos (watcher de reglas, volcados write-behind) antes del fork: un lock
+  tomado por otro hilo en ese momento quedaría bloqueado en los hijos. Cada worker los arranca
+  después del fork.
+- El padre abre el socket y hace fork de los workers; cada uno sirve la app con uvicorn sobre
+  ese socket (el kernel reparte las conexiones). Si un worker muere, el padre lo reemplaza; si
+  muere nada más arrancar, espera cada vez más (backoff exponencial) antes del siguiente intento.
+- Estado compartido: con STATE_BACKEND=redis el rate limit, las infracciones, los mutes y la
+  deduplicación son comunes a todos los workers (y réplicas). Con el backend en memoria cada
+  worker lleva su propia cuenta (se avisa al arrancar).
+- Recarga de reglas: SIGHUP al padre recompila en el padre y reenvía SIGHUP a cada worker. En el
+  worker el manejador solo marca la recarga y despierta al watcher, que compila y publica la nueva
+  generación en su hilo (el hilo principal sigue atendiendo peticiones). request_reload() (usado
+  por POST /admin/rules/reload) lo dispara desde un worker.
+- SIGTERM/SIGINT: el padre para a los workers (uvicorn termina las peticiones en curso) y sale.
+
+Sin fork (Windows) se usa uvicorn.run(workers=N): cada proceso compila su propio estado.
+"""
+from __future__ import annotations
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.utils.logging import log_event, log_error_event
+
+APP_PATH = "src.app.server:app"
+
+# True en los procesos hijos creados por Supervisor
+_IN_WORKER = False
+
+
+def can_fork() -> bool:
+    return hasattr(os, "fork") and sys.platform != "win32"
+
+
+def preload() -> Any:
+    """Importa la app y precompila reglas y modelos ML en el proceso actual, sin arrancar hilos
+    en segundo plano (los arranca cada worker tras el fork). Devuelve la app."""
+    from src.config.rules_loader import defer_rules_watcher, warm_moderation_plans
+    from src.storage.write_behind import defer_threads
+
+    defer_rules_watcher()
+    defer_threads()
+    from src.app.server import app
+
+    plans = warm_moderation_plans()
+    models = 0
+    for plan in plans:
+        if plan.enabled and plan.ml_training_hash:
+            try:
+                from src.ml.runtime import get_moderation_scorer
+                get_moderation_scorer(plan.chat_key, dict(plan.config.get("ml") or {}), plan.ml_training_hash)
+                models += 1
+            except Exception as e:
+                log_error_event("prefork_preload_error", chat=plan.chat_key, error=str(e))
+    # Objetos del arranque fuera del GC: los hijos no los recorren ni tocan sus páginas
+    gc.collect()
+    gc.freeze()
+    log_event("prefork_preloaded", plans=len(plans), ml_models=models, frozen=gc.get_freeze_count())
+    return app
+
+
+def listen_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Socket de escucha creado en el padre y heredado por los workers."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _reload_local() -> None:
+    from src.config.rules_loader import reload_rules_cache
+    try:
+        reload_rules_cache()
+    except Exception:
+        # Reglas inválidas: rules_loader ya lo registró y sigue con la generación anterior
+        pass
+
+
+def request_reload() -> None:
+    """Recarga las reglas en todos los procesos: en un worker avisa al padre; si no, recarga aquí."""
+    if _IN_WORKER:
+        os.kill(os.getppid(), signal.SIGHUP)
+    else:
+        _reload_local()
+
+
+def _after_fork_in_child() -> None:
+    global _IN_WORKER
+    from src.config.rules_loader import defer_rules_watcher, schedule_rules_reload
+    from src.storage.write_behind import start_deferred_threads
+
+    _IN_WORKER = True
+    # Las conexiones SQL del pool del padre no se comparten con los hijos
+    db = sys.modules.get("src.storage.db")
+    if db is not None:
+        db.engine.dispose(close=False)
+    # SIGHUP solo marca la recarga: hacerla en el manejador bloquearía el hilo principal y podría
+    # quedarse esperando el lock de recarga que ya tiene el propio hilo interrumpido
+    signal.signal(signal.SIGHUP, lambda *_: schedule_rules_reload())
+    start_deferred_threads()
+    defer_rules_watcher(False)
+
+
+def _uvicorn_worker(app: Any, host: str, port: int) -> Callable[[socket.socket], None]:
+    def run(sock: socket.socket) -> None:
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, lifespan="on"))
+        server.run(sockets=[sock])
+    return run
+
+
+class Supervisor:
+    """Proceso padre: hace fork de `workers` hijos que ejecutan target(sock), los reemplaza si
+    mueren y reenvía las recargas (SIGHUP) y la parada (SIGTERM/SIGINT).
+
+    Un worker que muere antes de `min_uptime` segundos cuenta como fallo de arranque: el siguiente
+    intento espera `backoff` segundos, el doble en cada fallo seguido, hasta `max_backoff`.
+    """
+
+    def __init__(self, target: Callable[[socket.socket], None], sock: socket.socket, workers: int,
+                 on_reload: Optional[Callable[[], None]] = None, stop_timeout: float = 30.0,
+                 min_uptime: float = 5.0, backoff: float = 0.5, max_backoff: float = 30.0) -> None:
+        self.target = target
+        self.sock = sock
+        self.workers = max(1, int(workers))
+        self.on_reload = on_reload
+        self.stop_timeout = stop_timeout
+        self.min_uptime = min_uptime
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.children: Dict[int, int] = {}  # pid -> número de worker
+        self._started: Dict[int, float] = {}  # número de worker -> monotonic del último arranque
+        self._failures: Dict[int, int] = {}  # número de worker -> fallos de arranque seguidos
+        self._respawn_at: Dict[int, float] = {}  # número de worker -> cuándo volver a arrancarlo
+        self._stopping = False
+        self._reload = False
+
+    def _spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                for sig in (signal.SIGTERM, signal.SIGINT):
+                    signal.signal(sig, signal.SIG_DFL)
+                _after_fork_in_child()
+                self.target(self.sock)
+            except BaseException as e:
+                if not isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    log_error_event("prefork_worker_error", worker=slot, error=str(e))
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        self._started[slot] = time.monotonic()
+        log_event("prefork_worker_started", worker=slot, pid=pid)
+        return pid
+
+    def _schedule_respawn(self, slot: int) -> float:
+        """Programa el reemplazo de un worker que terminó. Devuelve la espera en segundos."""
+        now = time.monotonic()
+        if now - self._started.get(slot, now) < self.min_uptime:
+            failures = self._failures[slot] = self._failures.get(slot, 0) + 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+            log_event("prefork_worker_respawn_delayed", worker=slot, failures=failures, delay=delay)
+        else:
+            self._failures.pop(slot, None)
+            delay = 0.0
+        self._respawn_at[slot] = now + delay
+        return delay
+
+    def _respawn_due(self) -> None:
+        now = time.monotonic()
+        for slot, due in list(self._respawn_at.items()):
+            if due <= now:
+                del self._respawn_at[slot]
+                self._spawn(slot)
+
+    def _signal(self, sig: int) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self) -> List[int]:
+        exited = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot = self.children.pop(pid, None)
+            if slot is not None:
+                exited.append(slot)
+                log_event("prefork_worker_exited", worker=slot, pid=pid, status=status)
+        return exited
+
+    def _handle_stop(self, *_: Any) -> None:
+        self._stopping = True
+
+    def _handle_hup(self, *_: Any) -> None:
+        self._reload = True
+
+    def run(self, poll_interval: float = 0.5) -> None:
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_hup)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        try:
+            while not self._stopping:
+                time.sleep(poll_interval)
+                if self._reload:
+                    self._reload = False
+                    if self.on_reload is not None:
+                        self.on_reload()
+                    self._signal(signal.SIGHUP)
+                    log_event("prefork_rules_reloaded", workers=len(self.children))
+                for slot in self._reap():
+                    if not self._stopping:
+                        self._schedule_respawn(slot)
+                if not self._stopping:
+                    self._respawn_due()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.stop_timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        self._signal(signal.SIGKILL)
+        while self.children:
+            pid, _ = os.waitpid(-1, 0)
+            self.children.pop(pid, None)
+
+
+def _cpu_count() -> int:
+    # CPUs asignadas al proceso (affinity/cpuset) si el sistema lo permite
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def serve(host: str = "0.0.0.0", port: int = 8001, workers: int = 1) -> None:
+    """Arranca la API con `workers` procesos (0 = uno por CPU)."""
+    import uvicorn
+
+    workers = workers or _cpu_count()
+    if workers <= 1:
+        uvicorn.run(APP_PATH, host=host, port=port)
+        return
+    if not can_fork():
+        # Sin fork: uvicorn lanza procesos nuevos que importan y compilan todo por su cuenta
+        uvicorn.run(APP_PATH, host=host, port=port, workers=workers)
+        return
+    from src.storage.state_backend import get_state_backend
+    if get_state_backend() is None:
+        log_event("prefork_local_state", workers=workers,
+                  detail="STATE_BACKEND=memory: rate limit, infracciones y mutes son por worker")
+    app = preload()
+    sock = listen_socket(host, port)
+
+    Supervisor(_uvicorn_worker(app, host, port), sock, workers, on_reload=_reload_local).run()
@@ -9,6 +9,18 @@ class InputMessage(BaseModel):
     text: str
     attachments: Optional[List[Any]] = None
     raw_payload: Optional[Dict[str, Any]] = None
+    # Id del mensaje en la plataforma: si llega repetido (reintento), no se procesa de nuevo
+    message_id: Optional[Union[str, int]] = None
+
+
+class MLFeedback(BaseModel):
+    group_id: Union[str, int]
+    text: str
+    # toxic | spam | normal (normal = marcar falso positivo)
+    label: str
+    # add = aprender el ejemplo, remove = deshacer un ejemplo aprendido antes
+    op: str = "add"
+    by: Optional[str] = None
 
 
 class OutputMessage(BaseModel):
@@ -30,4 +42,9 @@ class ResponseEnvelope(BaseModel):
     # automáticamente dicts que contienen campos extra (por ejemplo 'options')
     # a OutputMessage, lo que podría descartar dichos campos.
     response: Union[Dict[str, Any], OutputMessage]
-    dispatched: Optional[DispatchResult] = None
\ No newline at end of file
+    dispatched: Optional[DispatchResult] = None
+
+
+class BatchResponse(BaseModel):
+    # Una respuesta por mensaje, en el mismo orden que la petición
+    responses: List[ResponseEnvelope]
\ No newline at end of file
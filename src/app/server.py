@@ -1,17 +1,37 @@
 """API del Bot de Comunidad (FastAPI)."""
-from typing import Optional
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from src.bot_core.manager import BotManager
 from src.app.health import health_status
 from src.app.config import SEND_AUTOMATIC_RESPONSES
+from src.app.prefork import request_reload
 import os
-from src.connectors.dispatcher import enviar_respuesta
-from src.app.schemas import InputMessage, ResponseEnvelope, OutputMessage, DispatchResult
+from src.connectors.dispatcher import enviar_respuesta_async, outbound
+from src.connectors.http_client import close_async_client, http_stats
+from src.app.schemas import InputMessage, ResponseEnvelope, OutputMessage, DispatchResult, MLFeedback, BatchResponse
+from src.ml.feedback import submit_feedback
+from src.storage.repository import audit_repo
+from src.tasks.chat_queue import QueueFull, get_chat_scheduler
+from src.utils.dedup import get_update_dedup
 from src.utils.logging import log_event, log_error_event
-from src.connectors.whatsapp_connector import router as whatsapp_router
+from src.connectors.whatsapp_connector import (
+    WHATSAPP_DRAIN_TIMEOUT, router as whatsapp_router, inbound_pool as whatsapp_inbound_pool,
+)
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    # Terminar los mensajes encolados y cerrar el pool de conexiones salientes
+    await whatsapp_inbound_pool.close(timeout=WHATSAPP_DRAIN_TIMEOUT)
+    await run_in_threadpool(chat_scheduler.close)
+    await close_async_client()
+
 
-app = FastAPI(title="Comunidad Bot API")
+app = FastAPI(title="Comunidad Bot API", lifespan=lifespan)
 
 # CORS opcional (no restrictivo por defecto)
 allow_origins = os.getenv("CORS_ALLOW_ORIGINS")
@@ -42,6 +62,9 @@ def require_api_key(x_api_key: Optional[str] = Header(default=None, alias="x-api
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid API key")
     return True
 manager = BotManager()
+# Cola de entrada del proceso (compartida con los conectores): orden por chat, chats en paralelo
+# y shedding de respuestas bajo carga
+chat_scheduler = get_chat_scheduler()
 app.include_router(whatsapp_router)
 
 
@@ -50,55 +73,126 @@ def health():
     return health_status()
 
 
-@app.post("/webhook", response_model=ResponseEnvelope)
-def webhook(payload: InputMessage, _auth_ok: bool = Depends(require_api_key)):
-    """Recibe mensajes normalizados de los conectores y responde según NLU/handlers.
-    Si SEND_AUTOMATIC_RESPONSES=true, además envía la respuesta a la plataforma origen.
+# Máximo de mensajes aceptados por /webhook/batch
+WEBHOOK_BATCH_MAX = int(os.getenv("WEBHOOK_BATCH_MAX", "500"))
+
+
+def _response_obj(result_dict):
+    # Construir OutputMessage solo si el dict contiene exclusivamente
+    # los campos compatibles con OutputMessage; si tiene campos extra
+    # (ej. 'options' para encuestas), devolver el dict tal cual para
+    # preservar esos campos en la API.
+    if isinstance(result_dict, dict) and ("text" in result_dict and "type" in result_dict):
+        allowed = {"text", "type", "quick_replies", "attachments"}
+        if set(result_dict.keys()).issubset(allowed):
+            return OutputMessage(**result_dict)
+    return result_dict
+
+
+async def _build_envelope(payload: InputMessage, result_dict) -> ResponseEnvelope:
+    """Despacha la respuesta (si SEND_AUTOMATIC_RESPONSES=true) y arma el sobre de respuesta.
+    El envío es asíncrono: mientras se espera a la plataforma el worker atiende otras peticiones.
     """
-    log_event("incoming_payload", platform=payload.platform, user=str(payload.platform_user_id), group=str(payload.group_id))
-    result_dict = manager.process_message(payload.model_dump())
     if SEND_AUTOMATIC_RESPONSES:
         try:
             platform = payload.platform
-            dispatch_result = enviar_respuesta(platform, payload.model_dump(), result_dict)
+            dispatch_result = await enviar_respuesta_async(platform, payload.model_dump(), result_dict)
             log_event("dispatch_success", platform=platform, user=str(payload.platform_user_id), group=str(payload.group_id))
-            # Si result_dict no tiene los campos requeridos por OutputMessage
-            # no intentamos validarlo con Pydantic; en ese caso devolvemos
-            # directamente el dict (ResponseEnvelope acepta dicts).
-            # Construir OutputMessage solo si el dict contiene exclusivamente
-            # los campos compatibles con OutputMessage; si tiene campos extra
-            # (ej. 'options' para encuestas), devolver el dict tal cual para
-            # preservar esos campos en la API.
-            if isinstance(result_dict, dict) and ("text" in result_dict and "type" in result_dict):
-                allowed = {"text", "type", "quick_replies", "attachments"}
-                keys = set(result_dict.keys())
-                if keys.issubset(allowed):
-                    response_obj = OutputMessage(**result_dict)
-                else:
-                    response_obj = result_dict
-            else:
-                response_obj = result_dict
-            envelope = ResponseEnvelope(
-                response=response_obj,
+            return ResponseEnvelope(
+                response=_response_obj(result_dict),
                 dispatched=DispatchResult(**dispatch_result)
             )
-            return envelope
         except Exception as e:
             log_error_event("dispatch_error", error=str(e), platform=payload.platform)
-            # Si hay error al despachar, y result_dict no cumple OutputMessage,
-            # devolvemos el dict crudo para que el caller lo maneje.
-            if isinstance(result_dict, dict) and ("text" in result_dict and "type" in result_dict):
-                allowed = {"text", "type", "quick_replies", "attachments"}
-                if set(result_dict.keys()).issubset(allowed):
-                    return ResponseEnvelope(response=OutputMessage(**result_dict))
-            return ResponseEnvelope(response=result_dict)
-    # Respuesta sin dispatch (bot en modo silent): si result_dict no contiene
-    # los campos esperados por OutputMessage, devolvemos directamente el dict.
-    if isinstance(result_dict, dict) and ("text" in result_dict and "type" in result_dict):
-        allowed = {"text", "type", "quick_replies", "attachments"}
-        if set(result_dict.keys()).issubset(allowed):
-            return ResponseEnvelope(response=OutputMessage(**result_dict))
-    return ResponseEnvelope(response=result_dict)
+            # Si hay error al despachar devolvemos la respuesta sin dispatch
+            # para que el caller la maneje.
+            return ResponseEnvelope(response=_response_obj(result_dict))
+    # Respuesta sin dispatch (bot en modo silent)
+    return ResponseEnvelope(response=_response_obj(result_dict))
+
+
+@app.post("/webhook", response_model=ResponseEnvelope)
+async def webhook(payload: InputMessage, _auth_ok: bool = Depends(require_api_key)):
+    """Recibe mensajes normalizados de los conectores y responde según NLU/handlers.
+    Si SEND_AUTOMATIC_RESPONSES=true, además envía la respuesta a la plataforma origen.
+    El pipeline (CPU) corre en la cola por chat (ChatScheduler: en orden dentro de cada chat,
+    chats distintos en paralelo; 503 si la cola está llena) y el envío es asíncrono, así que una plataforma
+    lenta no bloquea al resto de chats.
+    """
+    log_event("incoming_payload", platform=payload.platform, user=str(payload.platform_user_id), group=str(payload.group_id))
+    try:
+        result_dict = await manager.process_message_async(payload.model_dump(), timeout=0)
+    except QueueFull:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Cola de entrada llena, reintenta más tarde")
+    return await _build_envelope(payload, result_dict)
+
+
+@app.post("/webhook/batch", response_model=BatchResponse)
+async def webhook_batch(payloads: List[InputMessage], _auth_ok: bool = Depends(require_api_key)):
+    """Procesa una lista de mensajes normalizados en lote (p. ej. backlog tras una caída).
+    Pasa por la misma cola por chat que /webhook (orden, backpressure y shedding; 503 si el lote
+    no cabe entero). Devuelve una respuesta por mensaje, en el mismo orden; los envíos se hacen en paralelo.
+    """
+    if len(payloads) > WEBHOOK_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Máximo {WEBHOOK_BATCH_MAX} mensajes por lote",
+        )
+    log_event("incoming_batch", size=len(payloads))
+    try:
+        results = await manager.process_batch_async([p.model_dump() for p in payloads], timeout=0)
+    except QueueFull:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Cola de entrada llena, reintenta más tarde")
+    envelopes = await asyncio.gather(*(_build_envelope(p, r) for p, r in zip(payloads, results)))
+    return BatchResponse(responses=list(envelopes))
+
+
+@app.post("/admin/ml/feedback")
+def ml_feedback(data: MLFeedback, _auth_ok: bool = Depends(require_api_key)):
+    """Corrige el modelo ML de un chat (falso positivo/negativo) sin re-entrenar ni editar rules.yaml."""
+    try:
+        result = submit_feedback(str(data.group_id), data.text, data.label, data.op, by=data.by)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OSError as e:
+        # Archivo de feedback no escribible (permisos, disco lleno): no se guardó nada
+        log_error_event("ml_feedback_error", group=str(data.group_id), error=str(e))
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="No se pudo guardar la corrección (almacenamiento de feedback no disponible)")
+    log_event("ml_feedback", group=str(data.group_id), label=data.label, op=data.op, by=data.by)
+    return result
+
+
+@app.get("/admin/audit")
+def admin_audit(
+    group_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    action: Optional[str] = None,
+    limit: int = 50,
+    _auth_ok: bool = Depends(require_api_key),
+):
+    """Historial reciente de acciones de moderación (la más reciente primero), por grupo y/o usuario."""
+    limit = max(1, min(limit, 1000))
+    return {"actions": audit_repo.recent_actions(group_id=group_id, user_id=user_id, limit=limit, action=action)}
+
+
+@app.get("/admin/metrics")
+def admin_metrics(_auth_ok: bool = Depends(require_api_key)):
+    """Métricas de envío: reutilización de conexiones por plataforma y estado de la cola de salida."""
+    return {
+        "http": http_stats(),
+        "outbound": outbound.stats(),
+        "whatsapp_inbound": whatsapp_inbound_pool.stats(),
+        "dedup": get_update_dedup().stats(),
+        "chat_queue": chat_scheduler.stats(),
+    }
+
+
+@app.post("/admin/rules/reload")
+def admin_rules_reload(_auth_ok: bool = Depends(require_api_key)):
+    """Recarga rules.yaml; en modo prefork, en todos los workers."""
+    request_reload()
+    return {"status": "reloading"}
 
 
 @app.post("/admin/reply")
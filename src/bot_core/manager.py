@@ -1,11 +1,7 @@
-import unicodedata
+from src.nlu.language_utils import fold_text
 # --- Normalización robusta para matching de intents ---
 def normalizar_texto(texto: str) -> str:
-	texto = (texto or "").strip().lower()
-	texto = " ".join(texto.split())
-	texto = unicodedata.normalize('NFD', texto)
-	texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
-	return texto
+	return fold_text(texto)
 """
 BotManager: orquesta NLU, moderación, rate limiting y dispatch a handlers.
 Contrato de entrada (payload normalizado):
@@ -19,11 +15,16 @@ Contrato de entrada (payload normalizado):
 }
 """
 
-from typing import Optional, Dict, Any
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
 
-from src.nlu.intent_detector import detectar_intencion
-from src.nlu.entity_extractor import extraer_entidades
+from src.nlu.features import MessageFeatures
 from src.utils.rate_limiter import RateLimiter
+from src.storage.state_backend import get_window_store
 from src.utils.security import sanitizar_texto
 from src.utils.validators import validar_mensaje
 from src.handlers.bienvenida import enviar_bienvenida
@@ -31,65 +32,231 @@ from src.handlers.encuesta import crear_encuesta
 from src.handlers.sorteo import realizar_sorteo
 from src.handlers.moderacion import revisar_mensaje
 from src.handlers.greeting import handle_greeting
+from src.tasks.chat_queue import get_chat_scheduler
+from src.utils.dedup import get_update_dedup
 from src.utils.logging import log_event
-from src.config.rules_loader import get_moderation_config, get_features_config
+from src.config.rules_loader import ModerationPlan, get_moderation_plan, get_features_config
+
+# LOG_STAGE_TIMINGS=true registra el coste (ms) de cada etapa del pipeline por mensaje
+_LOG_STAGE_TIMINGS = os.getenv("LOG_STAGE_TIMINGS", "false").lower() in ("1", "true", "yes")
+
+
+# Resultado para un update ya procesado (reintento de entrega)
+_DUPLICATE = {"type": "noop", "reason": "duplicate"}
+# Resultado cuando, por carga, se moderó el mensaje pero se omitió la respuesta conversacional
+_SHED = {"type": "noop", "reason": "shed"}
+
+# Pool de hilos para llamadas bloqueantes de la fachada async (run_blocking; BOT_EXECUTOR_WORKERS,
+# por defecto min(32, CPUs + 4)). Los mensajes van por el ChatScheduler.
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+	global _EXECUTOR
+	if _EXECUTOR is None:
+		with _EXECUTOR_LOCK:
+			if _EXECUTOR is None:
+				workers = int(os.getenv("BOT_EXECUTOR_WORKERS", "0") or 0) or min(32, (os.cpu_count() or 1) + 4)
+				_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-manager")
+	return _EXECUTOR
 
 
 class BotManager:
 	def __init__(self, rate_limit_max: int = 5, rate_limit_interval: int = 10):
-		self.rate_limiter = RateLimiter(rate_limit_max, rate_limit_interval)
-	def process_message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-		# 1) Sanitizar y validar
-		texto_original = payload.get("text", "")
-		texto = sanitizar_texto(texto_original)
-		usuario = str(payload.get("platform_user_id", ""))
-		grupo = str(payload.get("group_id", ""))
+		# Con STATE_BACKEND=redis el límite se comparte entre réplicas
+		self.rate_limiter = RateLimiter(rate_limit_max, rate_limit_interval, store=get_window_store("ratelimit"))
+
+	# --- Fachada async para conectores con event loop (Telegram polling, Discord) ---
+	async def run_blocking(self, func, *args, **kwargs):
+		"""Ejecuta una llamada bloqueante (recarga de YAML, feedback ML...) en el pool de hilos."""
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+	async def process_message_async(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+		"""process_message sin bloquear el event loop.
+
+		El mensaje pasa por el ChatScheduler del proceso (get_chat_scheduler): el pipeline (reglas,
+		regex, ML, NLU) corre en sus hilos, los mensajes de un mismo chat se procesan de uno en uno
+		y en orden de llegada y chats distintos avanzan en paralelo. Con la cola llena espera sitio
+		hasta `timeout` segundos (por defecto CHAT_QUEUE_WAIT_SECONDS) y después lanza QueueFull.
+		"""
+		return await get_chat_scheduler().process(payload, timeout, handler=self._scheduled)
+
+	async def process_batch_async(
+		self, payloads: List[Dict[str, Any]], timeout: Optional[float] = None, dedup: bool = True,
+	) -> List[Dict[str, Any]]:
+		"""Como process_message_async para un lote: resultados en el mismo orden que los payloads."""
+		handler = self._scheduled if dedup else self._scheduled_no_dedup
+		return await get_chat_scheduler().process_many(payloads, timeout, handler=handler)
 
+	def submit_batch(self, payloads: List[Dict[str, Any]], dedup: bool = True) -> List[Future]:
+		"""Encola el lote en el ChatScheduler sin esperar (QueueFull si no cabe entero)."""
+		handler = self._scheduled if dedup else self._scheduled_no_dedup
+		return get_chat_scheduler().submit_many(payloads, handler=handler)
+
+	def _scheduled(self, payload: Dict[str, Any], converse: bool) -> Dict[str, Any]:
+		return self.process_message(payload, converse=converse)
+
+	def _scheduled_no_dedup(self, payload: Dict[str, Any], converse: bool) -> Dict[str, Any]:
+		return self.process_message(payload, dedup=False, converse=converse)
+
+	@staticmethod
+	def analyze(payload: Dict[str, Any]) -> Optional[MessageFeatures]:
+		"""Sanitiza, valida y analiza el texto del payload. None si el mensaje es inválido."""
+		texto = sanitizar_texto(payload.get("text", ""))
 		if not validar_mensaje(texto):
-			return {"text": "Mensaje vacío o inválido.", "type": "reply"}
+			return None
+		return MessageFeatures(texto, normalizar_texto(texto))
+
+	@staticmethod
+	def is_duplicate(payload: Dict[str, Any]) -> bool:
+		"""True si el payload trae message_id y ese update ya se recibió (reintento de entrega)."""
+		mid = payload.get("message_id")
+		if mid is None or mid == "":
+			return False
+		platform = str(payload.get("platform", ""))
+		if get_update_dedup().seen(platform, payload.get("group_id"), mid):
+			log_event("duplicate_update", platform=platform, group=str(payload.get("group_id", "")), message_id=str(mid))
+			return True
+		return False
+
+	@staticmethod
+	def forget_update(payload: Dict[str, Any]) -> None:
+		"""Olvida el message_id marcado por is_duplicate (el update no se pudo procesar): el reintento
+		de la plataforma se procesará en lugar de descartarse como duplicado."""
+		mid = payload.get("message_id")
+		if mid is None or mid == "":
+			return
+		get_update_dedup().forget(str(payload.get("platform", "")), payload.get("group_id"), mid)
+
+	def process_batch(self, payloads: List[Dict[str, Any]], dedup: bool = True) -> List[Dict[str, Any]]:
+		"""Procesa varios payloads (p. ej. updates acumulados tras una caída).
 
-		# Normalizar para NLU y moderación
-		texto_norm = normalizar_texto(texto)
+		Agrupa por chat para resolver cada plan compilado una sola vez y puntuar el ML de todo
+		el chat en una sola llamada vectorizada. Los mensajes se procesan en el orden recibido
+		(rate limiting y conteo de infracciones se comportan igual que llamando a
+		process_message uno a uno) y los resultados se devuelven en ese mismo orden.
+		Los duplicados (mismo message_id) se descartan antes de analizarlos. Si el lote falla, los
+		mensajes que no llegaron a procesarse se olvidan para que el reintento los procese.
+		"""
+		duplicated = [dedup and self.is_duplicate(p) for p in payloads]
+		results: List[Dict[str, Any]] = []
+		try:
+			analyzed = [None if dup else self.analyze(p) for p, dup in zip(payloads, duplicated)]
+			by_chat: Dict[str, List[MessageFeatures]] = {}
+			for payload, features in zip(payloads, analyzed):
+				if features is not None:
+					by_chat.setdefault(str(payload.get("group_id", "")), []).append(features)
+			plans: Dict[str, ModerationPlan] = {}
+			for grupo, chat_features in by_chat.items():
+				plan = plans[grupo] = get_moderation_plan(grupo)
+				self._prescore_ml(grupo, plan, chat_features)
+			log_event("batch_processed", size=len(payloads), chats=len(by_chat))
+			for payload, features, dup in zip(payloads, analyzed, duplicated):
+				results.append(
+					dict(_DUPLICATE) if dup else
+					self.process_message(payload, features=features, plan=plans.get(str(payload.get("group_id", ""))), dedup=False)
+				)
+		except Exception:
+			if dedup:
+				for payload, dup in zip(payloads[len(results):], duplicated[len(results):]):
+					if not dup:
+						self.forget_update(payload)
+			raise
+		return results
+
+	@staticmethod
+	def _prescore_ml(grupo: str, plan: ModerationPlan, chat_features: List[MessageFeatures]) -> None:
+		ml_cfg = plan.config.get("ml", {}) or {}
+		if not plan.enabled or not bool(ml_cfg.get("enabled", False)) or len(chat_features) < 2:
+			return
+		try:
+			from src.ml.runtime import get_moderation_scorer
+			scorer = get_moderation_scorer(grupo or "global", ml_cfg, plan.ml_training_hash)
+			scores = scorer.score_tokens_batch([f.tokens for f in chat_features])
+		except Exception:
+			# Si falla, cada mensaje se puntúa individualmente en revisar_mensaje
+			return
+		for features, s in zip(chat_features, scores):
+			features.ml_scores = s
+
+	def process_message(
+		self,
+		payload: Dict[str, Any],
+		features: Optional[MessageFeatures] = None,
+		plan: Optional[ModerationPlan] = None,
+		dedup: bool = True,
+		converse: bool = True,
+	) -> Dict[str, Any]:
+		# 0) Updates repetidos (mismo message_id): no moderar ni contar infracciones dos veces.
+		# Se marca antes de procesar (dos entregas simultáneas no pasan las dos) y se olvida si falla.
+		if dedup:
+			if self.is_duplicate(payload):
+				return dict(_DUPLICATE)
+			try:
+				return self.process_message(payload, features=features, plan=plan, dedup=False, converse=converse)
+			except Exception:
+				self.forget_update(payload)
+				raise
+		# 1) Sanitizar y validar; analizar el mensaje una sola vez
+		# (texto normalizado, tokens, URLs, mayúsculas, entidades). process_batch lo pasa ya hecho.
+		usuario = str(payload.get("platform_user_id", ""))
+		grupo = str(payload.get("group_id", ""))
+		if features is None:
+			features = self.analyze(payload)
+			if features is None:
+				return {"text": "Mensaje vacío o inválido.", "type": "reply"}
 
 		# 2) Rate limiting por usuario
 		if not self.rate_limiter.allow(usuario):
 			return {"text": "Estás enviando mensajes muy rápido. Intenta más tarde.", "type": "reply"}
 
-		# 3) Moderación temprana (por chat)
-		moderacion = revisar_mensaje(texto_norm, usuario, grupo)
+		# 3) Moderación temprana (por chat). El plan compilado se resuelve una sola vez por mensaje.
+		if plan is None:
+			plan = get_moderation_plan(grupo)
+		with features.measure("moderation"):
+			moderacion = revisar_mensaje(features.normalized, usuario, grupo, plan=plan, features=features)
 		if moderacion:
+			self._log_timings(grupo, features)
 			return moderacion
+		# Con la cola sobrecargada (ChatScheduler) solo se modera: sin NLU ni respuesta
+		if not converse:
+			self._log_timings(grupo, features)
+			return dict(_SHED)
 
 		# 4) NLU: intención y entidades
-		# Usar texto sanitizado (no normalizado) para NLU por compatibilidad con palabras clave
-		intent = detectar_intencion(texto)
-		# Extraer entidades del texto sin normalizar para preservar
+		# Usar texto sanitizado (no normalizado) para NLU por compatibilidad con palabras clave.
+		# Las entidades se extraen del texto sin normalizar para preservar
 		# mayúsculas, tildes y formato original (preguntas, opciones).
-		entities = extraer_entidades(texto)
+		with features.measure("nlu"):
+			intent = features.intent
+			entities = features.entities
 		log_event("nlu_result", intent=intent, entities=entities)
+		self._log_timings(grupo, features)
 
 		# 5) Dispatch por intención
 		# Modo enforce_only: en grupos, solo moderación (no conversar)
-		cfg = get_moderation_config(grupo)
-		features = get_features_config(grupo)
+		cfg = plan.config
+		features_cfg = get_features_config(grupo)
 		enforce_only = bool(cfg.get("enforce_only", False))
 		# Determinar si el contexto es de grupo. Usar solo bandera explícita del payload.
 		# Si no viene, asumir False para mantener compatibilidad con Webchat y otros canales.
 		is_group = bool(payload.get("is_group", False))
-		if intent == "greeting" and not (enforce_only and is_group) and features.get("greeting_enabled", True):
+		if intent == "greeting" and not (enforce_only and is_group) and features_cfg.get("greeting_enabled", True):
 			nombre = entities.get("name") or usuario
 			return {
 				"text": handle_greeting(nombre),
 				"type": "reply",
 				"quick_replies": ["Ver reglas", "Participar en sorteo", "Crear encuesta"]
 			}
-		if intent == "welcome" and not (enforce_only and is_group) and features.get("welcome_enabled", True):
+		if intent == "welcome" and not (enforce_only and is_group) and features_cfg.get("welcome_enabled", True):
 			return enviar_bienvenida(usuario, grupo)
-		if intent == "survey" and not (enforce_only and is_group) and features.get("survey_enabled", True):
+		if intent == "survey" and not (enforce_only and is_group) and features_cfg.get("survey_enabled", True):
 			pregunta = entities.get("question") or "¿Cuál prefieres?"
 			opciones = entities.get("options") or ["Opción A", "Opción B"]
 			return crear_encuesta(pregunta, opciones)
-		if intent == "raffle" and not (enforce_only and is_group) and features.get("raffle_enabled", True):
+		if intent == "raffle" and not (enforce_only and is_group) and features_cfg.get("raffle_enabled", True):
 			participantes = entities.get("participants") or [usuario]
 			return realizar_sorteo(participantes)
 		# 6) Fallback
@@ -97,6 +264,11 @@ class BotManager:
 			# En grupos modo enforcement, no responder al fallback
 			return {"type": "noop"}
 		# Responder fallback solo si está habilitado
-		if features.get("fallback_enabled", True):
+		if features_cfg.get("fallback_enabled", True):
 			return {"text": "No entendí tu mensaje. Usa 'ayuda' para opciones.", "type": "reply"}
 		return {"type": "noop"}
+
+	@staticmethod
+	def _log_timings(grupo: str, features: MessageFeatures) -> None:
+		if _LOG_STAGE_TIMINGS and features.timings:
+			log_event("stage_timings", chat_id=grupo, length=features.length, ms={k: round(v, 3) for k, v in features.timings.items()})
@@ -1,61 +1,375 @@
 from __future__ import annotations
+import copy
+import hashlib
+import marshal
+import os
+import sys
 import yaml
+from dataclasses import dataclass, field, replace
+from itertools import count
 from pathlib import Path
-from threading import Lock
+from threading import Event, Lock, Thread
 from time import monotonic
-from functools import lru_cache
-from typing import Any, Dict, Optional
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Mapping, Optional, Tuple
+
+from src.utils.aho_corasick import AhoCorasickMatcher
+from src.utils.logging import log_event, log_error_event
+from src.utils.regex_set import RegexSet
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]  # .../Comunidad
 RULES_FILE = PROJECT_ROOT / "config" / "rules.yaml"
 
-# Hot-reload ligero sin dependencias: se verifica el mtime del archivo y, si cambia,
-# se limpia el caché LRU automáticamente. Se limita la frecuencia de chequeo para rendimiento.
-_RULES_LAST_MTIME_NS: Optional[int] = None
-_RULES_LAST_CHECK_TS: float = 0.0
+# Hot-reload por generaciones: las reglas se leen, validan y compilan fuera del camino de los
+# mensajes (hilo RulesWatcher) y se publican de golpe como una nueva RulesGeneration. Los
+# lectores toman la generación vigente una vez por llamada, así que nunca ven un estado a medias;
+# si el YAML nuevo no es válido se sigue usando la generación anterior.
+# RULES_WATCH=false desactiva el watcher: entonces se comprueba el mtime desde el camino de
+# lectura como mucho una vez por segundo (comportamiento anterior).
 _RULES_CHECK_INTERVAL_SEC: float = 1.0  # evita stat() en cada llamada
+_RULES_LAST_CHECK_TS: float = 0.0
 _RULES_RELOAD_LOCK: Lock = Lock()
+_CURRENT: Optional["RulesGeneration"] = None
+_GENERATION_COUNTER = count(1)
+# Firma del último archivo inválido: no se reintenta (ni se vuelve a registrar) hasta que cambie
+_FAILED_SIGNATURE: Optional[Tuple[int, int, int]] = None
+_WATCHER: Optional["RulesWatcher"] = None
+# Modo prefork: el padre no arranca el watcher antes del fork; cada worker arranca el suyo
+_WATCH_DEFERRED = False
+# Recarga completa pedida con schedule_rules_reload() (SIGHUP en los workers)
+_RELOAD_REQUESTED = False
+
+
+class RulesError(ValueError):
+    """rules.yaml no es válido; se mantiene la generación de reglas anterior."""
+
+
+class RulesGeneration:
+    """Una versión de rules.yaml ya leída y compilada. No se modifica una vez publicada."""
+
+    __slots__ = ("number", "data", "signature", "merged", "plans")
+
+    def __init__(self, number: int, data: Dict[str, Any], signature: Optional[Tuple[int, int, int]]) -> None:
+        self.number = number
+        self.data = data
+        self.signature = signature
+        self.merged: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.plans: Dict[str, "ModerationPlan"] = {}
+
+    def resolve(self, key: str) -> str:
+        # Los chats sin override usan exactamente las reglas (y el plan) de default
+        return key if key in self.data else "default"
+
+
+def _file_signature(path: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+# Loader de PyYAML en C (libyaml) si está disponible: varias veces más rápido que el de Python
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Snapshot compilado: reglas ya validadas y configs efectivas (default + override) de cada chat,
+# serializadas con marshal y ligadas al hash del contenido del YAML. Arrancar o recargar con el
+# mismo archivo no vuelve a parsearlo. RULES_SNAPSHOT=false lo desactiva; RULES_SNAPSHOT_DIR
+# cambia dónde se guarda. Por defecto va a data/ (escribible), no junto al YAML: en Kubernetes
+# la carpeta de config suele ser un ConfigMap de solo lectura.
+_SNAPSHOT_FORMAT = 1
+SNAPSHOT_DIR = PROJECT_ROOT / "data"
+
+
+def _snapshot_path(path: Path) -> Optional[Path]:
+    if os.getenv("RULES_SNAPSHOT", "true").strip().lower() in ("0", "false", "no"):
+        return None
+    folder = os.getenv("RULES_SNAPSHOT_DIR", "").strip()
+    return (Path(folder) if folder else SNAPSHOT_DIR) / f".{path.name}.snapshot"
+
+
+def _snapshot_key(raw: bytes) -> Tuple[int, Tuple[int, int], str]:
+    # marshal depende de la versión de Python: va en la clave junto al formato y el hash
+    return (_SNAPSHOT_FORMAT, tuple(sys.version_info[:2]), hashlib.blake2b(raw, digest_size=20).hexdigest())
+
+
+def _load_snapshot(snapshot: Path, key: Tuple[Any, ...]) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    try:
+        stored = marshal.loads(snapshot.read_bytes())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_error_event("rules_snapshot_invalid", file=str(snapshot), error=str(e))
+        return None
+    if not isinstance(stored, tuple) or len(stored) != 3 or stored[0] != key:
+        return None
+    return stored[1], stored[2]
+
+
+def _write_snapshot(snapshot: Path, key: Tuple[Any, ...], data: Dict[str, Any], merged: Dict[str, Any]) -> None:
+    try:
+        blob = marshal.dumps((key, data, merged))
+    except ValueError:
+        # Tipos que marshal no admite (p. ej. fechas de YAML): se parsea en cada arranque
+        return
+    tmp = snapshot.with_name(f"{snapshot.name}.{os.getpid()}.tmp")
+    try:
+        snapshot.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(blob)
+        os.replace(tmp, snapshot)
+    except OSError as e:
+        log_error_event("rules_snapshot_write_failed", file=str(snapshot), error=str(e))
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+
+
+def _parse_rules(raw: bytes, name: str) -> Dict[str, Any]:
+    data = yaml.load(raw, Loader=_YAML_LOADER) or {}
+    if not isinstance(data, dict):
+        raise RulesError(f"{name}: se esperaba un mapa de chats, no {type(data).__name__}")
+    # Normalizar claves de primer nivel a str (para soportar chat_id numérico sin comillas)
+    data = {str(k): v for k, v in data.items()}
+    for key, rules in data.items():
+        if rules is not None and not isinstance(rules, dict):
+            raise RulesError(f"{name}: las reglas de '{key}' deben ser un mapa")
+    return data
+
+
+def _read_rules(path: Path) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(reglas por chat, configs efectivas por chat) de rules.yaml, desde el snapshot si está vigente."""
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return {}, {"default": None}
+    snapshot = _snapshot_path(path)
+    key = _snapshot_key(raw)
+    if snapshot is not None:
+        cached = _load_snapshot(snapshot, key)
+        if cached is not None:
+            return cached
+    data = _parse_rules(raw, path.name)
+    merged = {k: _merge_chat_rules(data, k) for k in dict.fromkeys(["default", *data.keys()])}
+    if snapshot is not None:
+        _write_snapshot(snapshot, key, data, merged)
+    return data, merged
+
+
+def _compile_generation(data: Dict[str, Any], merged: Dict[str, Any], signature: Optional[Tuple[int, int, int]],
+                        previous: Optional[RulesGeneration] = None) -> RulesGeneration:
+    """Construye y compila todos los planes de una generación (sin publicarla).
+    Los chats cuya config efectiva no cambió reutilizan el plan ya compilado de `previous`.
+    """
+    gen = RulesGeneration(next(_GENERATION_COUNTER), data, signature)
+    for key, rules in merged.items():
+        gen.merged[key] = rules
+        old = previous.plans.get(key) if previous is not None else None
+        if old is not None and previous.merged.get(key) == rules:
+            gen.plans[key] = replace(old, generation=gen.number)
+        else:
+            gen.plans[key] = _build_moderation_plan(key, rules or {}, gen.number)
+    return gen
+
+
+def reload_rules_cache() -> int:
+    """Lee, valida y compila rules.yaml y publica la nueva generación. Devuelve su número.
+    Si el archivo no es válido lanza RulesError (o el error de YAML) y deja la generación anterior.
+    """
+    global _CURRENT, _FAILED_SIGNATURE
+    path = RULES_FILE
+    with _RULES_RELOAD_LOCK:
+        signature = _file_signature(path)
+        if signature is None and _CURRENT is not None and _CURRENT.signature is not None:
+            # Borrado o renombrado a medias: no quedarse sin reglas
+            raise RulesError(f"{path.name} no existe")
+        try:
+            data, merged = _read_rules(path)
+            gen = _compile_generation(data, merged, signature, previous=_CURRENT)
+        except Exception as e:
+            _FAILED_SIGNATURE = signature
+            log_error_event("rules_reload_failed", file=str(path), error=str(e),
+                            generation=_CURRENT.number if _CURRENT is not None else None)
+            raise
+        _FAILED_SIGNATURE = None
+        _CURRENT = gen
+    log_event("rules_reloaded", generation=gen.number, chats=len(gen.data))
+    return gen.number
+
+
+def _reload_if_changed() -> None:
+    """Recarga si el archivo cambió respecto a la generación vigente (errores: se registran)."""
+    signature = _file_signature(RULES_FILE)
+    current = _CURRENT
+    if current is not None and signature == current.signature:
+        return
+    if signature is not None and signature == _FAILED_SIGNATURE:
+        return
+    try:
+        reload_rules_cache()
+    except Exception:
+        pass
+
+
+def _reload_pending() -> None:
+    """Recarga completa si se pidió con schedule_rules_reload(); si no, solo si el archivo cambió."""
+    global _RELOAD_REQUESTED
+    if not _RELOAD_REQUESTED:
+        _reload_if_changed()
+        return
+    _RELOAD_REQUESTED = False
+    try:
+        reload_rules_cache()
+    except Exception:
+        pass
+
+
+def schedule_rules_reload() -> None:
+    """Pide una recarga completa sin hacerla aquí: la hace el hilo watcher o, sin watcher, la
+    siguiente lectura de reglas. Segura desde un manejador de señales (no toma el lock de recarga).
+    """
+    global _RELOAD_REQUESTED
+    _RELOAD_REQUESTED = True
+    watcher = _WATCHER
+    if watcher is not None:
+        watcher.wake()
+
+
+class RulesWatcher:
+    """Hilo que recarga rules.yaml al cambiar: eventos del sistema de archivos con `watchdog`
+    (inotify en Linux) si está instalado; si no, comprobando stat() cada `interval` segundos."""
+
+    def __init__(self, path: Path, interval: float = 1.0, debounce: float = 0.2) -> None:
+        self.path = path
+        self.interval = interval
+        self.debounce = debounce
+        self._changed = Event()
+        self._stop = Event()
+        self._observer = None
+        self._thread = Thread(target=self._run, name="rules-watcher", daemon=True)
+
+    def _start_observer(self) -> bool:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except Exception:  # pragma: no cover - dependencia opcional
+            return False
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Los editores suelen escribir un temporal y renombrarlo: se mira también el destino
+                paths = (getattr(event, "src_path", ""), getattr(event, "dest_path", ""))
+                if any(p and Path(p).name == watcher.path.name for p in paths):
+                    watcher._changed.set()
+
+        try:
+            observer = Observer()
+            observer.schedule(_Handler(), str(self.path.parent), recursive=False)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            log_error_event("rules_watcher_error", error=str(e))
+            return False
+        self._observer = observer
+        return True
+
+    def start(self) -> "RulesWatcher":
+        # Con eventos, el sondeo queda como red de seguridad poco frecuente
+        if self._start_observer():
+            self.interval = max(self.interval, 30.0)
+        self._thread.start()
+        return self
+
+    @property
+    def mode(self) -> str:
+        return "events" if self._observer is not None else "polling"
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._changed.wait(self.interval):
+                # Agrupar las escrituras de un mismo guardado
+                self._stop.wait(self.debounce)
+                self._changed.clear()
+            if not self._stop.is_set():
+                _reload_pending()
+
+    def wake(self) -> None:
+        self._changed.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._changed.set()
+        if self._observer is not None:
+            self._observer.stop()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+
+def _watch_enabled() -> bool:
+    return os.getenv("RULES_WATCH", "true").strip().lower() not in ("0", "false", "no")
+
+
+def start_rules_watcher() -> Optional[RulesWatcher]:
+    """Arranca (una vez por proceso) el watcher de rules.yaml; None si RULES_WATCH=false o si
+    está aplazado con defer_rules_watcher()."""
+    global _WATCHER
+    if _WATCHER is None and not _WATCH_DEFERRED and _watch_enabled():
+        _WATCHER = RulesWatcher(RULES_FILE, _RULES_CHECK_INTERVAL_SEC).start()
+    return _WATCHER
+
+
+def defer_rules_watcher(deferred: bool = True) -> None:
+    """Aplaza el arranque del watcher (padre del modo prefork: sin hilos antes del fork, porque un
+    lock tomado por otro hilo quedaría bloqueado en los hijos). Con False se arranca ya."""
+    global _WATCH_DEFERRED
+    _WATCH_DEFERRED = deferred
+    if not deferred:
+        start_rules_watcher()
 
 
 def _maybe_reload_rules_if_changed() -> None:
-    global _RULES_LAST_MTIME_NS, _RULES_LAST_CHECK_TS
+    # Sin watcher: comprobar el mtime desde el camino de lectura, como mucho una vez por segundo
+    global _RULES_LAST_CHECK_TS
     now = monotonic()
-    if (now - _RULES_LAST_CHECK_TS) < _RULES_CHECK_INTERVAL_SEC:
+    if (now - _RULES_LAST_CHECK_TS) < _RULES_CHECK_INTERVAL_SEC and not _RELOAD_REQUESTED:
         return
     _RULES_LAST_CHECK_TS = now
-    try:
-        mtime_ns = RULES_FILE.stat().st_mtime_ns
-    except FileNotFoundError:
-        mtime_ns = None
-    # Si hay cambio respecto al último visto, limpiar caché bajo lock
-    if mtime_ns != _RULES_LAST_MTIME_NS:
+    _reload_pending()
+
+
+def _current() -> RulesGeneration:
+    """Generación vigente. La primera llamada carga las reglas y arranca el watcher."""
+    gen = _CURRENT
+    if gen is None:
         with _RULES_RELOAD_LOCK:
-            # revalidar dentro del lock
+            gen = _CURRENT
+        if gen is None:
             try:
-                current_ns = RULES_FILE.stat().st_mtime_ns
-            except FileNotFoundError:
-                current_ns = None
-            if current_ns != _RULES_LAST_MTIME_NS:
                 reload_rules_cache()
-                _RULES_LAST_MTIME_NS = current_ns
+            except Exception:
+                if _CURRENT is None:
+                    raise
+            gen = _CURRENT
+        start_rules_watcher()
+    elif _WATCHER is None:
+        _maybe_reload_rules_if_changed()
+        gen = _CURRENT
+    return gen
 
 
-@lru_cache(maxsize=1)
 def _load_rules() -> Dict[str, Any]:
-    if not RULES_FILE.exists():
-        return {}
-    with open(RULES_FILE, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f) or {}
-    # Normalizar claves de primer nivel a str (para soportar chat_id numérico sin comillas)
-    try:
-        data = {str(k): v for k, v in data.items()}
-    except Exception:
-        pass
-    return data
+    """Reglas de la generación vigente ({str(chat_id): reglas}). No mutar."""
+    return _current().data
+
 
+def get_rules_generation() -> int:
+    """Número de generación de las reglas cargadas (cambia en cada recarga)."""
+    return _current().number
 
-def reload_rules_cache() -> None:
-    _load_rules.cache_clear()  # type: ignore[attr-defined]
+
+def _rules_key(chat_id: Optional[int | str]) -> str:
+    return str(chat_id) if chat_id is not None else "default"
 
 
 def _deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
@@ -77,10 +391,14 @@ def _deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any
 
 
 def get_chat_rules(chat_id: Optional[int | str]) -> Optional[Dict[str, Any]]:
-    # Hot-reload: antes de leer, validar si el YAML cambió y limpiar caché si corresponde
-    _maybe_reload_rules_if_changed()
-    data = _load_rules()
-    key = str(chat_id) if chat_id is not None else "default"
+    """Reglas efectivas de un chat (default + override) de la generación vigente.
+    El resultado es compartido: los llamadores no deben mutarlo.
+    """
+    gen = _current()
+    return gen.merged[gen.resolve(_rules_key(chat_id))]
+
+
+def _merge_chat_rules(data: Dict[str, Any], key: str) -> Optional[Dict[str, Any]]:
     # Herencia: default -> override (deep merge). Si no hay override, usar default.
     default_rules = data.get("default") or {}
     override_rules = data.get(key)
@@ -121,7 +439,12 @@ def get_survey_config(chat_id: Optional[int | str]) -> Dict[str, Any]:
 
 
 def get_moderation_config(chat_id: Optional[int | str]) -> Dict[str, Any]:
-    rules = get_chat_rules(chat_id) or {}
+    """Copia editable (profunda) del config del chat. Para solo leer, en caminos calientes, usar
+    get_moderation_plan(chat_id).config: es el mismo config, de solo lectura y sin copiar."""
+    return copy.deepcopy(dict(get_moderation_plan(chat_id).config))
+
+
+def _build_moderation_config(rules: Dict[str, Any]) -> Dict[str, Any]:
     mod = rules.get("moderation", {}) or {}
     # Defaults
     return {
@@ -135,6 +458,8 @@ def get_moderation_config(chat_id: Optional[int | str]) -> Dict[str, Any]:
         },
         "mute_duration_seconds": int(mod.get("mute_duration_seconds", 600)),
         "banned_words": list(mod.get("banned_words", ["spam", "oferta", "prohibido"])),
+        # Si true, banned_words/learning solo coinciden como palabra completa (no como subcadena)
+        "banned_words_whole_word": bool(mod.get("banned_words_whole_word", False)),
         "delete_message_on_violation": bool(mod.get("delete_message_on_violation", True)),
         # Si true, en grupos el bot solo actúa ante violaciones (no responde saludos ni conversa)
         # Permitir configurarlo también a nivel superior (compatibilidad y simplicidad en rules.yaml)
@@ -212,6 +537,97 @@ def get_moderation_config(chat_id: Optional[int | str]) -> Dict[str, Any]:
     }
 
 
+@dataclass(frozen=True)
+class ModerationPlan:
+    """Configuración de moderación compilada e inmutable para un chat.
+    Se construye una vez por generación de reglas y se reutiliza en cada mensaje:
+    palabras ya normalizadas, regex ya compiladas, umbrales y plantillas de texto.
+    """
+    chat_key: str
+    generation: int
+    config: Mapping[str, Any]
+    enabled: bool
+    thresholds: Mapping[str, int]
+    banned_words: Tuple[str, ...]
+    word_matcher: AhoCorasickMatcher
+    regex_set: RegexSet
+    whitelist_users: FrozenSet[str]
+    link_whitelist: Tuple[str, ...]
+    templates: Mapping[str, Optional[str]] = field(default_factory=dict)
+    # Hash del set de entrenamiento ML (None si ML está desactivado en el chat)
+    ml_training_hash: Optional[str] = None
+
+    def action_for_count(self, count: int) -> str:
+        """Acción escalada según el número de infracciones acumuladas."""
+        th = self.thresholds
+        if count >= th.get("ban", 4):
+            return "ban"
+        if count >= th.get("kick", 3):
+            return "kick"
+        if count >= th.get("mute", 2):
+            return "mute"
+        return "warn"
+
+
+def _normalized_words(*groups: Any) -> Tuple[str, ...]:
+    # Minúsculas, sin vacíos (evita matches universales) y sin duplicados, preservando orden
+    seen: Dict[str, None] = {}
+    for group in groups:
+        for w in group or []:
+            txt = str(w).strip()
+            if txt:
+                seen.setdefault(str(w).lower(), None)
+    return tuple(seen)
+
+
+def _build_moderation_plan(key: str, rules: Dict[str, Any], generation: int) -> ModerationPlan:
+    cfg = _build_moderation_config(rules)
+    learning = cfg.get("learning", {}) or {}
+    banned_words = _normalized_words(
+        cfg.get("banned_words"), learning.get("toxic_words"), learning.get("spam_words")
+    )
+    ml_cfg = cfg.get("ml", {}) or {}
+    ml_hash: Optional[str] = None
+    if bool(ml_cfg.get("enabled", False)):
+        # Import diferido: solo los chats con ML pagan la carga del runtime
+        from src.ml.runtime import training_hash
+        ml_hash = training_hash(ml_cfg)
+    return ModerationPlan(
+        chat_key=key,
+        generation=generation,
+        config=MappingProxyType(cfg),
+        enabled=bool(cfg.get("enabled", True)),
+        thresholds=MappingProxyType(dict(cfg["thresholds"])),
+        banned_words=banned_words,
+        word_matcher=AhoCorasickMatcher(banned_words, whole_word=bool(cfg.get("banned_words_whole_word", False))),
+        # Patrones inválidos o demasiado largos se registran y se omiten (no rompen el chat completo)
+        regex_set=RegexSet(cfg.get("regex_patterns") or [], name=key),
+        whitelist_users=frozenset(str(u) for u in cfg.get("whitelist_users", []) or []),
+        link_whitelist=tuple(str(d).lower() for d in cfg.get("link_whitelist", []) or []),
+        templates=MappingProxyType({
+            "warn": cfg.get("warn_message"),
+            "mute": cfg.get("mute_message"),
+            "kick": cfg.get("kick_message"),
+            "ban": cfg.get("ban_message"),
+            "muted_notice": cfg.get("muted_notice"),
+            "soft_mute_notice": cfg.get("soft_mute_notice"),
+        }),
+        ml_training_hash=ml_hash,
+    )
+
+
+def get_moderation_plan(chat_id: Optional[int | str]) -> ModerationPlan:
+    """Plan de moderación compilado del chat (compilado al cargar la generación de reglas)."""
+    gen = _current()
+    return gen.plans[gen.resolve(_rules_key(chat_id))]
+
+
+def warm_moderation_plans() -> Tuple[ModerationPlan, ...]:
+    """Compila por adelantado los planes de moderación de `default` y de cada chat de rules.yaml
+    (p. ej. en el proceso padre antes de hacer fork de los workers)."""
+    return tuple(_current().plans.values())
+
+
 def get_saas_config(chat_id: Optional[int | str]) -> Dict[str, Any]:
     rules = get_chat_rules(chat_id) or {}
     s = rules.get("saas", {}) or {}
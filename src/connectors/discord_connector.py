@@ -42,8 +42,9 @@ import logging
 import discord  # type: ignore
 
 from src.bot_core.manager import BotManager
-from src.config.rules_loader import get_welcome_config, get_moderation_config, get_saas_config, get_features_config
+from src.config.rules_loader import get_welcome_config, get_moderation_plan, get_saas_config, get_features_config
 from src.storage.repository import audit_repo  # registrar acciones
+from src.ml.feedback import FEEDBACK_LABELS, submit_feedback  # feedback ML de admins
 
 
 logger = logging.getLogger("discord_connector")
@@ -165,8 +166,8 @@ async def apply_moderation_action(message: discord.Message, action: dict):
             mute_msg = action.get("text")
             if not mute_msg:
                 # Intentar obtener la plantilla desde rules.yaml
-                from src.config.rules_loader import get_moderation_config
-                cfg = get_moderation_config(str(message.guild.id))
+                from src.config.rules_loader import get_moderation_plan
+                cfg = get_moderation_plan(str(message.guild.id)).config
                 mute_msg = cfg.get("mute_message", "Usuario silenciado por {minutes} min.")
                 mute_msg = mute_msg.replace("{user}", f"@{member.display_name}")
                 mute_msg = mute_msg.replace("{minutes}", str(dur // 60)).replace("{seconds}", str(dur))
@@ -283,7 +284,7 @@ async def apply_moderation_action(message: discord.Message, action: dict):
         # Notificación a canal de admins si está habilitado
         try:
             if message.guild:
-                cfg = get_moderation_config(str(message.guild.id))
+                cfg = get_moderation_plan(str(message.guild.id)).config
                 if cfg.get("admin_notify", False):
                     dest_id = cfg.get("admin_notify_channel_id")
                     dest_channel = message.guild.get_channel(int(dest_id)) if dest_id else message.channel
@@ -440,6 +441,32 @@ class DiscordBotClient(discord.Client):
                 await message.channel.send(f"[MOD] Error: {e}")
                 return
 
+        # Feedback ML (admins): responder a un mensaje con /learn <toxic|spam|normal> o /unlearn <label>
+        if cmd in ("/learn", "!learn", "/unlearn", "!unlearn"):
+            if not isinstance(message.author, discord.Member) or not _is_admin(message.author):
+                await message.channel.send("Solo administradores pueden entrenar el modelo.")
+                return
+            parts = content.split()
+            label = parts[1].lower() if len(parts) > 1 else ""
+            ref = message.reference.resolved if message.reference else None
+            texto = getattr(ref, "content", "") or ""
+            if not texto or label not in FEEDBACK_LABELS:
+                await message.channel.send(f"Uso: responde a un mensaje con {cmd} <{'|'.join(FEEDBACK_LABELS)}>")
+                return
+            op = "remove" if "unlearn" in cmd else "add"
+            try:
+                result = await self.manager.run_blocking(submit_feedback, _get_group_id(message), texto, label, op, by=str(message.author.id))
+                if not result.get("ml_enabled"):
+                    estado = "guardado (ML desactivado en este servidor)"
+                elif result.get("applied"):
+                    estado = "aplicado al modelo"
+                else:
+                    estado = "guardado, sin cambios en el modelo"
+                await message.channel.send(f"{'Aprendido' if op == 'add' else 'Olvidado'} como '{label}': {estado}.")
+            except Exception as e:
+                await message.channel.send(f"[ML] No se pudo registrar el feedback: {e}")
+            return
+
         # Comando para mostrar reglas en Discord (simple): /reglas, !reglas o 'reglas'
         if content.strip().lower() in ("/reglas", "!reglas", "reglas"):
             try:
@@ -471,9 +498,11 @@ class DiscordBotClient(discord.Client):
             "attachments": [att.url for att in getattr(message, "attachments", [])] or None,
             "raw_payload": None,
             "is_group": bool(message.guild),
+            "message_id": str(message.id),
         }
 
-        resp = self.manager.process_message(payload)
+        # El pipeline corre en la cola por chat (ChatScheduler): un chat lento no frena al resto de servidores
+        resp = await self.manager.process_message_async(payload)
 
         # Noop: no responder
         if not resp:
@@ -485,7 +514,7 @@ class DiscordBotClient(discord.Client):
             # Respetar enforce_only en servidores: no enviar replies conversacionales
             try:
                 if message.guild:
-                    cfg = get_moderation_config(str(message.guild.id))
+                    cfg = get_moderation_plan(str(message.guild.id)).config
                     if bool(cfg.get("enforce_only", False)):
                         logger.info("[discord] Respuesta suprimida por enforce_only en guild")
                         return
@@ -1,9 +1,25 @@
-"""Dispatcher de salida: envia respuestas a la plataforma adecuada."""
-from typing import Dict, Any
+"""Dispatcher de salida: envia respuestas a la plataforma adecuada.
 
-from src.connectors.telegram_connector import enviar_mensaje_telegram
-from src.connectors.whatsapp_connector import enviar_mensaje_whatsapp
+enviar_respuesta_async pasa por una cola de salida (OutboundDispatcher) que respeta los límites
+de cada plataforma en lugar de enviar en el acto:
+
+- Token buckets global y por chat (Telegram: ~30 msg/s en total y ~20 msg/min por grupo).
+- Prioridad: las acciones de moderación salen antes que las respuestas conversacionales.
+- Coalescing: varias respuestas pendientes para el mismo chat se envían como un único mensaje.
+- Un 429 pausa el chat (o toda la plataforma, según la plataforma) durante el `retry_after` indicado.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.connectors.telegram_connector import enviar_mensaje_telegram, enviar_mensaje_telegram_async
+from src.connectors.whatsapp_connector import enviar_mensaje_whatsapp, enviar_mensaje_whatsapp_async
 from src.connectors.webchat_connector import enviar_mensaje_webchat
+from src.utils.logging import log_event
+from src.utils.sliding_window import TokenBucket
 
 
 def enviar_respuesta(platform: str, payload_entrada: Dict[str, Any], respuesta: Dict[str, Any]) -> Dict[str, Any]:
@@ -20,3 +36,201 @@ def enviar_respuesta(platform: str, payload_entrada: Dict[str, Any], respuesta:
         return {"platform": platform, "result": enviar_mensaje_webchat(str(uid or ""), text)}
 
     return {"platform": platform, "sent": False, "reason": "Plataforma no soportada"}
+
+
+PRIORITY_MODERATION = 0
+PRIORITY_REPLY = 1
+
+# Límites por plataforma. rate/burst en mensajes por segundo; rate_limit_scope indica qué pausa un 429.
+PLATFORM_LIMITS: Dict[str, Dict[str, Any]] = {
+    "telegram": {"global_rate": 30.0, "global_burst": 30, "chat_rate": 20 / 60, "chat_burst": 20, "rate_limit_scope": "chat", "max_len": 4096},
+    "whatsapp": {"global_rate": 80.0, "global_burst": 80, "chat_rate": 1 / 6, "chat_burst": 5, "rate_limit_scope": "global", "max_len": 4096},
+}
+# Reintentos tras un 429 antes de devolver el error al llamador
+_MAX_RATE_LIMITED = 3
+
+
+class _Outgoing:
+    __slots__ = ("chat", "priority", "seq", "texts", "size", "send", "futures", "rate_limited")
+
+    def __init__(self, chat: str, priority: int, seq: int, text: str, send) -> None:
+        self.chat = chat
+        self.priority = priority
+        self.seq = seq
+        self.texts = [text]
+        self.size = len(text)
+        self.send = send
+        self.futures: List[asyncio.Future] = []
+        self.rate_limited = 0
+
+
+class _PlatformQueue:
+    """Cola de una plataforma: heap de listos (prioridad, orden) + heap de diferidos (hasta cuándo)."""
+
+    def __init__(self, name: str, limits: Dict[str, Any]) -> None:
+        self.name = name
+        self.limits = limits
+        self.global_bucket = TokenBucket(limits["global_rate"], limits["global_burst"], max_keys=1)
+        self.chat_bucket = TokenBucket(limits["chat_rate"], limits["chat_burst"])
+        self.ready: List[Tuple[int, int, _Outgoing]] = []
+        self.deferred: List[Tuple[float, int, int, _Outgoing]] = []
+        self.open: Dict[Tuple[str, int], _Outgoing] = {}
+        self.chat_paused: Dict[str, float] = {}
+        self.global_paused = 0.0
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.ready) + len(self.deferred)
+
+
+class OutboundDispatcher:
+    """Cola de envíos salientes con rate shaping por plataforma (ver docstring del módulo).
+
+    submit() devuelve un Future con el resultado del envío (compartido si el mensaje se fusionó
+    con otros). Un worker asyncio por plataforma vacía la cola.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, Any]]] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.limits = limits or PLATFORM_LIMITS
+        self._clock = clock
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: Dict[str, _PlatformQueue] = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    def handles(self, platform: str) -> bool:
+        return platform in self.limits
+
+    def _queue(self, platform: str) -> _PlatformQueue:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Primer uso o nuevo event loop (p. ej. tests): las colas no sobreviven entre loops
+            self._loop = loop
+            self._queues = {}
+        q = self._queues.get(platform)
+        if q is None:
+            q = self._queues[platform] = _PlatformQueue(platform, self.limits[platform])
+        if q.task is None or q.task.done():
+            q.task = loop.create_task(self._worker(q))
+        return q
+
+    def submit(self, platform: str, chat: str, text: str, send: Callable[[str], Awaitable[Dict[str, Any]]],
+               priority: int = PRIORITY_REPLY) -> "asyncio.Future[Dict[str, Any]]":
+        """Encola `text` para `chat`; send(texto) hace el envío real y devuelve el dict de resultado."""
+        q = self._queue(platform)
+        fut = asyncio.get_running_loop().create_future()
+        item = q.open.get((chat, priority))
+        if item is not None and item.size + 2 + len(text) <= q.limits["max_len"]:
+            item.texts.append(text)
+            item.size += 2 + len(text)
+            item.send = send
+            self.coalesced += 1
+        else:
+            item = _Outgoing(chat, priority, next(self._seq), text, send)
+            q.open[(chat, priority)] = item
+            heapq.heappush(q.ready, (priority, item.seq, item))
+            q.wake.set()
+        item.futures.append(fut)
+        return fut
+
+    def _wait_for(self, q: _PlatformQueue, item: _Outgoing, now: float) -> float:
+        return max(q.chat_bucket.wait_time(item.chat, now=now), q.chat_paused.get(item.chat, 0.0) - now)
+
+    def _next(self, q: _PlatformQueue, now: float) -> Tuple[Optional[_Outgoing], Optional[float]]:
+        """Siguiente mensaje enviable, o (None, segundos hasta el próximo diferido)."""
+        while q.deferred and q.deferred[0][0] <= now:
+            _, priority, seq, item = heapq.heappop(q.deferred)
+            heapq.heappush(q.ready, (priority, seq, item))
+        while q.ready:
+            priority, seq, item = heapq.heappop(q.ready)
+            wait = self._wait_for(q, item, now)
+            if wait <= 0:
+                return item, None
+            heapq.heappush(q.deferred, (now + wait, priority, seq, item))
+        return None, (q.deferred[0][0] - now if q.deferred else None)
+
+    async def _worker(self, q: _PlatformQueue) -> None:
+        while True:
+            now = self._clock()
+            item, wait = self._next(q, now)
+            if item is None:
+                q.wake.clear()
+                try:
+                    await asyncio.wait_for(q.wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Límite global de la plataforma (y pausa global tras un 429)
+            gwait = max(q.global_bucket.wait_time("*", now=now), q.global_paused - now)
+            if gwait > 0:
+                await asyncio.sleep(gwait)
+                now = self._clock()
+            q.global_bucket.allow("*", now=now)
+            q.chat_bucket.allow(item.chat, now=now)
+            if q.open.get((item.chat, item.priority)) is item:
+                del q.open[(item.chat, item.priority)]
+            try:
+                result = await item.send("\n\n".join(item.texts))
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            retry_after = result.get("retry_after") if isinstance(result, dict) else None
+            if retry_after is not None and item.rate_limited < _MAX_RATE_LIMITED:
+                item.rate_limited += 1
+                self.rate_limited += 1
+                until = self._clock() + float(retry_after)
+                if q.limits["rate_limit_scope"] == "global":
+                    q.global_paused = max(q.global_paused, until)
+                else:
+                    q.chat_paused[item.chat] = max(q.chat_paused.get(item.chat, 0.0), until)
+                log_event("outbound_rate_limited", platform=q.name, chat=item.chat, retry_after=retry_after)
+                heapq.heappush(q.deferred, (until, item.priority, item.seq, item))
+                continue
+            q.chat_paused.pop(item.chat, None)
+            self.sent += 1
+            for fut in item.futures:
+                if not fut.done():
+                    fut.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": {name: len(q) for name, q in self._queues.items()},
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+        }
+
+
+outbound = OutboundDispatcher()
+# Segundos que el webhook espera el resultado del envío antes de responder "queued"
+OUTBOUND_WAIT_SECONDS = float(os.getenv("OUTBOUND_WAIT_SECONDS", "10"))
+
+
+async def enviar_respuesta_async(platform: str, payload_entrada: Dict[str, Any], respuesta: Dict[str, Any]) -> Dict[str, Any]:
+    """Como enviar_respuesta, pero sin bloquear el event loop y pasando por la cola de salida."""
+    text = respuesta.get("text", "")
+
+    if platform == "webchat":
+        uid = payload_entrada.get("platform_user_id")
+        return {"platform": platform, "result": enviar_mensaje_webchat(str(uid or ""), text)}
+    if not outbound.handles(platform):
+        return {"platform": platform, "sent": False, "reason": "Plataforma no soportada"}
+    if not text:
+        return {"platform": platform, "sent": False, "reason": "Sin texto"}
+
+    if platform == "telegram":
+        chat = str(payload_entrada.get("group_id") or payload_entrada.get("platform_user_id") or "")
+        send = lambda t: enviar_mensaje_telegram_async(chat, t)  # noqa: E731
+    else:
+        chat = str(payload_entrada.get("platform_user_id") or "")
+        pnid = payload_entrada.get("_phone_number_id")
+        send = lambda t: enviar_mensaje_whatsapp_async(chat, t, phone_number_id=pnid)  # noqa: E731
+    priority = PRIORITY_MODERATION if respuesta.get("type") == "moderation" else PRIORITY_REPLY
+    fut = outbound.submit(platform, chat, text, send, priority)
+    try:
+        result = await asyncio.wait_for(asyncio.shield(fut), timeout=OUTBOUND_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return {"platform": platform, "sent": None, "reason": "queued"}
+    return {"platform": platform, "result": result}
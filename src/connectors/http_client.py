@@ -0,0 +1,212 @@
+"""Clientes HTTP compartidos para los envíos salientes (Telegram, WhatsApp).
+
+Cada plataforma tiene sesiones de larga duración con pool de conexiones (keep-alive), así que
+solo el primer envío paga el handshake TCP+TLS:
+
+- get_async_client(platform): httpx.AsyncClient por event loop y plataforma. HTTP/2 si está
+  instalado `h2` (una conexión multiplexa todos los envíos). Los reintentos esperan con
+  asyncio.sleep: mientras Telegram tarda o se hace el backoff, el worker atiende otros chats.
+- get_session(platform): requests.Session por plataforma para los envíos síncronos.
+
+http_stats() expone por plataforma peticiones, conexiones nuevas, handshakes TLS y % de reutilización.
+
+Variables de entorno:
+- HTTP_MAX_CONNECTIONS (por defecto 100): conexiones simultáneas máximas del pool.
+- HTTP_MAX_KEEPALIVE (por defecto 20): conexiones ociosas que se mantienen abiertas.
+- HTTP2 (por defecto auto): false desactiva HTTP/2 aunque `h2` esté instalado.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+try:  # dependencia opcional (pip install httpx[http2])
+    import h2  # type: ignore  # noqa: F401
+    _H2_AVAILABLE = True
+except Exception:
+    _H2_AVAILABLE = False
+
+# Clientes por event loop y plataforma (un AsyncClient no puede usarse desde otro loop)
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+    )
+
+
+def _http2_enabled() -> bool:
+    return _H2_AVAILABLE and os.getenv("HTTP2", "auto").strip().lower() not in ("0", "false", "no")
+
+
+class _Metrics:
+    __slots__ = ("requests", "connections", "tls_handshakes", "http2")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.http2 = 0
+
+
+_metrics: Dict[str, _Metrics] = {}
+
+
+def _metrics_for(platform: str) -> _Metrics:
+    m = _metrics.get(platform)
+    if m is None:
+        m = _metrics.setdefault(platform, _Metrics())
+    return m
+
+
+def _tracer(platform: str):
+    # Eventos de httpcore: connect_tcp/start_tls solo ocurren al abrir una conexión nueva
+    m = _metrics_for(platform)
+
+    async def trace(event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            m.connections += 1
+        elif event_name == "connection.start_tls.complete":
+            m.tls_handshakes += 1
+        elif event_name.endswith(".send_request_headers.started"):
+            m.requests += 1
+            if event_name.startswith("http2."):
+                m.http2 += 1
+
+    async def on_request(request: httpx.Request) -> None:
+        request.extensions["trace"] = trace
+
+    return on_request
+
+
+def get_async_client(platform: str = "default") -> httpx.AsyncClient:
+    """Cliente compartido del event loop actual para la plataforma (se crea la primera vez)."""
+    per_loop = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = per_loop.get(platform)
+    if client is None or client.is_closed:
+        client = per_loop[platform] = httpx.AsyncClient(
+            limits=_limits(),
+            timeout=10.0,
+            http2=_http2_enabled(),
+            event_hooks={"request": [_tracer(platform)]},
+        )
+    return client
+
+
+async def close_async_client() -> None:
+    """Cierra los clientes del event loop actual (llamar al apagar la app)."""
+    for client in (_clients.pop(asyncio.get_running_loop(), None) or {}).values():
+        await client.aclose()
+
+
+def get_session(platform: str = "default") -> requests.Session:
+    """requests.Session compartida por plataforma (pool keep-alive) para envíos síncronos."""
+    session = _sessions.get(platform)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(platform)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")))
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[platform] = session
+    return session
+
+
+def _session_stats(session: requests.Session) -> Dict[str, int]:
+    # urllib3 cuenta por pool las conexiones abiertas y las peticiones hechas
+    out = {"requests": 0, "connections": 0}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for pool in [pools[k] for k in pools.keys()]:
+            out["requests"] += getattr(pool, "num_requests", 0)
+            out["connections"] += getattr(pool, "num_connections", 0)
+    return out
+
+
+def _reuse(requests_: int, connections: int) -> Optional[float]:
+    return round(1 - connections / requests_, 4) if requests_ else None
+
+
+def http_stats() -> Dict[str, Any]:
+    """Métricas de reutilización de conexiones por plataforma (async y sync)."""
+    out: Dict[str, Any] = {"http2_available": _http2_enabled()}
+    for platform, m in list(_metrics.items()):
+        out.setdefault(platform, {})["async"] = {
+            "requests": m.requests,
+            "connections": m.connections,
+            "tls_handshakes": m.tls_handshakes,
+            "http2_requests": m.http2,
+            "reuse_ratio": _reuse(m.requests, m.connections),
+        }
+    for platform, session in list(_sessions.items()):
+        st = _session_stats(session)
+        st["reuse_ratio"] = _reuse(st["requests"], st["connections"])
+        out.setdefault(platform, {})["sync"] = st
+    return out
+
+
+class RateLimited(RuntimeError):
+    """La plataforma respondió 429; retry_after son los segundos que pide esperar."""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    # Telegram: {"parameters": {"retry_after": N}}; el resto: cabecera Retry-After
+    try:
+        value = (resp.json().get("parameters") or {}).get("retry_after")
+        if value is not None:
+            return float(value)
+    except Exception:
+        pass
+    try:
+        return float(resp.headers.get("Retry-After", "1"))
+    except ValueError:
+        return 1.0
+
+
+async def post_json_with_retries(
+    url: str,
+    json_payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 5,
+    retries: int = 3,
+    backoff: float = 0.5,
+    client: Optional[httpx.AsyncClient] = None,
+    platform: str = "default",
+) -> httpx.Response:
+    """POST JSON con reintentos (errores de red y 5xx) y backoff lineal sin bloquear el loop.
+    Devuelve la respuesta 2xx; ante un 429 lanza RateLimited sin reintentar (quien llama decide
+    cuándo volver a enviar); si se agotan los intentos o la respuesta es otro 4xx, lanza RuntimeError.
+    """
+    client = client or get_async_client(platform)
+    last_err = None
+    for attempt in range(1, retries + 1):
+        try:
+            resp = await client.post(url, json=json_payload, headers=headers, timeout=timeout)
+            if 200 <= resp.status_code < 300:
+                return resp
+            last_err = f"HTTP {resp.status_code}: {resp.text}"
+            if resp.status_code == 429:
+                raise RateLimited(last_err, _retry_after(resp))
+            if resp.status_code < 500:
+                break
+        except httpx.HTTPError as e:
+            last_err = str(e) or type(e).__name__
+        if attempt < retries:
+            await asyncio.sleep(backoff * attempt)
+    raise RuntimeError(last_err or "Unknown error")
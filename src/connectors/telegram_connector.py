@@ -1,8 +1,8 @@
 # telegram_connector.py - Conector funcional para Telegram
-import requests
 import os
 import time
 from typing import Any, Dict
+from src.connectors.http_client import RateLimited, get_session, post_json_with_retries
 from src.utils.logging import log_event, log_error_event
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
@@ -13,7 +13,7 @@ def _post_with_retries(url: str, json_payload: Dict[str, Any], timeout: int = 5,
     last_err = None
     for attempt in range(1, retries + 1):
         try:
-            resp = requests.post(url, json=json_payload, timeout=timeout)
+            resp = get_session("telegram").post(url, json=json_payload, timeout=timeout)
             if resp.status_code >= 200 and resp.status_code < 300:
                 return resp.json()
             last_err = f"HTTP {resp.status_code}: {resp.text}"
@@ -36,6 +36,24 @@ def enviar_mensaje_telegram(chat_id, texto):
         log_error_event("telegram_send_error", chat_id=str(chat_id), error=str(e))
         return {"ok": False, "error": str(e)}
 
+
+async def enviar_mensaje_telegram_async(chat_id, texto):
+    """Versión asíncrona de enviar_mensaje_telegram (pool de conexiones compartido, reintentos sin bloquear)."""
+    payload = {
+        "chat_id": chat_id,
+        "text": texto
+    }
+    try:
+        resp = await post_json_with_retries(TELEGRAM_API_URL, payload, timeout=5, retries=3, backoff=0.5, platform="telegram")
+        log_event("telegram_send_success", chat_id=str(chat_id))
+        return resp.json()
+    except RateLimited as e:
+        log_error_event("telegram_send_error", chat_id=str(chat_id), error=str(e), retry_after=e.retry_after)
+        return {"ok": False, "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        log_error_event("telegram_send_error", chat_id=str(chat_id), error=str(e))
+        return {"ok": False, "error": str(e)}
+
 # Ejemplo de función para recibir y normalizar mensajes
 
 def normalizar_mensaje_telegram(update):
@@ -6,7 +6,6 @@ Lee mensajes y los reenvía al BotManager para procesar y responder.
 import os
 import sys
 from pathlib import Path
-import yaml
 from dotenv import load_dotenv
 import logging
 from telegram import Update, ChatPermissions
@@ -23,7 +22,8 @@ from src.bot_core.manager import BotManager
 from src.handlers.bienvenida import enviar_bienvenida
 from src.handlers.moderacion import moderation_repo
 from src.storage.repository import audit_repo
-from src.config.rules_loader import get_moderation_config, reload_rules_cache, get_features_config
+from src.config.rules_loader import get_chat_rules, get_moderation_plan, reload_rules_cache, get_features_config
+from src.ml.feedback import FEEDBACK_LABELS, submit_feedback
 
 # Cargar variables de entorno desde .env en la raíz de Comunidad
 load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
@@ -53,17 +53,10 @@ logger = logging.getLogger("telegram_polling")
 
 bot_manager = BotManager()
 
-# Cargar reglas desde config/rules.yaml
-RULES_FILE = PROJECT_ROOT / "config" / "rules.yaml"
+# Reglas de config/rules.yaml: las del rules_loader (generación vigente, sin volver a parsear el YAML)
 def cargar_reglas(chat_id: str | int | None):
     try:
-        if not RULES_FILE.exists():
-            return None
-        with open(RULES_FILE, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
-        key = str(chat_id) if chat_id is not None else "default"
-        reglas = data.get(key) or data.get("default")
-        return reglas
+        return get_chat_rules(chat_id)
     except Exception as e:
         logger.warning(f"No se pudieron cargar reglas: {e}")
         return None
@@ -76,7 +69,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print(f"[INFO] chat_id del grupo: {chat_id}")
     # Si el bot está deshabilitado para este chat, ignorar mensajes
     try:
-        cfg = get_moderation_config(chat_id)
+        cfg = get_moderation_plan(chat_id).config
         if not cfg.get("enabled", True):
             return
     except Exception:
@@ -91,9 +84,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "attachments": None,
         "raw_payload": None,
         "is_group": is_group,
+        "message_id": update.message.message_id,
     }
     logger.info(f"[{TELEGRAM_BOT_NAME}] Mensaje recibido de {user_id}: {text}")
-    response = bot_manager.process_message(payload)
+    # El pipeline corre en la cola por chat (ChatScheduler): el event loop sigue atendiendo otros chats
+    response = await bot_manager.process_message_async(payload)
     # Enviar respuesta al usuario
     reply_text = None
     # Soporta respuesta directa o anidada bajo 'response'
@@ -110,7 +105,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             chat_type = getattr(update.effective_chat, "type", "") or ""
             is_group = chat_type in ("group", "supergroup")
-            cfg_guard = get_moderation_config(chat_id)
+            cfg_guard = get_moderation_plan(chat_id).config
             if is_group and bool(cfg_guard.get("enforce_only", False)):
                 # No enviar respuestas conversacionales en modo enforce_only
                 logger.info("[telegram] Respuesta suprimida por enforce_only en grupo")
@@ -149,7 +144,7 @@ async def handle_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_name = user.username or (user.full_name if hasattr(user, 'full_name') else str(user.id))
     chat_id = update.effective_chat.id if update.effective_chat else ""
-    cfg = get_moderation_config(chat_id)
+    cfg = get_moderation_plan(chat_id).config
     if not cfg.get("enabled", True):
         return
     try:
@@ -169,7 +164,8 @@ async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Mensaje de bienvenida y reglas\n"
         "/help - Mostrar esta ayuda\n"
         "/modhelp - Ayuda de moderación\n\n"
-        "Moderación (admins): /warn, /mute [min], /unmute, /kick, /ban, /unban, /reload\n\n"
+        "Moderación (admins): /warn, /mute [min], /unmute, /kick, /ban, /unban, /reload\n"
+        "ML (admins, respondiendo a un mensaje): /learn <toxic|spam|normal>, /unlearn <toxic|spam|normal>\n\n"
         "Prueba también: 'hola', 'encuesta', 'sorteo'"
     )
     await update.message.reply_text(help_text)
@@ -222,7 +218,7 @@ async def apply_moderation_action(update: Update, context: ContextTypes.DEFAULT_
 
     # Notificación a administradores (simple): reenvía al chat si admin_notify
     try:
-        cfg = get_moderation_config(chat_id)
+        cfg = get_moderation_plan(chat_id).config
         if cfg.get("admin_notify", False):
             dest_id = cfg.get("admin_notify_chat_id") or chat_id
             await context.bot.send_message(dest_id, f"[MOD] acción={action} usuario={user.username or user_id} motivo={info.get('text','')}")
@@ -232,7 +228,7 @@ async def apply_moderation_action(update: Update, context: ContextTypes.DEFAULT_
     if action == "kick":
         try:
             # Comportamiento de kick configurable por reglas
-            cfg_rules = get_moderation_config(chat_id)
+            cfg_rules = get_moderation_plan(chat_id).config
             rejoin_seconds = int(cfg_rules.get("kick_rejoin_seconds", 60))
             if rejoin_seconds and rejoin_seconds > 0:
                 # Expulsión temporal: ban corto + desban para permitir reingreso luego
@@ -393,7 +389,7 @@ async def handle_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.new_chat_members:
         return
     chat_id = update.effective_chat.id if update.effective_chat else ""
-    cfg = get_moderation_config(chat_id)
+    cfg = get_moderation_plan(chat_id).config
     try:
         feats = get_features_config(chat_id)
         if not feats.get("welcome_enabled", True):
@@ -408,7 +404,7 @@ async def handle_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_reglas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id if update.effective_chat else None
-    cfg = get_moderation_config(chat_id)
+    cfg = get_moderation_plan(chat_id).config
     if not cfg.get("enabled", True):
         return
     # Switch de características: permitir desactivar /reglas por chat
@@ -429,11 +425,43 @@ async def handle_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await _require_admin(update, context):
         return
     try:
-        reload_rules_cache()
+        await bot_manager.run_blocking(reload_rules_cache)
         await update.message.reply_text("Reglas recargadas desde config/rules.yaml")
     except Exception as e:
         await update.message.reply_text(f"No se pudieron recargar reglas: {e}")
 
+async def _handle_ml_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE, op: str):
+    if not await _require_admin(update, context):
+        return
+    reply = update.message.reply_to_message if update.message else None
+    texto = (reply.text or reply.caption or "") if reply else ""
+    label = (context.args[0].lower() if context.args else "")
+    if not texto or label not in FEEDBACK_LABELS:
+        await update.message.reply_text(
+            f"Uso: responde a un mensaje con /{'learn' if op == 'add' else 'unlearn'} <{'|'.join(FEEDBACK_LABELS)}>"
+        )
+        return
+    try:
+        result = await bot_manager.run_blocking(submit_feedback, str(update.effective_chat.id), texto, label, op, by=str(update.effective_user.id))
+        if not result.get("ml_enabled"):
+            estado = "guardado (ML desactivado en este chat)"
+        elif result.get("applied"):
+            estado = "aplicado al modelo"
+        else:
+            estado = "guardado, sin cambios en el modelo"
+        verbo = "Aprendido" if op == "add" else "Olvidado"
+        await update.message.reply_text(f"{verbo} como '{label}': {estado}.")
+    except Exception as e:
+        await update.message.reply_text(f"No se pudo registrar el feedback: {e}")
+
+
+async def handle_learn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _handle_ml_feedback(update, context, "add")
+
+
+async def handle_unlearn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _handle_ml_feedback(update, context, "remove")
+
 def main():
     if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "<TU_TOKEN_AQUI>":
         logger.error("TELEGRAM_TOKEN no configurado. Define el token en el archivo .env o variable de entorno.")
@@ -452,6 +480,8 @@ def main():
     application.add_handler(CommandHandler("kick", handle_kick_cmd))
     application.add_handler(CommandHandler("ban", handle_ban_cmd))
     application.add_handler(CommandHandler("unban", handle_unban_cmd))
+    application.add_handler(CommandHandler("learn", handle_learn))
+    application.add_handler(CommandHandler("unlearn", handle_unlearn))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_member))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     logger.info(f"Bot de Telegram '{TELEGRAM_BOT_NAME}' iniciado en modo polling.")
@@ -11,20 +11,27 @@ Variables .env soportadas:
 - WHATSAPP_VERIFY_TOKEN: cadena que configuras tú para verificar el webhook (opcional, por defecto "verify")
 - WHATSAPP_API_VERSION: versión de Graph API (opcional, por defecto "v20.0")
 - WHATSAPP_PHONE_NUMBER_ID: opcional; si no está, se usa el del webhook entrante
+- WHATSAPP_ASYNC_MODE: true para responder 200 al instante y procesar en workers (por defecto false)
+- WHATSAPP_DRAIN_TIMEOUT: segundos para procesar lo encolado al apagar (por defecto 10)
 """
 
 from __future__ import annotations
+import asyncio
 import os
 import json
 import time
-from typing import Any, Dict, Optional
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-import requests
 from fastapi import APIRouter, Request, Response, status
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from src.bot_core.manager import BotManager
 from src.app.config import SEND_AUTOMATIC_RESPONSES
+from src.connectors.http_client import RateLimited, get_session, post_json_with_retries
+from src.tasks.chat_queue import QueueFull, get_chat_scheduler
+from src.utils.dedup import get_update_dedup
 from src.utils.logging import log_event, log_error_event
 
 
@@ -40,34 +47,50 @@ def _graph_base_url(api_version: str) -> str:
     return f"https://graph.facebook.com/{ver}"
 
 
-def enviar_mensaje_whatsapp(numero: str, texto: str, phone_number_id: Optional[str] = None) -> Dict[str, Any]:
-    """Envía un mensaje de texto vía Cloud API.
-
-    Si no se pasa phone_number_id, usa el último visto en webhook o el de .env.
-    """
+@lru_cache(maxsize=1)
+def _whatsapp_config() -> Tuple[str, str, Dict[str, str]]:
+    """(token, base_url, headers) leídos de .env una sola vez. cache_clear() tras cambiar el entorno."""
     token = os.getenv("WHATSAPP_TOKEN", "").strip()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+    }
+    return token, _graph_base_url("v20.0"), headers
+
+
+def _whatsapp_request(numero: str, texto: str, phone_number_id: Optional[str] = None):
+    """(url, headers, payload) del envío, o un dict de error si falta configuración."""
+    token, base_url, headers = _whatsapp_config()
     if not token:
         return {"ok": False, "error": "Falta WHATSAPP_TOKEN en .env"}
 
-    pnid = phone_number_id or _LAST_PHONE_NUMBER_ID or os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+    pnid = phone_number_id or _LAST_PHONE_NUMBER_ID
     if not pnid:
         return {"ok": False, "error": "No hay phone_number_id disponible (configure .env o reciba un webhook primero)"}
 
-    url = f"{_graph_base_url('v20.0')}/{pnid}/messages"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
+    url = f"{base_url}/{pnid}/messages"
     payload = {
         "messaging_product": "whatsapp",
         "to": str(numero),
         "type": "text",
         "text": {"body": texto[:4096]},  # límite seguro
     }
+    return url, headers, payload
+
+
+def enviar_mensaje_whatsapp(numero: str, texto: str, phone_number_id: Optional[str] = None) -> Dict[str, Any]:
+    """Envía un mensaje de texto vía Cloud API.
+
+    Si no se pasa phone_number_id, usa el último visto en webhook o el de .env.
+    """
+    req = _whatsapp_request(numero, texto, phone_number_id)
+    if isinstance(req, dict):
+        return req
+    url, headers, payload = req
     last_err: Optional[str] = None
     for attempt in range(1, 3):
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=10)
+            resp = get_session("whatsapp").post(url, headers=headers, json=payload, timeout=10)
             if 200 <= resp.status_code < 300:
                 return {"ok": True, "status": resp.status_code, "response": resp.json()}
             last_err = f"HTTP {resp.status_code}: {resp.text}"
@@ -77,6 +100,21 @@ def enviar_mensaje_whatsapp(numero: str, texto: str, phone_number_id: Optional[s
     return {"ok": False, "error": last_err or "Error desconocido"}
 
 
+async def enviar_mensaje_whatsapp_async(numero: str, texto: str, phone_number_id: Optional[str] = None) -> Dict[str, Any]:
+    """Versión asíncrona de enviar_mensaje_whatsapp (pool de conexiones compartido, reintentos sin bloquear)."""
+    req = _whatsapp_request(numero, texto, phone_number_id)
+    if isinstance(req, dict):
+        return req
+    url, headers, payload = req
+    try:
+        resp = await post_json_with_retries(url, payload, headers=headers, timeout=10, retries=2, backoff=0.3, platform="whatsapp")
+        return {"ok": True, "status": resp.status_code, "response": resp.json()}
+    except RateLimited as e:
+        return {"ok": False, "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        return {"ok": False, "error": str(e) or "Error desconocido"}
+
+
 def normalizar_mensaje_whatsapp(entry_change_value: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Extrae y normaliza un mensaje entrante del payload de Cloud API.
 
@@ -109,6 +147,7 @@ def normalizar_mensaje_whatsapp(entry_change_value: Dict[str, Any]) -> Optional[
             "group_id": None,  # Cloud API no maneja grupos del mismo modo
             "text": text_body or "",
             "raw_payload": msg,
+            "message_id": msg.get("id"),
             "_phone_number_id": phone_number_id,
         }
     except Exception:
@@ -129,37 +168,148 @@ async def verify(mode: Optional[str] = None, challenge: Optional[str] = None, to
     return Response(status_code=status.HTTP_403_FORBIDDEN)
 
 
+def _extraer_mensajes(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Mensajes normalizados con texto de un POST de la Cloud API."""
+    mensajes = []
+    for ent in data.get("entry") or []:
+        for ch in ent.get("changes", []):
+            value = ch.get("value") or {}
+            # Normalizar mensaje si existe
+            norm = normalizar_mensaje_whatsapp(value)
+            if not norm or not norm.get("text"):
+                continue
+            log_event("whatsapp_incoming", user=str(norm.get("platform_user_id")))
+            mensajes.append(norm)
+    return mensajes
+
+
+def _sin_duplicados(mensajes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Meta reintenta el webhook si no recibe 200 a tiempo: descartar ids (wamid) ya recibidos.
+    # Comprobar y marcar es un solo paso: dos entregas simultáneas no pasan las dos.
+    dedup = get_update_dedup()
+    nuevos = []
+    for norm in mensajes:
+        mid = norm.get("message_id")
+        if mid and dedup.seen("whatsapp", None, mid):
+            log_event("whatsapp_duplicate", message_id=mid)
+            continue
+        nuevos.append(norm)
+    return nuevos
+
+
+def _olvidar(mensajes: List[Dict[str, Any]]) -> None:
+    # Mensajes que no se pudieron encolar: el reintento de Meta sí debe procesarse
+    dedup = get_update_dedup()
+    for norm in mensajes:
+        if norm.get("message_id"):
+            dedup.forget("whatsapp", None, norm["message_id"])
+
+
+async def _procesar(mensajes: List[Dict[str, Any]], futuros: List[Future]) -> None:
+    # Espera los resultados del ChatScheduler (mensajes ya encolados en orden) y responde
+    results = await get_chat_scheduler().results(futuros)
+    envios = []
+    for norm, result in zip(mensajes, results):
+        # Responder automáticamente si corresponde (cola de salida con rate shaping)
+        if SEND_AUTOMATIC_RESPONSES and isinstance(result, dict) and result.get("text"):
+            from src.connectors.dispatcher import enviar_respuesta_async
+            envios.append(enviar_respuesta_async("whatsapp", norm, result))
+    if envios:
+        await asyncio.gather(*envios)
+
+
+class _InboundPool:
+    """Modo ack-then-process: encola en el ChatScheduler del proceso (orden por chat y cola acotada,
+    el mismo mecanismo que el resto de entradas) y espera resultados y envía respuestas en tareas de
+    fondo, para responder a Meta sin esperar al pipeline."""
+
+    def __init__(self) -> None:
+        self._tasks: Set[asyncio.Task] = set()
+        self.processed = 0
+        self.rejected = 0
+
+    def submit(self, mensajes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Encola los mensajes; devuelve los que no se encolaron (cola llena: todos)."""
+        try:
+            futuros = manager.submit_batch(mensajes, dedup=False)
+        except QueueFull:
+            self.rejected += len(mensajes)
+            return list(mensajes)
+        task = asyncio.get_running_loop().create_task(self._run(mensajes, futuros))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return []
+
+    async def _run(self, mensajes: List[Dict[str, Any]], futuros: List[Future]) -> None:
+        try:
+            await _procesar(mensajes, futuros)
+            self.processed += len(mensajes)
+        except Exception as e:
+            log_error_event("whatsapp_worker_error", error=str(e))
+
+    async def join(self) -> None:
+        """Espera a que se procesen los mensajes encolados (tests/apagado ordenado)."""
+        while True:
+            pendientes = [t for t in self._tasks if not t.done()]
+            if not pendientes:
+                return
+            await asyncio.gather(*pendientes, return_exceptions=True)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Apagado ordenado: espera lo encolado y sus respuestas (como mucho `timeout` segundos)."""
+        loop = asyncio.get_running_loop()
+        pendientes = [t for t in self._tasks if not t.done() and t.get_loop() is loop]
+        if not pendientes:
+            return
+        _, sin_terminar = await asyncio.wait(pendientes, timeout=timeout)
+        if sin_terminar:
+            log_error_event("whatsapp_inbound_drain_timeout", pending=len(sin_terminar))
+            for task in sin_terminar:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._tasks), "processed": self.processed, "rejected": self.rejected}
+
+
+# WHATSAPP_ASYNC_MODE=true: responder 200 a Meta en cuanto el payload se valida y encola
+WHATSAPP_ASYNC_MODE = os.getenv("WHATSAPP_ASYNC_MODE", "false").lower() in ("1", "true", "yes")
+inbound_pool = _InboundPool()
+WHATSAPP_DRAIN_TIMEOUT = float(os.getenv("WHATSAPP_DRAIN_TIMEOUT", "10"))
+
+
 @router.post("/")
 async def inbound(request: Request):
-    """Recibe notificaciones de la Cloud API y procesa mensajes entrantes."""
+    """Recibe notificaciones de la Cloud API y procesa mensajes entrantes.
+
+    Los mensajes se encolan en el ChatScheduler del proceso (orden por chat). Con
+    WHATSAPP_ASYNC_MODE=true responde al instante y los resultados y el envío de respuestas se
+    esperan en segundo plano. Si la cola está llena responde 503 para que Meta reintente más tarde.
+    """
     try:
         data = await request.json()
     except Exception:
         return {"status": "invalid json"}
 
     try:
-        entries = data.get("entry") or []
-        for ent in entries:
-            for ch in ent.get("changes", []):
-                value = ch.get("value") or {}
-                # Normalizar mensaje si existe
-                norm = normalizar_mensaje_whatsapp(value)
-                if not norm or not norm.get("text"):
-                    continue
-                log_event("whatsapp_incoming", user=str(norm.get("platform_user_id")))
-                # Procesar con el manager
-                result = manager.process_message(norm)
-                # Responder automáticamente si corresponde
-                if SEND_AUTOMATIC_RESPONSES and isinstance(result, dict):
-                    reply_text = result.get("text")
-                    if reply_text:
-                        enviar_mensaje_whatsapp(
-                            str(norm.get("platform_user_id")),
-                            reply_text,
-                            phone_number_id=norm.get("_phone_number_id"),
-                        )
+        mensajes = _sin_duplicados(_extraer_mensajes(data))
+        if not mensajes:
+            return {"status": "ok"}
+        if WHATSAPP_ASYNC_MODE:
+            rechazados = inbound_pool.submit(mensajes)
+        else:
+            try:
+                futuros = manager.submit_batch(mensajes, dedup=False)
+                rechazados = []
+            except QueueFull:
+                rechazados = mensajes
+        if rechazados:
+            _olvidar(rechazados)
+            log_error_event("whatsapp_queue_full", rejected=len(rechazados))
+            return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "busy"})
+        if WHATSAPP_ASYNC_MODE:
+            return {"status": "queued"}
+        await _procesar(mensajes, futuros)
         return {"status": "ok"}
     except Exception as e:
         log_error_event("whatsapp_webhook_error", error=str(e))
         return {"status": "error", "error": str(e)}
-
@@ -4,13 +4,13 @@ Acciones posibles: delete, warn, mute, kick, ban.
 Soporta: palabras prohibidas, patrones regex, whitelist, mensajes personalizados y ban temporal.
 """
 from typing import Optional, Dict, Any
-from src.config.rules_loader import get_moderation_config
-from src.storage.repository import ModerationRepository
+from src.config.rules_loader import ModerationPlan, get_moderation_plan
+from src.nlu.features import MessageFeatures
+from src.storage.repository import create_moderation_repository
 from src.utils.logging import log_event
-import re
 from urllib.parse import urlparse
 
-moderation_repo = ModerationRepository()
+moderation_repo = create_moderation_repository()
 
 
 # Formateo seguro de plantillas con placeholders opcionales
@@ -47,14 +47,25 @@ def _action_msg_allowed(cfg: Dict[str, Any], action: str) -> bool:
         return True
 
 
-def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    # Cargar configuración al inicio para usarla en cualquier rama (ML y clásica)
-    cfg = get_moderation_config(chat_id)
+def revisar_mensaje(
+    mensaje: str,
+    usuario: str,
+    chat_id: Optional[str] = None,
+    plan: Optional[ModerationPlan] = None,
+    features: Optional[MessageFeatures] = None,
+) -> Optional[Dict[str, Any]]:
+    # Plan compilado del chat (el BotManager lo pasa ya resuelto para no buscarlo dos veces)
+    if plan is None:
+        plan = get_moderation_plan(chat_id)
+    # Rasgos del mensaje calculados una sola vez (el BotManager los comparte con ML y NLU)
+    if features is None:
+        features = MessageFeatures(mensaje or "", normalized=(mensaje or "").lower())
+    cfg = plan.config
     # Guardas defensivas: si no hay usuario, no aplicar moderación (evita efectos globales)
     if not usuario:
         return None
     # --- Whitelist: si el usuario está exento, no aplicar moderación ---
-    if usuario in set(cfg.get("whitelist_users", [])):
+    if usuario in plan.whitelist_users:
         return None
 
     # --- Chequeo inmediato de estado muteado ---
@@ -111,9 +122,11 @@ def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -
     ml_cfg = cfg.get("ml", {}) or {}
     if bool(ml_cfg.get("enabled", False)):
         try:
-            from src.ml.runtime import get_moderation_scorer
-            scorer = get_moderation_scorer(str(chat_id or "global"), ml_cfg)
-            scores = scorer.score(mensaje)
+            scores = features.ml_scores
+            if scores is None:
+                from src.ml.runtime import get_moderation_scorer
+                scorer = get_moderation_scorer(str(chat_id or "global"), ml_cfg, plan.ml_training_hash)
+                scores = scorer.score_tokens(features.tokens)
             tox_thr = float(ml_cfg.get("toxicity_threshold", 0.9))
             spam_thr = float(ml_cfg.get("spam_threshold", 0.9))
             is_toxic = scores.get("toxic", 0.0) >= tox_thr
@@ -140,16 +153,7 @@ def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -
                 if ml_mode == "thresholds":
                     # Modo profesional: ML solo suma infracción y respeta thresholds clásicos
                     count = moderation_repo.add_violation(str(chat_id or "global"), str(usuario))
-                    th = cfg["thresholds"]
-                    action = "warn"
-                    if count >= th.get("ban", 4):
-                        action = "ban"
-                    elif count >= th.get("kick", 3):
-                        action = "kick"
-                    elif count >= th.get("mute", 2):
-                        action = "mute"
-                    elif count >= th.get("warn", 1):
-                        action = "warn"
+                    action = plan.action_for_count(count)
 
                     result: Dict[str, Any] = {"type": "moderation", "action": action, "reason": "ml_thresholds", "violations": count}
                     if cfg.get("delete_message_on_violation", True):
@@ -270,19 +274,10 @@ def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -
             # Ante cualquier problema en ML, continuar con modo clásico sin romper flujo
             pass
 
-    # Limpiar palabras prohibidas vacías para evitar matches universales
-    banned_words = [w.lower() for w in cfg.get("banned_words", []) if str(w).strip()]
-    # Aprendizaje manual (sin ML): unir listas definidas en rules.yaml (learning.toxic_words/spam_words)
-    learning = cfg.get("learning", {}) or {}
-    extra_words = []
-    extra_words.extend([w.lower() for w in (learning.get("toxic_words", []) or []) if str(w).strip()])
-    extra_words.extend([w.lower() for w in (learning.get("spam_words", []) or []) if str(w).strip()])
-    if extra_words:
-        banned_words.extend(extra_words)
-    texto = (mensaje or "").lower()
+    texto = features.normalized
     # --- Longitud máxima ---
     max_len = int(cfg.get("max_message_length", 0))
-    if max_len > 0 and len(texto) > max_len:
+    if max_len > 0 and features.length > max_len:
         resp: Dict[str, Any] = {"type": "moderation", "action": "delete"}
         if _action_msg_allowed(cfg, "delete") and not bool(cfg.get("strict_message_config", False)):
             resp["text"] = "Mensaje demasiado largo."
@@ -307,35 +302,27 @@ def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -
     # --- Detección de 'gritos' por porcentaje de mayúsculas ---
     caps_thr = int(cfg.get("caps_lock_threshold", 0))
     if caps_thr > 0 and texto:
-        letters = [c for c in mensaje if c.isalpha()]
-        if letters:
-            caps_ratio = sum(1 for c in letters if c.isupper()) * 100 // len(letters)
-            if caps_ratio >= caps_thr:
-                resp: Dict[str, Any] = {"type": "moderation", "action": "warn"}
-                if _action_msg_allowed(cfg, "warn"):
-                    if not bool(cfg.get("strict_message_config", False)):
-                        resp["text"] = "Evita escribir en MAYÚSCULAS."
-                return resp
+        # caps_ratio se mide sobre el texto original (el normalizado ya está en minúsculas)
+        if features.caps_ratio >= caps_thr:
+            resp: Dict[str, Any] = {"type": "moderation", "action": "warn"}
+            if _action_msg_allowed(cfg, "warn"):
+                if not bool(cfg.get("strict_message_config", False)):
+                    resp["text"] = "Evita escribir en MAYÚSCULAS."
+            return resp
 
     # --- Enlaces y archivos ---
     allow_links = bool(cfg.get("allow_links", True))
     allow_files = bool(cfg.get("allow_files", True))
     invite_ok = bool(cfg.get("invite_links_allowed", True))
-    link_whitelist = set(cfg.get("link_whitelist", []))
-
-    def _has_url(t: str) -> Optional[str]:
-        for token in t.split():
-            if token.startswith("http://") or token.startswith("https://") or token.startswith("www."):
-                return token
-        return None
+    link_whitelist = plan.link_whitelist
 
-    url = _has_url(mensaje or "")
+    url = features.first_url
     if not allow_links and url:
         try:
             u = urlparse(url if url.startswith("http") else f"http://{url}")
             host = (u.netloc or u.path).lower()
             is_invite = ("t.me/joinchat" in url.lower()) or ("telegram.me/joinchat" in url.lower())
-            whitelisted = any(host.endswith(dom.lower()) for dom in link_whitelist)
+            whitelisted = any(host.endswith(dom) for dom in link_whitelist)
             if not (whitelisted or (invite_ok and is_invite)):
                 resp: Dict[str, Any] = {"type": "moderation", "action": "delete"}
                 if _action_msg_allowed(cfg, "delete") and not bool(cfg.get("strict_message_config", False)):
@@ -349,13 +336,15 @@ def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -
 
     # Nota: detección de archivos adjuntos depende del conector; aquí asumimos texto plano.
     # --- Patrones prohibidos por regex ---
-    regex_list = [p for p in (cfg.get("regex_patterns", []) or []) if str(p).strip()]
-    regex_violation = any(re.search(pat, texto, flags=re.IGNORECASE) for pat in regex_list)
+    matched_pattern = plan.regex_set.search(texto)
+    regex_violation = matched_pattern is not None
     # Chequeo muted: no borrar todos los mensajes automáticamente; solo aplicar reglas si hay nueva violación
     user_is_muted = bool(chat_id and moderation_repo.is_muted(str(chat_id), str(usuario)))
 
     # --- Violación por palabra prohibida o regex ---
-    violation = any(w in texto for w in banned_words) or regex_violation
+    # Palabras prohibidas + aprendizaje manual (learning.toxic_words/spam_words) en una sola pasada
+    matched_word = plan.word_matcher.search(texto)
+    violation = matched_word is not None or regex_violation
     if not violation:
         # Si está muteado y no hay nueva violación, aplicar política de mute
         if user_is_muted:
@@ -397,21 +386,28 @@ def revisar_mensaje(mensaje: str, usuario: str, chat_id: Optional[str] = None) -
 
     # Registrar infracción y decidir acción
     count = moderation_repo.add_violation(str(chat_id or "global"), str(usuario))
-    th = cfg["thresholds"]
-
-    action = "warn"
-    if count >= th.get("ban", 4):
-        action = "ban"
-    elif count >= th.get("kick", 3):
-        action = "kick"
-    elif count >= th.get("mute", 2):
-        action = "mute"
-    elif count >= th.get("warn", 1):
-        action = "warn"
+    action = plan.action_for_count(count)
 
     result: Dict[str, Any] = {"type": "moderation", "action": action}
+    if matched_word is not None:
+        result["matched"] = matched_word
+    if matched_pattern is not None:
+        result["matched_pattern"] = matched_pattern
     if cfg.get("delete_message_on_violation", True):
         result["delete"] = True
+    if bool(cfg.get("log_actions", True)):
+        try:
+            log_event(
+                "moderation_match",
+                chat_id=str(chat_id or "global"),
+                user=str(usuario),
+                action=action,
+                violations=count,
+                matched=matched_word,
+                matched_pattern=matched_pattern,
+            )
+        except Exception:
+            pass
 
     if action == "warn":
         # Mensaje personalizado si está configurado (acepta {user})
@@ -0,0 +1,136 @@
+"""Feedback de administradores para el modelo ML (falsos positivos/negativos).
+
+Cada corrección se guarda como una línea JSON en ML_FEEDBACK_FILE (por defecto
+data/ml_feedback.jsonl) y se aplica de forma incremental al modelo del chat, sin
+re-entrenar desde cero ni editar rules.yaml. Al reiniciar (o al cambiar el entrenamiento
+base en rules.yaml) los deltas se vuelven a aplicar sobre el modelo base.
+
+El archivo es compartido (workers del modo prefork, otras réplicas con el mismo volumen): si
+cambia, las líneas nuevas se leen de forma incremental (comprobando como mucho una vez por
+segundo) y los modelos en caché las aplican en el siguiente mensaje del chat.
+"""
+from __future__ import annotations
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+FEEDBACK_LABELS = ("toxic", "spam", "normal")
+FEEDBACK_OPS = ("add", "remove")
+
+
+class FeedbackStore:
+    """Deltas de aprendizaje por chat, persistidos en JSON Lines (append-only)."""
+
+    def __init__(self, path: Optional[str | Path] = None, check_interval: float = 1.0) -> None:
+        self.path = Path(path) if path else None
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._by_chat: Dict[str, List[Tuple[str, str, str]]] = {}
+        # Archivo leído hasta _offset (inodo _inode); _checked_at: último stat()
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self._checked_at: Optional[float] = None
+
+    def _refresh(self, force: bool = False) -> None:
+        """Lee las líneas añadidas al archivo desde la última lectura (todo, si se reemplazó)."""
+        if self.path is None:
+            return
+        now = monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._read_new(now)
+
+    def _read_new(self, now: float) -> None:
+        # Con el lock tomado
+        self._checked_at = now
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self._inode or st.st_size < self._offset:
+            # Primera lectura, archivo reemplazado o truncado: empezar de cero
+            self._by_chat, self._offset = {}, 0
+            self._inode = st.st_ino if st is not None else None
+        if st is None or st.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        # Solo líneas completas: una escritura a medias se lee en la próxima comprobación
+        end = chunk.rfind(b"\n") + 1
+        self._offset += end
+        for line in chunk[:end].splitlines():
+            try:
+                rec = json.loads(line)
+                self._by_chat.setdefault(str(rec["chat_id"]), []).append(
+                    (str(rec["op"]), str(rec["label"]), str(rec["text"]))
+                )
+            except Exception:
+                # Línea corrupta (p. ej. escritura cortada): se ignora
+                continue
+
+    def deltas_for(self, chat_id: str) -> List[Tuple[str, str, str]]:
+        """Lista de (op, label, text) del chat en orden de llegada."""
+        self._refresh()
+        with self._lock:
+            return list(self._by_chat.get(str(chat_id), ()))
+
+    def count(self, chat_id: str) -> int:
+        """Número de deltas del chat (solo crece mientras el archivo no se reemplace)."""
+        self._refresh()
+        return len(self._by_chat.get(str(chat_id), ()))
+
+    def has_feedback(self, chat_id: str) -> bool:
+        return self.count(chat_id) > 0
+
+    def record(self, chat_id: str, text: str, label: str, op: str = "add", by: Optional[str] = None) -> Dict[str, Any]:
+        if label not in FEEDBACK_LABELS:
+            raise ValueError(f"label inválido '{label}'; usa {', '.join(FEEDBACK_LABELS)}")
+        if op not in FEEDBACK_OPS:
+            raise ValueError(f"op inválida '{op}'; usa {', '.join(FEEDBACK_OPS)}")
+        rec = {"ts": time(), "chat_id": str(chat_id), "op": op, "label": label, "text": text, "by": by}
+        with self._lock:
+            if self.path is None:
+                self._by_chat.setdefault(str(chat_id), []).append((op, label, text))
+                return rec
+            # Se lee primero lo que hubiera de otros procesos y después la línea propia (y cualquier
+            # otra escrita entre medias): el orden en memoria es el del archivo
+            self._read_new(monotonic())
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._read_new(monotonic())
+        return rec
+
+
+feedback_store = FeedbackStore(os.getenv("ML_FEEDBACK_FILE") or PROJECT_ROOT / "data" / "ml_feedback.jsonl")
+
+
+def submit_feedback(chat_id: str, text: str, label: str, op: str = "add", by: Optional[str] = None) -> Dict[str, Any]:
+    """Registra una corrección de admin y la aplica al modelo del chat.
+    Devuelve un resumen apto para responder al admin/API: `applied` es False si el ML está
+    desactivado en el chat o si la corrección no cambió el modelo (p. ej. quitar de una clase
+    sin ejemplos).
+    """
+    from src.config.rules_loader import get_moderation_plan
+    from src.ml.runtime import apply_feedback
+
+    text = (text or "").strip()
+    if not text:
+        raise ValueError("texto vacío")
+    plan = get_moderation_plan(chat_id)
+    ml_cfg = dict(plan.config.get("ml") or {})
+    rec = feedback_store.record(str(chat_id), text, label, op, by)
+    ml_enabled = bool(ml_cfg.get("enabled", False))
+    applied = False
+    if ml_enabled:
+        applied = apply_feedback(str(chat_id), ml_cfg, text, label, op, plan.ml_training_hash)
+    return {
+        "ok": True, "chat_id": str(chat_id), "label": label, "op": op,
+        "ml_enabled": ml_enabled, "applied": applied, "ts": rec["ts"],
+    }
@@ -0,0 +1,124 @@
+"""Persistencia binaria de modelos Naive Bayes vectorizados (memory-mappable).
+
+Formato (little-endian):
+    cabecera  : magic b"CGNB", versión u16, reservado u16, hash de entrenamiento (16 bytes),
+                n_clases u32, tamaño de vocabulario u32, bytes de la tabla de vocabulario u64
+    clases    : por clase, longitud u16 + nombre utf-8
+    (relleno hasta múltiplo de 8)
+    log_prior : float32[n_clases]
+    log_lik   : float32[n_clases * (vocab + 1)] en orden fila (la última columna = fuera de vocabulario)
+    vocab     : tokens utf-8 separados por "\n" (el orden define el índice de columna)
+
+Los arrays se leen con mmap en modo solo lectura, así varios workers comparten las mismas
+páginas del sistema operativo. El hash de la cabecera permite detectar modelos obsoletos.
+"""
+from __future__ import annotations
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .nb_text import ArrayNaiveBayes, np
+
+MAGIC = b"CGNB"
+FORMAT_VERSION = 1
+MODEL_SUFFIX = ".cgnb"
+_HEADER = struct.Struct("<4sHH16sIIQ")
+
+
+class StaleModelError(ValueError):
+    """El archivo existe pero fue entrenado con otro set (hash distinto) o tiene otro formato."""
+
+
+def model_path(model_dir: str | Path, train_hash: str) -> Path:
+    return Path(model_dir) / f"{train_hash}{MODEL_SUFFIX}"
+
+
+def _hash_bytes(train_hash: str) -> bytes:
+    raw = bytes.fromhex(train_hash)
+    return raw[:16].ljust(16, b"\0")
+
+
+def save_model(model: ArrayNaiveBayes, path: str | Path, train_hash: str) -> Path:
+    """Escribe el modelo de forma atómica (archivo temporal + rename)."""
+    if np is None:
+        raise RuntimeError("save_model requiere numpy instalado")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tokens = sorted(model.vocab, key=model.vocab.__getitem__)
+    vocab_blob = "\n".join(tokens).encode("utf-8")
+    classes_blob = b"".join(
+        struct.pack("<H", len(c.encode("utf-8"))) + c.encode("utf-8") for c in model.classes
+    )
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, _hash_bytes(train_hash), len(model.classes), len(tokens), len(vocab_blob)
+    )
+    head = header + classes_blob
+    padding = b"\0" * (-len(head) % 8)
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    with open(tmp, "wb") as f:
+        f.write(head + padding)
+        f.write(np.ascontiguousarray(model.log_prior, dtype="<f4").tobytes())
+        f.write(np.ascontiguousarray(model.log_likelihood, dtype="<f4").tobytes())
+        f.write(vocab_blob)
+    os.replace(tmp, path)
+    return path
+
+
+def read_header(buf) -> Tuple[str, int, int, int, Tuple[str, ...], int]:
+    """Devuelve (hash, n_clases, vocab, bytes_vocab, clases, offset_arrays)."""
+    if len(buf) < _HEADER.size:
+        raise StaleModelError("archivo de modelo truncado")
+    magic, version, _reserved, raw_hash, n_classes, vocab_size, vocab_len = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise StaleModelError(f"formato de modelo no soportado ({magic!r} v{version})")
+    offset = _HEADER.size
+    classes = []
+    for _ in range(n_classes):
+        (n,) = struct.unpack_from("<H", buf, offset)
+        offset += 2
+        classes.append(bytes(buf[offset:offset + n]).decode("utf-8"))
+        offset += n
+    offset += -offset % 8
+    return raw_hash.hex(), n_classes, vocab_size, vocab_len, tuple(classes), offset
+
+
+def load_model(path: str | Path, expected_hash: Optional[str] = None, use_mmap: bool = True) -> ArrayNaiveBayes:
+    """Carga un modelo guardado con save_model.
+
+    Con use_mmap=True los arrays apuntan directamente al archivo mapeado (solo lectura).
+    Lanza StaleModelError si el hash no coincide con expected_hash o si el archivo está corrupto.
+    """
+    if np is None:
+        raise RuntimeError("load_model requiere numpy instalado")
+    try:
+        return _load(path, expected_hash, use_mmap)
+    except StaleModelError:
+        raise
+    except (struct.error, ValueError) as e:
+        # Archivo corrupto (vacío, cabecera o vocabulario ilegibles): se trata como obsoleto
+        raise StaleModelError(f"archivo de modelo corrupto: {e}") from e
+
+
+def _load(path: str | Path, expected_hash: Optional[str], use_mmap: bool) -> ArrayNaiveBayes:
+    with open(path, "rb") as f:
+        if use_mmap:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+    train_hash, n_classes, vocab_size, vocab_len, classes, offset = read_header(buf)
+    if expected_hash is not None and train_hash != _hash_bytes(expected_hash).hex():
+        raise StaleModelError(f"modelo obsoleto: hash {train_hash} != {expected_hash}")
+    cols = vocab_size + 1
+    expected_len = offset + 4 * (n_classes + n_classes * cols) + vocab_len
+    if len(buf) < expected_len:
+        raise StaleModelError("archivo de modelo truncado")
+    log_prior = np.frombuffer(buf, dtype="<f4", count=n_classes, offset=offset)
+    offset += 4 * n_classes
+    log_likelihood = np.frombuffer(buf, dtype="<f4", count=n_classes * cols, offset=offset).reshape(n_classes, cols)
+    offset += 4 * n_classes * cols
+    blob = bytes(buf[offset:offset + vocab_len]).decode("utf-8")
+    tokens = blob.split("\n") if vocab_size else []
+    vocab = {tok: i for i, tok in enumerate(tokens)}
+    return ArrayNaiveBayes(classes, vocab, log_prior, log_likelihood)
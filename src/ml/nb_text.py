@@ -1,18 +1,37 @@
 from __future__ import annotations
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence
 from collections import Counter
 from math import log, exp
 from .tokenizer import tokenize
 
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional: sin él se usa NaiveBayesText puro
+    np = None  # type: ignore[assignment]
+
 class NaiveBayesText:
-    def __init__(self, prior: Dict[str,float], likelihood: Dict[str,Dict[str,int]], vocab_size: int) -> None:
+    def __init__(
+        self,
+        prior: Dict[str,float],
+        likelihood: Dict[str,Dict[str,int]],
+        vocab_size: int,
+        doc_counts: Optional[Dict[str,int]] = None,
+    ) -> None:
         self.prior = prior
         self.likelihood = likelihood
         self.vocab_size = vocab_size
         self.class_totals = {c: sum(cnt.values()) for c, cnt in likelihood.items()}
+        # Documentos por clase (necesario para recalcular priors en aprendizaje incremental)
+        self.doc_counts: Dict[str,int] = dict(doc_counts) if doc_counts is not None else {c: 0 for c in prior}
+        # Frecuencia total por token (todas las clases): define el vocabulario vivo
+        self._token_totals: Counter = Counter()
+        for cnt in likelihood.values():
+            self._token_totals.update(cnt)
 
     def score(self, text: str) -> Dict[str, float]:
-        toks = tokenize(text)
+        return self.score_tokens(tokenize(text))
+
+    def score_tokens(self, toks: Sequence[str]) -> Dict[str, float]:
         logps: Dict[str, float] = {}
         # Log-posteriors proporcionales (sin normalizar) por clase
         for c, p in self.prior.items():
@@ -49,4 +68,137 @@ class NaiveBayesText:
                 cnt.update(doc)
                 vocab.update(doc)
             likelihood[c] = dict(cnt)
-        return NaiveBayesText(priors, likelihood, len(vocab) or 1)
+        return NaiveBayesText(priors, likelihood, len(vocab) or 1, {c: len(texts) for c, texts in examples.items()})
+
+    # --- Aprendizaje incremental: O(tokens del documento) por actualización ---
+    def _refresh_priors(self) -> None:
+        total_docs = sum(self.doc_counts.values()) or 1
+        self.prior = {c: max(1e-9, n / total_docs) for c, n in self.doc_counts.items()}
+
+    def add_document(self, text: str, label: str) -> None:
+        """Suma un ejemplo etiquetado a los conteos (equivale a re-entrenar con él incluido)."""
+        toks = tokenize(text)
+        cnt = self.likelihood.setdefault(label, {})
+        for tok in toks:
+            cnt[tok] = cnt.get(tok, 0) + 1
+            self._token_totals[tok] += 1
+        self.class_totals[label] = self.class_totals.get(label, 0) + len(toks)
+        self.doc_counts[label] = self.doc_counts.get(label, 0) + 1
+        self.vocab_size = len(self._token_totals) or 1
+        self._refresh_priors()
+
+    def remove_document(self, text: str, label: str) -> bool:
+        """Resta un ejemplo previamente aprendido. Devuelve False si la clase no tenía documentos."""
+        if self.doc_counts.get(label, 0) <= 0:
+            return False
+        cnt = self.likelihood.setdefault(label, {})
+        removed = 0
+        for tok in tokenize(text):
+            n = cnt.get(tok, 0)
+            if n <= 0:
+                continue
+            removed += 1
+            if n == 1:
+                del cnt[tok]
+            else:
+                cnt[tok] = n - 1
+            left = self._token_totals[tok] - 1
+            if left <= 0:
+                del self._token_totals[tok]
+            else:
+                self._token_totals[tok] = left
+        self.class_totals[label] = max(0, self.class_totals.get(label, 0) - removed)
+        self.doc_counts[label] -= 1
+        self.vocab_size = len(self._token_totals) or 1
+        self._refresh_priors()
+        return True
+
+    def partial_fit(self, texts: Sequence[str], labels: Sequence[str]) -> "NaiveBayesText":
+        """Actualiza el modelo con nuevos ejemplos sin re-entrenar desde cero."""
+        for text, label in zip(texts, labels):
+            self.add_document(text, label)
+        return self
+
+
+def _softmax_probs(classes: Sequence[str], logps) -> Dict[str, float]:
+    # Misma salida que NaiveBayesText.score: softmax sobre clases + claves toxic/spam garantizadas
+    if not len(classes):
+        return {"toxic": 0.0, "spam": 0.0}
+    exps = np.exp(logps - logps.max())
+    z = float(exps.sum()) or 1.0
+    probs = {c: float(v / z) for c, v in zip(classes, exps.tolist())}
+    for k in ("toxic", "spam"):
+        probs.setdefault(k, 0.0)
+    return probs
+
+
+# Tipo de los arrays de ArrayNaiveBayes (ver su docstring)
+DTYPE = "float32"
+
+
+class ArrayNaiveBayes:
+    """Versión vectorizada (NumPy) de NaiveBayesText para scoring.
+
+    - vocab: token -> índice de columna. La última columna representa tokens fuera de vocabulario.
+    - log_likelihood: matriz (clases x vocab+1) con el suavizado de Laplace ya aplicado.
+    - Los arrays son siempre float32 (el formato en disco de model_store): un modelo recién
+      entrenado y uno cargado del archivo dan los mismos scores y ocupan lo mismo en caché.
+    El score de un texto es un gather de columnas + suma; score_batch puntúa muchos textos a la vez.
+    """
+
+    def __init__(self, classes: Sequence[str], vocab: Dict[str, int], log_prior, log_likelihood) -> None:
+        if np is None:
+            raise RuntimeError("ArrayNaiveBayes requiere numpy instalado")
+        self.classes = tuple(classes)
+        self.vocab = vocab
+        # Sin copia si ya son float32 (p. ej. mapeados del archivo)
+        self.log_prior = np.asarray(log_prior, dtype=DTYPE)
+        self.log_likelihood = np.asarray(log_likelihood, dtype=DTYPE)
+        self.unknown_index = log_likelihood.shape[1] - 1
+
+    @classmethod
+    def from_model(cls, model: NaiveBayesText) -> "ArrayNaiveBayes":
+        if np is None:
+            raise RuntimeError("ArrayNaiveBayes requiere numpy instalado")
+        classes = list(model.prior.keys())
+        tokens = sorted({tok for cnt in model.likelihood.values() for tok in cnt})
+        vocab = {tok: i for i, tok in enumerate(tokens)}
+        counts = np.zeros((len(classes), len(tokens) + 1), dtype=np.float64)
+        for ci, c in enumerate(classes):
+            for tok, n in model.likelihood.get(c, {}).items():
+                counts[ci, vocab[tok]] = n
+        denom = np.array(
+            [max(model.class_totals.get(c, 0) + model.vocab_size, 1) for c in classes], dtype=np.float64
+        )
+        # Laplace: log((count + 1) / denom); la columna final (count=0) cubre tokens desconocidos
+        log_likelihood = np.log(counts + 1.0) - np.log(denom)[:, None]
+        log_prior = np.log(np.array([max(model.prior[c], 1e-9) for c in classes], dtype=np.float64))
+        return cls(classes, vocab, log_prior, log_likelihood)
+
+    def _indices(self, toks: Sequence[str]):
+        get, unk = self.vocab.get, self.unknown_index
+        return np.fromiter((get(t, unk) for t in toks), dtype=np.intp, count=len(toks))
+
+    def score_tokens(self, toks: Sequence[str]) -> Dict[str, float]:
+        # Acumulado en float64, igual que score_tokens_batch (bincount)
+        logps = self.log_prior + self.log_likelihood[:, self._indices(toks)].sum(axis=1, dtype=np.float64)
+        return _softmax_probs(self.classes, logps)
+
+    def score(self, text: str) -> Dict[str, float]:
+        return self.score_tokens(tokenize(text))
+
+    def score_batch(self, texts: Sequence[str]) -> List[Dict[str, float]]:
+        """Puntúa varios textos en una sola pasada vectorizada."""
+        return self.score_tokens_batch([tokenize(t) for t in texts])
+
+    def score_tokens_batch(self, docs: Sequence[Sequence[str]]) -> List[Dict[str, float]]:
+        n = len(docs)
+        if n == 0:
+            return []
+        lengths = np.fromiter((len(d) for d in docs), dtype=np.intp, count=n)
+        idx = self._indices([tok for d in docs for tok in d])
+        rows = np.repeat(np.arange(n), lengths)
+        # Suma por documento de las log-verosimilitudes de sus tokens (una fila por clase)
+        per_class = [np.bincount(rows, weights=self.log_likelihood[ci, idx], minlength=n) for ci in range(len(self.classes))]
+        logps = np.stack(per_class, axis=1) + self.log_prior if per_class else np.zeros((n, 0))
+        return [_softmax_probs(self.classes, row) for row in logps]
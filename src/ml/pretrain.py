@@ -0,0 +1,70 @@
+"""Pre-entrena los modelos ML de todos los chats definidos en config/rules.yaml.
+
+Modo de uso (p. ej. al construir la imagen Docker):
+
+python -m src.ml.pretrain --out models
+
+Opciones:
+    --out PATH   Carpeta destino (por defecto: ML_MODEL_DIR o ./models)
+    --force      Re-entrena aunque exista un modelo válido con el mismo hash
+
+En ejecución, define ML_MODEL_DIR con la misma carpeta para que el runtime cargue
+los modelos mapeados en memoria en lugar de entrenarlos con el primer mensaje.
+Chats con el mismo set de entrenamiento comparten archivo (se nombra por hash).
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.config.rules_loader import _load_rules, get_moderation_plan
+from src.ml.model_store import StaleModelError, load_model, model_path, save_model
+from src.ml.nb_text import np
+from src.ml.runtime import train_model
+
+
+def pretrain_all(out_dir: Path, force: bool = False) -> int:
+    """Entrena y guarda un modelo por hash de entrenamiento. Devuelve cuántos se escribieron."""
+    written = 0
+    done = set()
+    for key in _load_rules().keys():
+        plan = get_moderation_plan(key)
+        train_hash = plan.ml_training_hash
+        if not train_hash or train_hash in done:
+            continue
+        done.add(train_hash)
+        path = model_path(out_dir, train_hash)
+        if not force:
+            try:
+                load_model(path, expected_hash=train_hash, use_mmap=False)
+                print(f"[pretrain] {key}: vigente {path.name}")
+                continue
+            except (FileNotFoundError, StaleModelError):
+                pass
+        model = train_model(dict(plan.config.get("ml") or {}), vectorized=True)
+        save_model(model, path, train_hash)
+        written += 1
+        print(f"[pretrain] {key}: guardado {path.name} (vocab={len(model.vocab)})")
+    return written
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-entrena modelos ML desde rules.yaml")
+    parser.add_argument("--out", default=os.getenv("ML_MODEL_DIR") or "models")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args(argv)
+    if np is None:
+        print("[pretrain] numpy no está instalado; no se pueden generar modelos vectorizados")
+        return 1
+    n = pretrain_all(Path(args.out), force=args.force)
+    print(f"[pretrain] {n} modelo(s) escritos en {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,16 @@
 from __future__ import annotations
-from typing import Dict, Any, Tuple
-from .nb_text import NaiveBayesText
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from .nb_text import ArrayNaiveBayes, NaiveBayesText, np
+from .feedback import feedback_store
+from .model_store import StaleModelError, load_model, model_path, save_model
+from src.utils.logging import log_error_event
+
+_CLASSES = ("toxic", "spam", "normal")
 
-# Memoización manual de modelos por (chat_id, firma_entrenamiento)
-_MODEL_CACHE: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]], 'Scorer'] = {}
 
 def get_training_from_config(ml_cfg: dict) -> dict:
     training = (ml_cfg.get("training") or {})
@@ -23,20 +30,243 @@ def _training_signature(ml_cfg: dict) -> Tuple[Tuple[str, ...], Tuple[str, ...],
     return tox, spm, nor
 
 
-def get_moderation_scorer(chat_id: str, ml_cfg: dict) -> 'Scorer':
+def _use_vectorized(ml_cfg: dict) -> bool:
+    return np is not None and bool(ml_cfg.get("vectorized", True))
+
+
+def training_hash(ml_cfg: dict) -> str:
+    """Hash de contenido del set de entrenamiento (independiente del orden de los ejemplos).
+    Se calcula una vez por generación de reglas (ver ModerationPlan.ml_training_hash);
+    chats con el mismo entrenamiento comparten modelo.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for cls, examples in zip(_CLASSES, _training_signature(ml_cfg)):
+        h.update(cls.encode("utf-8") + b"\0")
+        for ex in examples:
+            h.update(ex.encode("utf-8") + b"\n")
+        h.update(b"\1")
+    return h.hexdigest()
+
+
+def _estimate_model_bytes(model: NaiveBayesText | ArrayNaiveBayes) -> int:
+    # Estimación aproximada: suficiente para acotar memoria, no para contabilidad exacta
+    if isinstance(model, ArrayNaiveBayes):
+        return int(model.log_likelihood.nbytes) + 100 * len(model.vocab)
+    return 120 * sum(len(cnt) for cnt in model.likelihood.values())
+
+
+class ModelCache:
+    """LRU acotado por número de modelos y por memoria estimada, con métricas."""
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self._data: "OrderedDict[Tuple[Any, ...], Tuple[Scorer, int]]" = OrderedDict()
+        self._lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional["Scorer"]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Tuple[Any, ...], scorer: "Scorer") -> None:
+        size = _estimate_model_bytes(scorer.model)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (scorer, size)
+            self.bytes += size
+            # Expulsar los menos usados; siempre se conserva el recién insertado
+            while len(self._data) > 1 and (
+                len(self._data) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                _k, (_s, sz) = self._data.popitem(last=False)
+                self.bytes -= sz
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Modelos compartidos entre chats, indexados por (hash_entrenamiento, vectorizado).
+# Los chats con feedback de admins tienen modelo propio: (hash, vectorizado, chat_id).
+_MODEL_CACHE = ModelCache(
+    max_entries=int(os.getenv("ML_MODEL_CACHE_SIZE", "128")),
+    max_bytes=int(os.getenv("ML_MODEL_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+)
+
+
+def model_cache_stats() -> Dict[str, int]:
+    return _MODEL_CACHE.stats()
+
+
+def _model_dir() -> str:
+    # Directorio opcional de modelos persistidos (ver src/ml/model_store.py y src/ml/pretrain.py)
+    return os.getenv("ML_MODEL_DIR", "").strip()
+
+
+def train_model(ml_cfg: dict, vectorized: bool = True) -> NaiveBayesText | ArrayNaiveBayes:
     sig = _training_signature(ml_cfg)
-    key = (str(chat_id), sig[0], sig[1], sig[2])
+    training = {"toxic": list(sig[0]), "spam": list(sig[1]), "normal": list(sig[2])}
+    model = NaiveBayesText.train(training)
+    return ArrayNaiveBayes.from_model(model) if vectorized else model
+
+
+def _load_or_train(ml_cfg: dict, train_hash: str, vectorized: bool) -> NaiveBayesText | ArrayNaiveBayes:
+    model_dir = _model_dir()
+    if not (vectorized and model_dir):
+        return train_model(ml_cfg, vectorized)
+    path = model_path(model_dir, train_hash)
+    try:
+        # Modelo pre-entrenado: se mapea en memoria (solo lectura, compartido entre procesos)
+        return load_model(path, expected_hash=train_hash)
+    except FileNotFoundError:
+        pass
+    except (StaleModelError, ValueError, OSError) as e:
+        # Obsoleto o corrupto (ValueError incluye UnicodeDecodeError): se re-entrena y se sobrescribe
+        log_error_event("ml_model_load_error", path=str(path), error=str(e))
+    model = train_model(ml_cfg, vectorized)
+    try:
+        save_model(model, path, train_hash)
+    except Exception as e:
+        # Persistir es una optimización: si falla, se sigue con el modelo en memoria
+        log_error_event("ml_model_save_error", path=str(path), error=str(e))
+    return model
+
+
+def get_moderation_scorer(chat_id: str, ml_cfg: dict, train_hash: Optional[str] = None) -> 'Scorer':
+    """Devuelve el scorer del chat. Si se pasa train_hash (precalculado en el plan de moderación)
+    se evita recorrer el set de entrenamiento en cada mensaje.
+    """
+    # Modelo vectorizado (NumPy) por defecto; ml.vectorized: false fuerza el modelo puro
+    vectorized = _use_vectorized(ml_cfg)
+    train_hash = train_hash or training_hash(ml_cfg)
+    if feedback_store.has_feedback(str(chat_id)):
+        key: Tuple[Any, ...] = (train_hash, vectorized, str(chat_id))
+        scorer = _MODEL_CACHE.get(key)
+        pending = feedback_store.count(str(chat_id))
+        # Sin caché, o archivo de feedback reemplazado/truncado: se reconstruye desde el modelo base
+        if scorer is None or pending < scorer.applied:
+            scorer = _build_online_scorer(str(chat_id), ml_cfg, vectorized)
+            _MODEL_CACHE.put(key, scorer)
+        # Deltas nuevos (de este proceso o de otros que comparten el archivo)
+        elif pending > scorer.applied:
+            scorer.sync(feedback_store.deltas_for(str(chat_id)))
+        return scorer
+    key = (train_hash, vectorized)
     scorer = _MODEL_CACHE.get(key)
     if scorer is None:
-        training = {"toxic": list(sig[0]), "spam": list(sig[1]), "normal": list(sig[2])}
-        model = NaiveBayesText.train(training)
-        scorer = Scorer(model)
-        _MODEL_CACHE[key] = scorer
+        scorer = Scorer(_load_or_train(ml_cfg, train_hash, vectorized))
+        _MODEL_CACHE.put(key, scorer)
+    return scorer
+
+
+def _build_online_scorer(chat_id: str, ml_cfg: dict, vectorized: bool) -> "Scorer":
+    # Modelo base (conteos) + deltas persistidos del chat, aplicados incrementalmente
+    counts = train_model(ml_cfg, vectorized=False)
+    scorer = Scorer(ArrayNaiveBayes.from_model(counts) if vectorized else counts, counts=counts)
+    scorer.sync(feedback_store.deltas_for(chat_id))
     return scorer
 
+
+def apply_feedback(chat_id: str, ml_cfg: dict, text: str, label: str, op: str = "add", train_hash: Optional[str] = None) -> bool:
+    """Aplica un delta ya persistido (ver src/ml/feedback.py) al modelo del chat, construyéndolo si
+    no estaba en caché. Devuelve si ese delta cambió el modelo (False, p. ej., al quitar un ejemplo
+    de una clase que no tiene ninguno).
+    """
+    scorer = get_moderation_scorer(chat_id, ml_cfg, train_hash)
+    deltas = feedback_store.deltas_for(chat_id)
+    # El delta recién registrado es el último igual a (op, label, text) en el orden del archivo
+    delta = (op, label, text)
+    for i in range(len(deltas) - 1, -1, -1):
+        if deltas[i] == delta:
+            return scorer.outcome(i)
+    return False
+
 class Scorer:
-    def __init__(self, model: NaiveBayesText) -> None:
+    def __init__(self, model: NaiveBayesText | ArrayNaiveBayes, counts: Optional[NaiveBayesText] = None) -> None:
         self.model = model
+        # Conteos editables (solo en modelos con aprendizaje incremental)
+        self.counts = counts
+        # Deltas del FeedbackStore ya aplicados y si cada uno cambió el modelo
+        self.applied = 0
+        self._outcomes: List[bool] = []
+        self._dirty = False
+        self._lock = Lock()
+    def learn(self, text: str, label: str, op: str = "add") -> bool:
+        """Aplica un ejemplo a los conteos. Devuelve False si no cambió nada."""
+        if self.counts is None:
+            raise RuntimeError("Este scorer no admite aprendizaje incremental")
+        with self._lock:
+            return self._learn(text, label, op)
+    def _learn(self, text: str, label: str, op: str) -> bool:
+        if op == "remove":
+            changed = self.counts.remove_document(text, label)
+        else:
+            self.counts.add_document(text, label)
+            changed = True
+        # El modelo vectorizado se regenera de forma diferida en el próximo score
+        self._dirty = self._dirty or (changed and self.model is not self.counts)
+        return changed
+    def sync(self, deltas: Sequence[Tuple[str, str, str]]) -> None:
+        """Aplica los deltas (op, label, text) del chat que aún no se aplicaron."""
+        if self.counts is None:
+            raise RuntimeError("Este scorer no admite aprendizaje incremental")
+        with self._lock:
+            for op, label, text in deltas[self.applied:]:
+                self._outcomes.append(self._learn(text, label, op))
+            self.applied = max(self.applied, len(deltas))
+    def outcome(self, index: int) -> bool:
+        """Si el delta número `index` del chat cambió el modelo."""
+        with self._lock:
+            return index < len(self._outcomes) and self._outcomes[index]
+    def _current(self) -> NaiveBayesText | ArrayNaiveBayes:
+        if self._dirty:
+            with self._lock:
+                if self._dirty and self.counts is not None:
+                    self.model = ArrayNaiveBayes.from_model(self.counts)
+                    self._dirty = False
+        return self.model
     def score(self, text: str) -> Dict[str, float]:
-        s = self.model.score(text)
+        s = self._current().score(text)
+        return {"toxic": float(s.get("toxic", 0.0)), "spam": float(s.get("spam", 0.0))}
+    def score_tokens(self, toks: Sequence[str]) -> Dict[str, float]:
+        """Igual que score() pero con tokens ya calculados (MessageFeatures.tokens)."""
+        s = self._current().score_tokens(toks)
         return {"toxic": float(s.get("toxic", 0.0)), "spam": float(s.get("spam", 0.0))}
+    def score_tokens_batch(self, docs: Sequence[Sequence[str]]) -> List[Dict[str, float]]:
+        model = self._current()
+        if isinstance(model, ArrayNaiveBayes):
+            results = model.score_tokens_batch(docs)
+        else:
+            results = [model.score_tokens(toks) for toks in docs]
+        return [{"toxic": float(s.get("toxic", 0.0)), "spam": float(s.get("spam", 0.0))} for s in results]
+    def score_batch(self, texts: Sequence[str]) -> List[Dict[str, float]]:
+        model = self._current()
+        if isinstance(model, ArrayNaiveBayes):
+            results = model.score_batch(texts)
+        else:
+            results = [model.score(t) for t in texts]
+        return [{"toxic": float(s.get("toxic", 0.0)), "spam": float(s.get("spam", 0.0))} for s in results]
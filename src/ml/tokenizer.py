@@ -1,22 +1,31 @@
 import re
-import unicodedata
+from functools import lru_cache
 from typing import List
 
+from src.nlu.language_utils import SHORT_TEXT_MAX_LEN, fold_text
+
 _WS = re.compile(r"\s+")
 _PUNCT = re.compile(r"[\.,!\?;:\-_/\\\(\)\[\]\{\}\*\"']+")
 
 STOPWORDS = {"el","la","los","las","un","una","de","del","y","o","u","a","en","que","por","para","con","se","es","lo","al","como","no","si","su","sus","mi","mis","tu","tus"}
 
-def normalize(text: str) -> str:
-    t = text.lower()
-    # Quitar acentos/diacríticos para alinear variaciones (rápido -> rapido)
-    t = unicodedata.normalize('NFD', t)
-    t = ''.join(ch for ch in t if unicodedata.category(ch) != 'Mn')
+def _normalize(text: str) -> str:
+    # fold_text: minúsculas + quitar acentos/diacríticos (rápido -> rapido)
+    t = fold_text(text)
     t = _PUNCT.sub(" ", t)
     t = _WS.sub(" ", t).strip()
     return t
 
 
+_normalize_cached = lru_cache(maxsize=4096)(_normalize)
+
+
+def normalize(text: str) -> str:
+    if len(text) <= SHORT_TEXT_MAX_LEN:
+        return _normalize_cached(text)
+    return _normalize(text)
+
+
 def tokenize(text: str) -> List[str]:
     t = normalize(text)
     return [tok for tok in t.split(" ") if tok and tok not in STOPWORDS]
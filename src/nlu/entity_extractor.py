@@ -5,31 +5,36 @@ Soporta: name, question, options, participants
 import re
 from typing import Dict, Any
 
+_NAME_RE = re.compile(r"(?:soy|me llamo)\s+([A-Za-zÁÉÍÓÚÑáéíóúñ0-9_\-]+)", re.IGNORECASE)
+_QUESTION_RE = re.compile(r'"([^"]{3,})"')
+_OPTIONS_RE = re.compile(r"\[(.*?)\]")
+_PARTICIPANTS_RE = re.compile(r"\((.*?)\)")
+
 
 def extraer_entidades(texto: str) -> Dict[str, Any]:
 	entities: Dict[str, Any] = {}
 
 	# name: "soy <nombre>" o "me llamo <nombre>"
-	m = re.search(r"(?:soy|me llamo)\s+([A-Za-zÁÉÍÓÚÑáéíóúñ0-9_\-]+)", texto, re.IGNORECASE)
+	m = _NAME_RE.search(texto)
 	if m:
 		entities["name"] = m.group(1)
 
 	# survey: pregunta entre comillas "..." y opciones separadas por coma
-	q = re.search(r'"([^"]{3,})"', texto)
+	q = _QUESTION_RE.search(texto) if '"' in texto else None
 	if q:
 		entities["question"] = q.group(1)
-	opts = re.findall(r"\[(.*?)\]", texto)
+	# primera lista [a,b,c] (search basta: solo se usa la primera)
+	opts = _OPTIONS_RE.search(texto) if "[" in texto else None
 	if opts:
-		# primera lista [a,b,c]
-		raw = opts[0]
+		raw = opts.group(1)
 		parts = [p.strip() for p in raw.split(',') if p.strip()]
 		if len(parts) >= 2:
 			entities["options"] = parts
 
 	# raffle: participantes entre paréntesis (a,b,c)
-	p = re.findall(r"\((.*?)\)", texto)
+	p = _PARTICIPANTS_RE.search(texto) if "(" in texto else None
 	if p:
-		rawp = p[0]
+		rawp = p.group(1)
 		ppl = [x.strip() for x in rawp.split(',') if x.strip()]
 		if ppl:
 			entities["participants"] = ppl
@@ -0,0 +1,88 @@
+"""Análisis de un mensaje en una sola pasada, compartido por moderación, ML y NLU.
+
+El BotManager construye un MessageFeatures por mensaje; cada etapa lee de aquí en lugar de
+volver a recorrer el texto. Los rasgos costosos (tokens, entidades, intención) se calculan
+la primera vez que se piden y quedan memorizados en el propio objeto.
+"""
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.nlu.language_utils import fold_text
+
+_URL_PREFIXES = ("http://", "https://", "www.")
+
+
+class MessageFeatures:
+	__slots__ = ("text", "normalized", "length", "_tokens", "_urls", "_caps_ratio", "_entities", "_intent", "ml_scores", "timings")
+
+	def __init__(self, text: str, normalized: Optional[str] = None) -> None:
+		# text: texto sanitizado (conserva mayúsculas/tildes); normalized: minúsculas, sin acentos
+		self.text = text or ""
+		self.normalized = fold_text(self.text) if normalized is None else normalized
+		self.length = len(self.normalized)
+		self._tokens: Optional[List[str]] = None
+		self._urls: Optional[Tuple[str, ...]] = None
+		self._caps_ratio: Optional[int] = None
+		self._entities: Optional[Dict[str, Any]] = None
+		self._intent: Optional[str] = None
+		# Scores ML precalculados en lote (BotManager.process_batch); None = calcular al moderar
+		self.ml_scores: Optional[Dict[str, float]] = None
+		# Milisegundos por etapa (se rellena con measure())
+		self.timings: Dict[str, float] = {}
+
+	@property
+	def tokens(self) -> List[str]:
+		"""Tokens del modelo ML (sin stopwords ni puntuación)."""
+		if self._tokens is None:
+			from src.ml.tokenizer import tokenize
+			self._tokens = tokenize(self.normalized)
+		return self._tokens
+
+	@property
+	def urls(self) -> Tuple[str, ...]:
+		"""Palabras que parecen enlaces (http://, https://, www.), sobre el texto normalizado."""
+		if self._urls is None:
+			self._urls = tuple(tok for tok in self.normalized.split() if tok.startswith(_URL_PREFIXES))
+		return self._urls
+
+	@property
+	def first_url(self) -> Optional[str]:
+		urls = self.urls
+		return urls[0] if urls else None
+
+	@property
+	def caps_ratio(self) -> int:
+		"""Porcentaje entero de letras en mayúscula sobre el texto original (0 si no hay letras)."""
+		if self._caps_ratio is None:
+			letters = upper = 0
+			for c in self.text:
+				if c.isalpha():
+					letters += 1
+					if c.isupper():
+						upper += 1
+			self._caps_ratio = upper * 100 // letters if letters else 0
+		return self._caps_ratio
+
+	@property
+	def entities(self) -> Dict[str, Any]:
+		if self._entities is None:
+			from src.nlu.entity_extractor import extraer_entidades
+			self._entities = extraer_entidades(self.text)
+		return self._entities
+
+	@property
+	def intent(self) -> str:
+		if self._intent is None:
+			from src.nlu.intent_detector import detectar_intencion
+			self._intent = detectar_intencion(self.text)
+		return self._intent
+
+	@contextmanager
+	def measure(self, stage: str):
+		"""Acumula en timings[stage] el tiempo (ms) del bloque."""
+		start = perf_counter()
+		try:
+			yield self
+		finally:
+			self.timings[stage] = self.timings.get(stage, 0.0) + (perf_counter() - start) * 1000.0
@@ -1,2 +1,50 @@
+"""Normalización de texto compartida por el BotManager (intents/moderación) y el tokenizer ML."""
+import re
+import unicodedata
+from functools import lru_cache
+
+# Tabla de traducción para quitar diacríticos en Latin-1 + Latin Extended A/B (U+0080..U+024F),
+# que cubre el español y la gran mayoría del texto de los chats. Se genera con unicodedata
+# para que el resultado sea idéntico a NFD + descartar categoría 'Mn'.
+# Incluye también las entradas identidad (ASCII y letras sin acento): str.translate es bastante
+# más rápido cuando no tiene que resolver claves ausentes.
+_ACCENT_TABLE: dict[int, str] = {}
+for _cp in range(0x250):
+	_ch = chr(_cp)
+	_ACCENT_TABLE[_cp] = "".join(c for c in unicodedata.normalize("NFD", _ch) if unicodedata.category(c) != "Mn")
+del _cp, _ch
+
+# Cualquier carácter fuera de la tabla (griego, vietnamita, marcas combinantes sueltas...) usa NFD
+_OUTSIDE_TABLE = re.compile(r"[^\x00-\u024f]")
+
+# Mensajes cortos ("hola", "+1", stickers) se repiten mucho: se memorizan con un LRU acotado
+SHORT_TEXT_MAX_LEN = 64
+
+
 def normalize_text(text: str) -> str:
 	return (text or "").strip().lower()
+
+
+def strip_accents(text: str) -> str:
+	"""Quita diacríticos (rápido -> rapido). Equivale a NFD + filtrar marcas 'Mn'."""
+	if text.isascii():
+		return text
+	text = text.translate(_ACCENT_TABLE)
+	if _OUTSIDE_TABLE.search(text) is None:
+		return text
+	return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def _fold(text: str) -> str:
+	return strip_accents(" ".join(text.lower().split()))
+
+
+_fold_cached = lru_cache(maxsize=4096)(_fold)
+
+
+def fold_text(text: str) -> str:
+	"""Minúsculas, espacios colapsados y sin acentos. Memorizado para mensajes cortos."""
+	text = text or ""
+	if len(text) <= SHORT_TEXT_MAX_LEN:
+		return _fold_cached(text)
+	return _fold(text)
@@ -1,4 +1,14 @@
 # repository.py - Acceso y persistencia de datos para Bot Comunidad
+import heapq
+import json
+import os
+from collections import OrderedDict, deque
+from pathlib import Path
+from threading import RLock
+from typing import Dict, List, Optional, Tuple
+
+from src.storage.write_behind import WriteBehind
+from src.utils.sliding_window import InMemoryWindowStore, SlidingWindowCounter
 
 # Mockup: en producción usarías una DB real (SQLAlchemy, Mongo, etc)
 
@@ -43,73 +53,317 @@ class RaffleRepository:
         return self.raffles.get(raffle_id)
 
 
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class ModerationRecord:
+    """Estado de moderación de un (chat_id, user_id). Compacto (__slots__) y compatible con dict vía as_dict()."""
+    __slots__ = ("count", "muted_until", "banned", "last_violation", "last_seen")
+
+    def __init__(self, now: float):
+        self.count = 0
+        self.muted_until = None
+        self.banned = False
+        self.last_violation = now
+        self.last_seen = now
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "muted_until": self.muted_until, "banned": self.banned}
+
+
+_KIND_RECORD = 0
+# Fin de un mute: el registro vuelve a ser expulsable por el tope de memoria
+_KIND_MUTE = 1
+
+
 class ModerationRepository:
-    """Repositorio simple en memoria para infracciones por (chat_id, user_id).
-    Estructura: {(chat_id, user_id): {"count": int, "muted_until": timestamp|None, "banned": bool}}
-    Nota: Para producción, reemplazar por DB/Redis con expiración.
+    """Repositorio en memoria para infracciones por (chat_id, user_id), acotado en memoria.
+
+    - Registros ModerationRecord con __slots__ en un OrderedDict (orden LRU por última escritura).
+    - Índice de expiración (min-heap) con como mucho una entrada por clave: mutes vencidos e
+      infractores inactivos se eliminan de forma perezosa en O(log n) durante las operaciones normales.
+    - Antiflood con SlidingWindowCounter (O(1) amortizado; las ventanas inactivas se expulsan solas).
+    - decay_seconds: resta 1 infracción por cada periodo sin nuevas infracciones (0 = sin decay).
+    - record_ttl: segundos de inactividad tras los que se olvida un registro no baneado ni muteado (0 = nunca).
+    - max_records: tope de registros y de ventanas antiflood; al superarlo se expulsa el menos reciente
+      sin infracciones (o, si no hay, sin castigo vigente). Los mutes y bans vigentes no se expulsan.
+      Dos índices LRU de claves expulsables (sin infracciones / con infracciones y sin castigo) hacen
+      la expulsión O(1); el fin de cada mute se programa en el índice de expiración.
+
+    Los valores por defecto salen de MODERATION_VIOLATION_DECAY_SECONDS, MODERATION_RECORD_TTL_SECONDS
+    y MODERATION_MAX_RECORDS. stats() expone las métricas.
+    Para estado durable (sobrevive reinicios) ver SqlModerationRepository en sql_store.py;
+    para compartirlo entre réplicas, SharedModerationRepository en state_backend.py.
     """
-    def __init__(self):
+    def __init__(self, max_records: Optional[int] = None, record_ttl: Optional[float] = None, decay_seconds: Optional[float] = None):
         from time import time
-        self.records = {}
         self._time = time
-        # Ventana para antiflood: { (chat,user): [(ts1), (ts2), ...] }
-        self._msg_times = {}
+        self.max_records = int(max_records if max_records is not None else _env_number("MODERATION_MAX_RECORDS", 100_000))
+        self.record_ttl = float(record_ttl if record_ttl is not None else _env_number("MODERATION_RECORD_TTL_SECONDS", 7 * 86400))
+        self.decay_seconds = float(decay_seconds if decay_seconds is not None else _env_number("MODERATION_VIOLATION_DECAY_SECONDS", 0))
+        self.records: "OrderedDict[tuple, ModerationRecord]" = OrderedDict()
+        # Ventana para antiflood por (chat,user)
+        self._flood_store = InMemoryWindowStore(max_keys=self.max_records)
+        self._flood = SlidingWindowCounter(60, store=self._flood_store)
+        # Índice de expiración: (deadline, kind, key) + deadline vigente por (kind, key)
+        self._heap: list = []
+        self._scheduled: dict = {}
+        # Claves expulsables por el tope, en orden LRU: (sin infracciones, con infracciones y sin castigo)
+        self._evictable: Tuple["OrderedDict[tuple, None]", "OrderedDict[tuple, None]"] = (OrderedDict(), OrderedDict())
+        self._lock = RLock()
+        self._expired = 0
+        self._evicted = 0
+
+    # --- Índice de expiración ---
+    def _record_deadline(self, rec: ModerationRecord) -> Optional[float]:
+        if rec.banned:
+            return None
+        forget_at = None
+        if self.decay_seconds > 0:
+            forget_at = rec.last_violation + rec.count * self.decay_seconds
+        if self.record_ttl > 0:
+            idle_at = rec.last_seen + self.record_ttl
+            forget_at = idle_at if forget_at is None else min(forget_at, idle_at)
+        if forget_at is None:
+            return None
+        return max(forget_at, rec.muted_until or 0.0)
+
+    def _schedule(self, kind: int, key: tuple, deadline: Optional[float]) -> None:
+        if deadline is None:
+            return
+        current = self._scheduled.get((kind, key))
+        if current is None or deadline < current:
+            self._scheduled[(kind, key)] = deadline
+            heapq.heappush(self._heap, (deadline, kind, key))
+
+    def _expire(self, now: float) -> None:
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, kind, key = heapq.heappop(heap)
+            if self._scheduled.get((kind, key)) != deadline:
+                continue  # entrada obsoleta (se reprogramó antes)
+            del self._scheduled[(kind, key)]
+            rec = self.records.get(key)
+            if kind == _KIND_MUTE:
+                if rec is not None:
+                    self._index(key, rec, now)
+                continue
+            actual = self._record_deadline(rec) if rec is not None else None
+            if rec is None or actual is None:
+                continue
+            if actual > now:
+                self._schedule(kind, key, actual)
+            else:
+                self._drop(key)
+                self._expired += 1
+                self._forgotten(key)
+
+    def _index(self, key: tuple, rec: ModerationRecord, now: float) -> None:
+        """Reclasifica la clave en los índices de expulsión (al final: la más reciente)."""
+        clean, punished = self._evictable
+        clean.pop(key, None)
+        punished.pop(key, None)
+        if rec.banned:
+            return
+        if rec.muted_until is not None and rec.muted_until > now:
+            self._schedule(_KIND_MUTE, key, rec.muted_until)
+            return
+        (punished if rec.count else clean)[key] = None
+
+    def _updated(self, key: tuple, rec: ModerationRecord, now: float) -> None:
+        # Tras cada escritura del registro: expiración e índices de expulsión
+        self._schedule(_KIND_RECORD, key, self._record_deadline(rec))
+        self._index(key, rec, now)
+
+    def _drop(self, key: tuple) -> None:
+        del self.records[key]
+        for kind in (_KIND_RECORD, _KIND_MUTE):
+            self._scheduled.pop((kind, key), None)
+        for index in self._evictable:
+            index.pop(key, None)
+
+    def _enforce_cap(self) -> None:
+        # Un mute o ban vigente nunca se expulsa: si todos lo están, se supera el tope antes que
+        # perderlos. El registro recién creado aún no está en los índices, así que tampoco.
+        while len(self.records) > self.max_records > 0:
+            index = next((i for i in self._evictable if i), None)
+            if index is None:
+                break
+            key, _ = index.popitem(last=False)
+            self._drop(key)
+            self._evicted += 1
+
+    def _decay(self, rec: ModerationRecord, now: float) -> None:
+        if self.decay_seconds > 0 and rec.count:
+            steps = int((now - rec.last_violation) // self.decay_seconds)
+            if steps > 0:
+                rec.count = max(0, rec.count - steps)
+                rec.last_violation += steps * self.decay_seconds
+
+    # --- Puntos de extensión para stores persistentes (no-op en memoria) ---
+    def _refresh(self, key: tuple) -> None:
+        """Se llama sin el lock antes de leer o escribir la clave: un store persistente carga aquí
+        el registro (E/S fuera del lock del repositorio)."""
+
+    def _lookup(self, key: tuple, now: float) -> Optional[ModerationRecord]:
+        """Registro de la clave o None. Un store persistente lo carga aquí si no está en memoria."""
+        return self.records.get(key)
+
+    def _changed(self, key: tuple, rec: ModerationRecord) -> None:
+        """Se llama tras cada escritura del registro."""
 
+    def _forgotten(self, key: tuple) -> None:
+        """Se llama cuando el registro expira o se resetea."""
+
+    def _touch(self, key: tuple, now: float) -> ModerationRecord:
+        # Obtiene o crea el registro y lo marca como el más reciente
+        self._expire(now)
+        rec = self._lookup(key, now)
+        if rec is None:
+            rec = self.records[key] = ModerationRecord(now)
+            self._enforce_cap()
+        else:
+            self.records.move_to_end(key)
+            self._decay(rec, now)
+        rec.last_seen = now
+        return rec
+
+    # --- API pública ---
     def get_record(self, chat_id: str, user_id: str):
-        return self.records.get((str(chat_id), str(user_id)), {"count": 0, "muted_until": None, "banned": False})
+        key = (str(chat_id), str(user_id))
+        self._refresh(key)
+        with self._lock:
+            now = self._time()
+            rec = self._lookup(key, now)
+            if rec is None:
+                return {"count": 0, "muted_until": None, "banned": False}
+            self._decay(rec, now)
+            return rec.as_dict()
 
     def add_violation(self, chat_id: str, user_id: str) -> int:
         key = (str(chat_id), str(user_id))
-        rec = self.records.get(key) or {"count": 0, "muted_until": None, "banned": False}
-        rec["count"] = rec.get("count", 0) + 1
-        self.records[key] = rec
-        return rec["count"]
+        self._refresh(key)
+        with self._lock:
+            now = self._time()
+            rec = self._touch(key, now)
+            rec.count += 1
+            rec.last_violation = now
+            self._updated(key, rec, now)
+            self._changed(key, rec)
+            return rec.count
 
     def set_muted(self, chat_id: str, user_id: str, seconds: int):
         key = (str(chat_id), str(user_id))
-        rec = self.records.get(key) or {"count": 0, "muted_until": None, "banned": False}
-        rec["muted_until"] = self._time() + int(seconds)
-        self.records[key] = rec
+        self._refresh(key)
+        with self._lock:
+            now = self._time()
+            rec = self._touch(key, now)
+            rec.muted_until = now + int(seconds)
+            self._updated(key, rec, now)
+            self._changed(key, rec)
 
     def is_muted(self, chat_id: str, user_id: str) -> bool:
         key = (str(chat_id), str(user_id))
-        rec = self.records.get(key)
-        if not rec or rec.get("muted_until") is None:
-            return False
-        return rec["muted_until"] > self._time()
+        self._refresh(key)
+        with self._lock:
+            now = self._time()
+            rec = self._lookup(key, now)
+            if not rec or rec.muted_until is None:
+                return False
+            return rec.muted_until > now
 
     def set_banned(self, chat_id: str, user_id: str, banned: bool = True):
         key = (str(chat_id), str(user_id))
-        rec = self.records.get(key) or {"count": 0, "muted_until": None, "banned": False}
-        rec["banned"] = banned
-        self.records[key] = rec
+        self._refresh(key)
+        with self._lock:
+            now = self._time()
+            rec = self._touch(key, now)
+            rec.banned = banned
+            self._updated(key, rec, now)
+            self._changed(key, rec)
 
     def reset(self, chat_id: str, user_id: str):
-        self.records.pop((str(chat_id), str(user_id)), None)
+        with self._lock:
+            key = (str(chat_id), str(user_id))
+            if key in self.records:
+                self._drop(key)
+            self._forgotten(key)
 
     # --- Antiflood: registrar mensaje y validar límite por minuto ---
     def register_message(self, chat_id: str, user_id: str, window_seconds: int = 60) -> int:
-        key = (str(chat_id), str(user_id))
+        return self._flood.hit((str(chat_id), str(user_id)), self._time(), window_seconds)
+
+    def stats(self) -> dict:
+        """Métricas del repositorio (tamaños, expirados y expulsados por el tope de memoria)."""
         now = self._time()
-        times = self._msg_times.get(key, [])
-        times = [t for t in times if now - t <= window_seconds]
-        times.append(now)
-        self._msg_times[key] = times
-        return len(times)
+        self._flood_store.evict_idle(now)
+        with self._lock:
+            self._expire(now)
+            return {
+                "records": len(self.records),
+                "flood_windows": len(self._flood_store),
+                "expiry_index": len(self._heap),
+                "expired": self._expired,
+                "evicted": self._evicted,
+                "max_records": self.max_records,
+            }
 
 
 class AuditRepository:
-    """Repositorio simple en memoria para auditoría de acciones de moderación.
+    """Auditoría de acciones de moderación: cola en memoria acotada + log append-only en disco.
+
     Estructura de registro:
     {"ts": epoch, "bot_id": str, "group_id": str, "user_id": str, "action": str, "reason": str, "by": str|None}
+
+    - records: ring buffer con las últimas `max_records` acciones (AUDIT_MAX_RECORDS, por defecto 10000).
+    - Índices por grupo y por usuario sobre ese ring buffer: recent_actions() no recorre todo el
+      historial. Al salir un registro del ring buffer sale también de sus índices (siempre es el
+      más antiguo de cada uno), así que la memoria total sigue acotada por max_records.
+    - Con log_dir (AUDIT_LOG_DIR), cada acción se añade a segmentos JSON Lines (audit-<n>.jsonl,
+      rotados al superar AUDIT_SEGMENT_BYTES) que un hilo vuelca por lotes cada
+      AUDIT_FLUSH_INTERVAL s. Al arrancar se recarga la cola desde los segmentos más recientes.
     """
-    def __init__(self):
+    def __init__(self, max_records: Optional[int] = None, log_dir: Optional[str] = None,
+                 segment_bytes: Optional[int] = None, flush_interval: Optional[float] = None, background: bool = True):
         from time import time
         self._time = time
-        self.records = []
+        self.max_records = int(max_records if max_records is not None else _env_number("AUDIT_MAX_RECORDS", 10_000))
+        self.records: deque = deque()
+        self._by_group: Dict[str, deque] = {}
+        self._by_user: Dict[str, deque] = {}
+        self._lock = RLock()
+        log_dir = os.getenv("AUDIT_LOG_DIR", "") if log_dir is None else log_dir
+        self.log_dir = Path(log_dir) if log_dir else None
+        self.segment_bytes = int(segment_bytes if segment_bytes is not None else _env_number("AUDIT_SEGMENT_BYTES", 64 * 1024 * 1024))
+        self._pending: List[str] = []
+        self._segment: Optional[Path] = None
+        self._writer = None
+        if self.log_dir is not None:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            self._load_tail()
+            if background:
+                interval = float(flush_interval if flush_interval is not None else _env_number("AUDIT_FLUSH_INTERVAL", 1.0))
+                self._writer = WriteBehind(self.flush, interval, "audit-log")
+
+    # --- Memoria: ring buffer + índices ---
+    def _index(self, rec: dict) -> None:
+        self.records.append(rec)
+        self._by_group.setdefault(rec["group_id"], deque()).append(rec)
+        self._by_user.setdefault(rec["user_id"], deque()).append(rec)
+        while len(self.records) > self.max_records > 0:
+            old = self.records.popleft()
+            for index, key in ((self._by_group, old["group_id"]), (self._by_user, old["user_id"])):
+                entries = index[key]
+                entries.popleft()
+                if not entries:
+                    del index[key]
 
     def add_action(self, bot_id: str, group_id: str, user_id: str, action: str, reason: str = "", by: str | None = None):
-        self.records.append({
+        rec = {
             "ts": self._time(),
             "bot_id": str(bot_id),
             "group_id": str(group_id),
@@ -117,8 +371,129 @@ class AuditRepository:
             "action": action,
             "reason": reason,
             "by": by,
-        })
+        }
+        with self._lock:
+            self._index(rec)
+            if self.log_dir is not None:
+                self._pending.append(json.dumps(rec, ensure_ascii=False))
+        return rec
+
+    def recent_actions(self, group_id: Optional[str] = None, user_id: Optional[str] = None,
+                       limit: int = 50, action: Optional[str] = None) -> List[dict]:
+        """Últimas acciones (la más reciente primero), filtradas por grupo, usuario y/o acción."""
+        with self._lock:
+            if user_id is not None:
+                source = self._by_user.get(str(user_id), ())
+                if group_id is not None:
+                    by_group = self._by_group.get(str(group_id), ())
+                    if len(by_group) < len(source):
+                        source = by_group
+            elif group_id is not None:
+                source = self._by_group.get(str(group_id), ())
+            else:
+                source = self.records
+            out = []
+            for rec in reversed(source):
+                if group_id is not None and rec["group_id"] != str(group_id):
+                    continue
+                if user_id is not None and rec["user_id"] != str(user_id):
+                    continue
+                if action is not None and rec["action"] != action:
+                    continue
+                out.append(dict(rec))
+                if len(out) >= limit:
+                    break
+            return out
+
+    # --- Disco: segmentos JSON Lines append-only ---
+    def _segments(self) -> List[Path]:
+        return sorted(self.log_dir.glob("audit-*.jsonl"), key=lambda p: int(p.stem.split("-", 1)[1]))
+
+    def _load_tail(self) -> None:
+        # Lee los segmentos más nuevos hasta llenar el ring buffer y los indexa en orden
+        segments = self._segments()
+        if segments:
+            self._segment = segments[-1]
+        loaded: List[List[dict]] = []
+        total = 0
+        for seg in reversed(segments):
+            recs = []
+            with open(seg, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        recs.append(json.loads(line))
+                    except Exception:
+                        # Línea corrupta (p. ej. escritura cortada): se ignora
+                        continue
+            loaded.append(recs)
+            total += len(recs)
+            if total >= self.max_records > 0:
+                break
+        for recs in reversed(loaded):
+            for rec in recs:
+                self._index(rec)
+
+    def _current_segment(self) -> Path:
+        seg = self._segment
+        if seg is None or (seg.exists() and seg.stat().st_size >= self.segment_bytes):
+            n = int(seg.stem.split("-", 1)[1]) + 1 if seg is not None else 1
+            seg = self._segment = self.log_dir / f"audit-{n:08d}.jsonl"
+        return seg
+
+    def flush(self) -> int:
+        """Añade las acciones pendientes al segmento actual en una sola escritura."""
+        with self._lock:
+            lines, self._pending = self._pending, []
+            if not lines:
+                return 0
+            try:
+                with open(self._current_segment(), "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except Exception:
+                self._pending[:0] = lines
+                raise
+            return len(lines)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        elif self.log_dir is not None:
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "records": len(self.records),
+                "groups": len(self._by_group),
+                "users": len(self._by_user),
+                "pending_writes": len(self._pending),
+                "max_records": self.max_records,
+            }
+
+
+def _store_kind() -> str:
+    # MODERATION_STORE=memory (por defecto) | sql (SQLAlchemy + DB_URL, ver sql_store.py)
+    return os.getenv("MODERATION_STORE", "memory").strip().lower() or "memory"
+
+
+def create_moderation_repository() -> ModerationRepository:
+    # STATE_BACKEND=redis comparte el estado entre réplicas (ver state_backend.py) y tiene prioridad
+    from src.storage.state_backend import SharedModerationRepository, get_state_backend
+    backend = get_state_backend()
+    if backend is not None:
+        return SharedModerationRepository(backend)
+    if _store_kind() == "sql":
+        from src.storage.sql_store import SqlModerationRepository
+        return SqlModerationRepository()
+    return ModerationRepository()
+
+
+def create_audit_repository() -> AuditRepository:
+    if _store_kind() == "sql":
+        from src.storage.sql_store import SqlAuditRepository
+        return SqlAuditRepository()
+    return AuditRepository()
 
 
 # Instancias singleton simples para uso global
-audit_repo = AuditRepository()
+audit_repo = create_audit_repository()
@@ -0,0 +1,392 @@
+"""Estado de moderación y auditoría durables sobre SQLAlchemy (SQLite por defecto).
+
+Implementan la misma interfaz que ModerationRepository/AuditRepository en memoria:
+
+- Write-behind: las escrituras (infracciones, mutes, bans, acciones de auditoría) se aplican en
+  memoria al instante y se acumulan en un buffer que un hilo en segundo plano vuelca a la base
+  en upserts/inserts por lotes cada `flush_interval` segundos (o antes si el buffer llega a
+  `flush_batch`). El mensaje nunca espera a la base para escribir.
+- Read-through: is_muted/get_record leen de la caché en memoria; si la clave no está se consulta
+  la base una vez y se cachea el resultado, también el negativo ("sin registro"). Si la entrada
+  tiene más de `cache_ttl` segundos se sirve igual y el hilo write-behind la renueva en segundo
+  plano (en lote), así que una base lenta no frena el pipeline de moderación.
+
+Se activa con MODERATION_STORE=sql y usa el engine de src/storage/db.py (DB_URL).
+Las tablas se crean automáticamente si no existen.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Boolean, Column, Float, Integer, MetaData, String, Table, Text, and_, delete, insert, or_, select, tuple_
+from sqlalchemy.engine import Engine
+
+from src.storage.repository import AuditRepository, ModerationRecord, ModerationRepository, _env_number
+from src.storage.write_behind import WriteBehind
+from src.utils.logging import log_error_event
+
+metadata = MetaData()
+
+moderation_state = Table(
+    "moderation_state",
+    metadata,
+    Column("chat_id", String(100), primary_key=True),
+    Column("user_id", String(120), primary_key=True),
+    Column("count", Integer, nullable=False, default=0),
+    Column("muted_until", Float, nullable=True),
+    Column("banned", Boolean, nullable=False, default=False),
+    Column("last_violation", Float, nullable=False),
+    Column("last_seen", Float, nullable=False),
+)
+
+moderation_audit = Table(
+    "moderation_audit",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("ts", Float, nullable=False, index=True),
+    Column("bot_id", String(190), nullable=False),
+    Column("group_id", String(100), nullable=False, index=True),
+    Column("user_id", String(120), nullable=False),
+    Column("action", String(50), nullable=False),
+    Column("reason", Text),
+    Column("by_user", String(120)),
+)
+
+_STATE_COLUMNS = ("count", "muted_until", "banned", "last_violation", "last_seen")
+# Cada cuánto el hilo write-behind purga de la base los registros inactivos (segundos)
+_PURGE_INTERVAL = 3600.0
+
+
+def _default_engine() -> Engine:
+    from src.storage.db import engine
+    return engine
+
+
+def _upsert_statement(engine: Engine, table: Table, keys: Tuple[str, ...], columns: Tuple[str, ...]):
+    """INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE según el dialecto (None si no lo soporta)."""
+    name = engine.dialect.name
+    if name in ("sqlite", "postgresql"):
+        if name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(index_elements=list(keys), set_={c: stmt.excluded[c] for c in columns})
+    if name in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in columns})
+    return None
+
+
+class SqlModerationRepository(ModerationRepository):
+    """ModerationRepository durable: memoria como caché read-through + volcado write-behind a SQL.
+
+    Las ventanas antiflood siguen solo en memoria (son efímeras por naturaleza).
+    """
+
+    def __init__(
+        self,
+        engine: Optional[Engine] = None,
+        flush_interval: Optional[float] = None,
+        flush_batch: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+        background: bool = True,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.engine = engine if engine is not None else _default_engine()
+        metadata.create_all(self.engine, tables=[moderation_state], checkfirst=True)
+        self.flush_interval = float(flush_interval if flush_interval is not None else _env_number("MODERATION_FLUSH_INTERVAL", 1.0))
+        self.flush_batch = int(flush_batch if flush_batch is not None else _env_number("MODERATION_FLUSH_BATCH", 500))
+        self.cache_ttl = float(cache_ttl if cache_ttl is not None else _env_number("MODERATION_CACHE_TTL", 30.0))
+        # Buffer write-behind: clave -> fila a guardar (None = borrar). Se coalescen escrituras repetidas.
+        self._pending: Dict[tuple, Optional[Dict[str, Any]]] = {}
+        self._inflight: Dict[tuple, Optional[Dict[str, Any]]] = {}
+        # Última consulta a la base por clave: (momento, existía). Acotado como records.
+        self._checked: "OrderedDict[tuple, Tuple[float, bool]]" = OrderedDict()
+        # Entradas vencidas a renovar en el hilo write-behind: clave -> _checked al pedirlo
+        self._stale: Dict[tuple, Tuple[float, bool]] = {}
+        self._flush_lock = threading.Lock()
+        self._upsert = _upsert_statement(self.engine, moderation_state, ("chat_id", "user_id"), _STATE_COLUMNS)
+        self._db_reads = 0
+        self._flushes = 0
+        self._rows_written = 0
+        self._last_purge = self._time()
+        self._writer = WriteBehind(self._background_flush, self.flush_interval, "moderation-store") if background else None
+
+    # --- Read-through ---
+    def _refresh(self, key: tuple) -> None:
+        # Fuera del lock: la consulta a la base no frena al resto de llamadas de moderación
+        with self._lock:
+            now = self._time()
+            rec = self.records.get(key)
+            # Las escrituras locales aún no volcadas son la versión más reciente
+            if key in self._pending or key in self._inflight:
+                return
+            checked = self._checked.get(key)
+            # Caché válida si es reciente y coincide con la memoria (si el registro fue expulsado por
+            # el tope de memoria pero existe en la base, hay que recargarlo)
+            if checked is not None and checked[1] == (rec is not None):
+                if now - checked[0] < self.cache_ttl:
+                    return
+                if self._writer is not None:
+                    # Vencida: se sirve la caché y el hilo write-behind la renueva
+                    if key not in self._stale:
+                        self._stale[key] = checked
+                        self._writer.notify()
+                    return
+        try:
+            row = self._fetch(key)
+        except Exception as e:
+            # Sin base disponible se sigue con la caché en memoria (se reintenta en la próxima lectura)
+            log_error_event("moderation_store_read_error", error=str(e))
+            return
+        with self._lock:
+            # Si hubo escrituras o lecturas de la clave mientras tanto, esa versión es más nueva
+            if key in self._pending or key in self._inflight or self._checked.get(key) is not checked:
+                return
+            self._apply_row(key, row, now)
+
+    def _apply_row(self, key: tuple, row: Optional[Dict[str, Any]], now: float) -> None:
+        self._mark_checked(key, now, row is not None)
+        rec = self.records.get(key)
+        if row is None:
+            if rec is not None:
+                # La fila no existe: otra réplica lo olvidó o reseteó
+                self._drop(key)
+            return
+        if rec is None:
+            rec = self.records[key] = ModerationRecord(now)
+            self._enforce_cap()
+        for col in _STATE_COLUMNS:
+            setattr(rec, col, row[col])
+        rec.banned = bool(rec.banned)
+        self._updated(key, rec, now)
+
+    def _mark_checked(self, key: tuple, now: float, exists: bool) -> None:
+        self._checked[key] = (now, exists)
+        self._checked.move_to_end(key)
+        while len(self._checked) > self.max_records > 0:
+            self._checked.popitem(last=False)
+
+    def refresh_stale(self) -> int:
+        """Renueva desde la base, en lote, las entradas vencidas que se leyeron. Devuelve cuántas."""
+        with self._lock:
+            stale, self._stale = self._stale, {}
+        if not stale:
+            return 0
+        try:
+            rows = self._fetch_many(list(stale))
+        except Exception as e:
+            # Se sigue con la caché; la próxima lectura de cada clave lo vuelve a pedir
+            log_error_event("moderation_store_read_error", error=str(e))
+            return 0
+        with self._lock:
+            now = self._time()
+            for key, checked in stale.items():
+                # Como en _refresh: si hubo escrituras o lecturas de la clave mientras tanto, es más nueva
+                if key in self._pending or key in self._inflight or self._checked.get(key) is not checked:
+                    continue
+                self._apply_row(key, rows.get(key), now)
+        return len(stale)
+
+    def _fetch_many(self, keys: List[tuple], chunk: int = 500) -> Dict[tuple, Dict[str, Any]]:
+        c = moderation_state.c
+        rows: Dict[tuple, Dict[str, Any]] = {}
+        with self.engine.connect() as conn:
+            for i in range(0, len(keys), chunk):
+                self._db_reads += 1
+                result = conn.execute(
+                    select(moderation_state).where(tuple_(c.chat_id, c.user_id).in_(keys[i:i + chunk]))
+                ).mappings()
+                for row in result:
+                    rows[(row["chat_id"], row["user_id"])] = dict(row)
+        return rows
+
+    def _fetch(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """Fila de la clave o None si no existe. Los errores de la base se propagan."""
+        self._db_reads += 1
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(moderation_state).where(
+                    and_(moderation_state.c.chat_id == key[0], moderation_state.c.user_id == key[1])
+                )
+            ).mappings().first()
+        return dict(row) if row is not None else None
+
+    # --- Write-behind ---
+    def _changed(self, key: tuple, rec: ModerationRecord) -> None:
+        self._pending[key] = {
+            "chat_id": key[0],
+            "user_id": key[1],
+            "count": rec.count,
+            "muted_until": rec.muted_until,
+            "banned": bool(rec.banned),
+            "last_violation": rec.last_violation,
+            "last_seen": rec.last_seen,
+        }
+        self._mark_checked(key, rec.last_seen, True)
+        if self._writer is not None and len(self._pending) >= self.flush_batch:
+            self._writer.notify()
+
+    def _forgotten(self, key: tuple) -> None:
+        self._pending[key] = None
+        self._mark_checked(key, self._time(), False)
+
+    def flush(self) -> int:
+        """Vuelca el buffer a la base en lote. Devuelve el número de filas escritas/borradas."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._inflight, self._pending = self._pending, {}
+            batch = self._inflight
+            upserts = [row for row in batch.values() if row is not None]
+            deletes = [key for key, row in batch.items() if row is None]
+            try:
+                with self.engine.begin() as conn:
+                    if deletes:
+                        conn.execute(
+                            delete(moderation_state).where(
+                                tuple_(moderation_state.c.chat_id, moderation_state.c.user_id).in_(deletes)
+                            )
+                        )
+                    if upserts:
+                        if self._upsert is not None:
+                            conn.execute(self._upsert, upserts)
+                        else:
+                            keys = [(r["chat_id"], r["user_id"]) for r in upserts]
+                            conn.execute(
+                                delete(moderation_state).where(
+                                    tuple_(moderation_state.c.chat_id, moderation_state.c.user_id).in_(keys)
+                                )
+                            )
+                            conn.execute(insert(moderation_state), upserts)
+            except Exception:
+                # Reencolar lo que no se pudo escribir sin pisar escrituras más nuevas
+                with self._lock:
+                    for key, row in batch.items():
+                        self._pending.setdefault(key, row)
+                    self._inflight = {}
+                raise
+            with self._lock:
+                self._inflight = {}
+                self._flushes += 1
+                self._rows_written += len(batch)
+            return len(batch)
+
+    def _background_flush(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.refresh_stale()
+        now = self._time()
+        if now - self._last_purge >= _PURGE_INTERVAL:
+            self._last_purge = now
+            self.purge_idle(now)
+
+    def purge_idle(self, now: Optional[float] = None) -> int:
+        """Borra de la base registros inactivos más de record_ttl (no baneados ni muteados)."""
+        if self.record_ttl <= 0:
+            return 0
+        now = self._time() if now is None else now
+        c = moderation_state.c
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                delete(moderation_state).where(
+                    and_(
+                        c.banned == False,  # noqa: E712
+                        or_(c.muted_until.is_(None), c.muted_until <= now),
+                        c.last_seen < now - self.record_ttl,
+                    )
+                )
+            )
+        return int(result.rowcount or 0)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self.flush()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats.update(
+                {
+                    "pending_writes": len(self._pending),
+                    "stale_reads": len(self._stale),
+                    "db_reads": self._db_reads,
+                    "flushes": self._flushes,
+                    "rows_written": self._rows_written,
+                }
+            )
+        return stats
+
+
+class SqlAuditRepository(AuditRepository):
+    """AuditRepository que persiste cada acción en `moderation_audit` (inserts por lotes) en lugar
+    de en segmentos en disco. Al arrancar recarga la cola en memoria con las acciones más recientes.
+    """
+
+    def __init__(self, engine: Optional[Engine] = None, flush_interval: Optional[float] = None, background: bool = True) -> None:
+        super().__init__(log_dir="", background=False)
+        self.engine = engine if engine is not None else _default_engine()
+        metadata.create_all(self.engine, tables=[moderation_audit], checkfirst=True)
+        self._load_recent()
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_lock = threading.Lock()
+        interval = float(flush_interval if flush_interval is not None else _env_number("MODERATION_FLUSH_INTERVAL", 1.0))
+        self._writer = WriteBehind(self.flush, interval, "audit-store") if background else None
+
+    def add_action(self, bot_id: str, group_id: str, user_id: str, action: str, reason: str = "", by: str | None = None):
+        rec = super().add_action(bot_id, group_id, user_id, action, reason, by)
+        row = {k: rec[k] for k in ("ts", "bot_id", "group_id", "user_id", "action", "reason")}
+        row["by_user"] = rec["by"]
+        with self._buffer_lock:
+            self._buffer.append(row)
+        return rec
+
+    def _load_recent(self) -> None:
+        stmt = select(moderation_audit).order_by(moderation_audit.c.id.desc())
+        if self.max_records > 0:
+            stmt = stmt.limit(self.max_records)
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(stmt).mappings().all()
+        except Exception as e:
+            log_error_event("store_load_error", store="audit-store", error=str(e))
+            return
+        with self._lock:
+            for row in reversed(rows):
+                rec = {k: row[k] for k in ("ts", "bot_id", "group_id", "user_id", "action", "reason")}
+                rec["by"] = row["by_user"]
+                self._index(rec)
+
+    def flush(self) -> int:
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(moderation_audit), rows)
+        except Exception:
+            with self._buffer_lock:
+                self._buffer[:0] = rows
+            raise
+        return len(rows)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            self.flush()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._buffer_lock:
+            stats["pending_writes"] = len(self._buffer)
+        return stats
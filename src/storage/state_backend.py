@@ -0,0 +1,433 @@
+"""Estado compartido entre réplicas (rate limiting, antiflood, mutes, bans, infracciones y deduplicación).
+
+StateBackend es la interfaz; hay dos implementaciones:
+
+- InMemoryStateBackend: estado del propio proceso (una sola réplica, tests).
+- RedisStateBackend: estado en Redis (o compatible: KeyDB, Valkey...). Cada operación es un
+  único script Lua, así que es atómica aunque varias réplicas atiendan al mismo usuario y
+  cuesta un solo round-trip. Las claves inactivas expiran con TTL en el propio Redis.
+
+SharedModerationRepository expone la interfaz de ModerationRepository sobre un StateBackend
+y backend.window_store(ns) da un WindowStore para RateLimiter/SlidingWindowCounter.
+
+Se activa con STATE_BACKEND=redis (usa REDIS_URL). Requiere el paquete opcional `redis`.
+"""
+from __future__ import annotations
+import itertools
+import os
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from src.storage.repository import ModerationRepository
+from src.utils.logging import log_error_event
+from src.utils.sliding_window import InMemoryWindowStore, SlidingWindowCounter, WindowStore
+
+try:  # dependencia opcional
+    import redis  # type: ignore
+except Exception:  # pragma: no cover - sin redis instalado
+    redis = None
+
+
+def _key_str(key: Hashable) -> str:
+    if isinstance(key, tuple):
+        return ":".join(str(k) for k in key)
+    return str(key)
+
+
+class StateBackend:
+    """Interfaz del estado compartido. Las claves de registro son "chat:usuario"."""
+
+    def window_hit(self, key: str, window: float, now: float, limit: Optional[int], count_rejected: bool) -> Tuple[int, bool]:
+        raise NotImplementedError
+
+    def window_count(self, key: str, window: float, now: float) -> int:
+        raise NotImplementedError
+
+    def window_reset(self, key: str) -> None:
+        raise NotImplementedError
+
+    def incr_violation(self, key: str, now: float, decay_seconds: float, ttl: float) -> int:
+        """Suma una infracción (aplicando decay) y devuelve el total."""
+        raise NotImplementedError
+
+    def update_record(self, key: str, now: float, ttl: float, **fields: Any) -> None:
+        """Actualiza campos del registro (muted_until, banned)."""
+        raise NotImplementedError
+
+    def get_record(self, key: str, now: float, decay_seconds: float) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_record(self, key: str) -> None:
+        raise NotImplementedError
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """Marca la clave durante ttl segundos. False si ya estaba marcada (deduplicación)."""
+        raise NotImplementedError
+
+    def is_claimed(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        """Quita la marca de claim()."""
+        raise NotImplementedError
+
+    def window_store(self, namespace: str) -> WindowStore:
+        return _BackendWindowStore(self, namespace)
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class _BackendWindowStore(WindowStore):
+    """Adapta un StateBackend a la interfaz WindowStore, con prefijo de espacio de nombres."""
+
+    def __init__(self, backend: StateBackend, namespace: str) -> None:
+        self.backend = backend
+        self.namespace = namespace
+
+    def hit(self, key, window, now, limit=None, count_rejected=True):
+        return self.backend.window_hit(f"{self.namespace}:{_key_str(key)}", window, now, limit, count_rejected)
+
+    def count(self, key, window, now):
+        return self.backend.window_count(f"{self.namespace}:{_key_str(key)}", window, now)
+
+    def reset(self, key):
+        self.backend.window_reset(f"{self.namespace}:{_key_str(key)}")
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def _decayed(count: int, last_violation: float, now: float, decay_seconds: float) -> int:
+    if decay_seconds > 0 and count > 0:
+        steps = int((now - last_violation) // decay_seconds)
+        if steps > 0:
+            return max(0, count - steps)
+    return count
+
+
+class InMemoryStateBackend(StateBackend):
+    """Backend en el proceso: mismas semánticas que Redis, sin compartir entre réplicas (tests/local)."""
+
+    def __init__(self) -> None:
+        self._windows = InMemoryWindowStore()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._claims: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def window_hit(self, key, window, now, limit, count_rejected):
+        return self._windows.hit(key, window, now, limit, count_rejected)
+
+    def window_count(self, key, window, now):
+        return self._windows.count(key, window, now)
+
+    def window_reset(self, key):
+        self._windows.reset(key)
+
+    def _alive(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        rec = self._records.get(key)
+        if rec is not None and rec.get("expires_at") is not None and rec["expires_at"] <= now:
+            del self._records[key]
+            return None
+        return rec
+
+    @staticmethod
+    def _refresh_ttl(rec: Dict[str, Any], now: float, ttl: float) -> None:
+        if rec.get("banned") or ttl <= 0:
+            rec["expires_at"] = None
+        else:
+            rec["expires_at"] = max(now + ttl, rec.get("muted_until") or 0.0)
+
+    def incr_violation(self, key, now, decay_seconds, ttl):
+        with self._lock:
+            rec = self._alive(key, now) or self._records.setdefault(key, {"count": 0, "last_violation": now})
+            rec["count"] = _decayed(rec.get("count", 0), rec.get("last_violation", now), now, decay_seconds) + 1
+            rec["last_violation"] = now
+            self._refresh_ttl(rec, now, ttl)
+            return rec["count"]
+
+    def update_record(self, key, now, ttl, **fields):
+        with self._lock:
+            rec = self._alive(key, now) or self._records.setdefault(key, {"count": 0, "last_violation": now})
+            rec.update(fields)
+            self._refresh_ttl(rec, now, ttl)
+
+    def get_record(self, key, now, decay_seconds):
+        with self._lock:
+            rec = self._alive(key, now)
+            if rec is None:
+                return None
+            return {
+                "count": _decayed(rec.get("count", 0), rec.get("last_violation", now), now, decay_seconds),
+                "muted_until": rec.get("muted_until"),
+                "banned": bool(rec.get("banned", False)),
+            }
+
+    def delete_record(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def claim(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            expires = self._claims.get(key)
+            if expires is not None and expires > now:
+                return False
+            self._claims[key] = now + ttl
+            return True
+
+    def is_claimed(self, key):
+        with self._lock:
+            expires = self._claims.get(key)
+            return expires is not None and expires > time.time()
+
+    def release(self, key):
+        with self._lock:
+            self._claims.pop(key, None)
+
+    def stats(self):
+        return {"backend": "memory", "records": len(self._records), **self._windows.stats()}
+
+
+# --- Redis ---
+# Recalcula el TTL del registro: sin expiración si está baneado; si no, el mayor entre ttl y el fin del mute
+_LUA_TTL = """
+local function refresh_ttl(key, now, ttl)
+  if redis.call('HGET', key, 'banned') == '1' or ttl <= 0 then
+    redis.call('PERSIST', key)
+    return
+  end
+  local ms = ttl * 1000
+  local mu = tonumber(redis.call('HGET', key, 'muted_until') or '0') or 0
+  if (mu - now) * 1000 > ms then ms = (mu - now) * 1000 end
+  redis.call('PEXPIRE', key, math.ceil(ms))
+end
+"""
+
+# KEYS[1]=zset  ARGV: now, window, limit(-1 = sin límite), count_rejected(0/1), member
+_LUA_WINDOW_HIT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local n = redis.call('ZCARD', KEYS[1])
+local allowed = 1
+if limit >= 0 and n >= limit then allowed = 0 end
+if allowed == 1 or ARGV[4] == '1' then
+  redis.call('ZADD', KEYS[1], now, ARGV[5])
+  n = n + 1
+end
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return {n, allowed}
+"""
+
+# KEYS[1]=hash  ARGV: now, decay_seconds, ttl
+_LUA_INCR_VIOLATION = _LUA_TTL + """
+local now = tonumber(ARGV[1])
+local decay = tonumber(ARGV[2])
+local count = tonumber(redis.call('HGET', KEYS[1], 'count') or '0') or 0
+local lv = tonumber(redis.call('HGET', KEYS[1], 'last_violation') or ARGV[1]) or now
+if decay > 0 and count > 0 then
+  local steps = math.floor((now - lv) / decay)
+  if steps > 0 then count = math.max(0, count - steps) end
+end
+count = count + 1
+redis.call('HSET', KEYS[1], 'count', count, 'last_violation', ARGV[1])
+refresh_ttl(KEYS[1], now, tonumber(ARGV[3]))
+return count
+"""
+
+# KEYS[1]=hash  ARGV: now, ttl, campo1, valor1, ...
+_LUA_UPDATE = _LUA_TTL + """
+local now = tonumber(ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  redis.call('HSET', KEYS[1], 'count', 0, 'last_violation', ARGV[1])
+end
+for i = 3, #ARGV, 2 do
+  redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+refresh_ttl(KEYS[1], now, tonumber(ARGV[2]))
+return 1
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """Estado compartido en Redis. Ante un error de Redis la operación se registra y se resuelve
+    en `fallback` (por defecto un InMemoryStateBackend del proceso): el bot sigue moderando con
+    estado local (infracciones que escalan, rate limit, deduplicación) hasta que Redis vuelva,
+    en lugar de devolver valores fijos.
+    """
+
+    def __init__(self, client: Any, prefix: str = "cg:", fallback: Optional[StateBackend] = None) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.fallback = fallback if fallback is not None else InMemoryStateBackend()
+        self._window_hit = client.register_script(_LUA_WINDOW_HIT)
+        self._incr_violation = client.register_script(_LUA_INCR_VIOLATION)
+        self._update = client.register_script(_LUA_UPDATE)
+        self._seq = itertools.count()
+        self._node = os.urandom(4).hex()
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "cg:") -> "RedisStateBackend":
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis requiere el paquete 'redis' (pip install redis)")
+        return cls(redis.Redis.from_url(url, decode_responses=True), prefix=prefix)
+
+    def _error(self, op: str, e: Exception) -> None:
+        self.errors += 1
+        log_error_event("state_backend_error", backend="redis", op=op, error=str(e))
+
+    def window_hit(self, key, window, now, limit, count_rejected):
+        # Miembro único por evento (varias réplicas pueden registrar en el mismo instante)
+        member = f"{now}:{self._node}:{next(self._seq)}"
+        try:
+            n, allowed = self._window_hit(
+                keys=[f"{self.prefix}w:{key}"],
+                args=[now, window, -1 if limit is None else int(limit), 1 if count_rejected else 0, member],
+            )
+            return int(n), bool(int(allowed))
+        except Exception as e:
+            self._error("window_hit", e)
+            return self.fallback.window_hit(key, window, now, limit, count_rejected)
+
+    def window_count(self, key, window, now):
+        try:
+            return int(self.client.zcount(f"{self.prefix}w:{key}", f"({now - window}", "+inf"))
+        except Exception as e:
+            self._error("window_count", e)
+            return self.fallback.window_count(key, window, now)
+
+    def window_reset(self, key):
+        try:
+            self.client.delete(f"{self.prefix}w:{key}")
+        except Exception as e:
+            self._error("window_reset", e)
+            self.fallback.window_reset(key)
+
+    def incr_violation(self, key, now, decay_seconds, ttl):
+        try:
+            return int(self._incr_violation(keys=[f"{self.prefix}m:{key}"], args=[now, decay_seconds, ttl]))
+        except Exception as e:
+            self._error("incr_violation", e)
+            return self.fallback.incr_violation(key, now, decay_seconds, ttl)
+
+    def update_record(self, key, now, ttl, **fields):
+        args: list = [now, ttl]
+        for name, value in fields.items():
+            if isinstance(value, bool):
+                value = 1 if value else 0
+            args.extend([name, "" if value is None else value])
+        try:
+            self._update(keys=[f"{self.prefix}m:{key}"], args=args)
+        except Exception as e:
+            self._error("update_record", e)
+            self.fallback.update_record(key, now, ttl, **fields)
+
+    def get_record(self, key, now, decay_seconds):
+        try:
+            raw = self.client.hgetall(f"{self.prefix}m:{key}")
+        except Exception as e:
+            self._error("get_record", e)
+            return self.fallback.get_record(key, now, decay_seconds)
+        if not raw:
+            return None
+        count = int(float(raw.get("count") or 0))
+        last_violation = float(raw.get("last_violation") or now)
+        muted = raw.get("muted_until")
+        return {
+            "count": _decayed(count, last_violation, now, decay_seconds),
+            "muted_until": float(muted) if muted not in (None, "") else None,
+            "banned": raw.get("banned") == "1",
+        }
+
+    def delete_record(self, key):
+        try:
+            self.client.delete(f"{self.prefix}m:{key}")
+        except Exception as e:
+            self._error("delete_record", e)
+            self.fallback.delete_record(key)
+
+    def claim(self, key, ttl):
+        try:
+            return bool(self.client.set(f"{self.prefix}d:{key}", 1, nx=True, px=max(1, int(ttl * 1000))))
+        except Exception as e:
+            self._error("claim", e)
+            return self.fallback.claim(key, ttl)
+
+    def is_claimed(self, key):
+        try:
+            return bool(self.client.exists(f"{self.prefix}d:{key}"))
+        except Exception as e:
+            self._error("is_claimed", e)
+            return self.fallback.is_claimed(key)
+
+    def release(self, key):
+        try:
+            self.client.delete(f"{self.prefix}d:{key}")
+        except Exception as e:
+            self._error("release", e)
+        # Con Redis caído la marca pudo quedar en el respaldo local
+        self.fallback.release(key)
+
+    def stats(self):
+        return {"backend": "redis", "errors": self.errors, "fallback": self.fallback.stats()}
+
+
+class SharedModerationRepository(ModerationRepository):
+    """ModerationRepository cuyo estado vive en un StateBackend compartido entre réplicas."""
+
+    def __init__(self, backend: StateBackend, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.backend = backend
+        self._flood_store = backend.window_store("flood")
+        self._flood = SlidingWindowCounter(60, store=self._flood_store)
+
+    def get_record(self, chat_id: str, user_id: str):
+        rec = self.backend.get_record(_key_str((chat_id, user_id)), self._time(), self.decay_seconds)
+        return rec or {"count": 0, "muted_until": None, "banned": False}
+
+    def add_violation(self, chat_id: str, user_id: str) -> int:
+        return self.backend.incr_violation(_key_str((chat_id, user_id)), self._time(), self.decay_seconds, self.record_ttl)
+
+    def set_muted(self, chat_id: str, user_id: str, seconds: int):
+        now = self._time()
+        self.backend.update_record(_key_str((chat_id, user_id)), now, self.record_ttl, muted_until=now + int(seconds))
+
+    def is_muted(self, chat_id: str, user_id: str) -> bool:
+        now = self._time()
+        rec = self.backend.get_record(_key_str((chat_id, user_id)), now, self.decay_seconds)
+        return bool(rec and rec.get("muted_until") is not None and rec["muted_until"] > now)
+
+    def set_banned(self, chat_id: str, user_id: str, banned: bool = True):
+        self.backend.update_record(_key_str((chat_id, user_id)), self._time(), self.record_ttl, banned=bool(banned))
+
+    def reset(self, chat_id: str, user_id: str):
+        self.backend.delete_record(_key_str((chat_id, user_id)))
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.stats()}
+
+
+_BACKEND: Optional[StateBackend] = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def get_state_backend() -> Optional[StateBackend]:
+    """Backend compartido configurado (STATE_BACKEND=redis) o None para estado por proceso."""
+    global _BACKEND
+    if os.getenv("STATE_BACKEND", "memory").strip().lower() != "redis":
+        return None
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            from src.app.config import REDIS_URL
+            _BACKEND = RedisStateBackend.from_url(REDIS_URL, prefix=os.getenv("STATE_BACKEND_PREFIX", "cg:"))
+        return _BACKEND
+
+
+def get_window_store(namespace: str) -> Optional[WindowStore]:
+    """WindowStore compartido si hay backend configurado; None para usar el de memoria del proceso."""
+    backend = get_state_backend()
+    return backend.window_store(namespace) if backend is not None else None
@@ -0,0 +1,71 @@
+"""Hilo de volcado en segundo plano (write-behind) compartido por los stores persistentes."""
+from __future__ import annotations
+import atexit
+import threading
+from typing import List, Optional
+
+from src.utils.logging import log_error_event
+
+# Modo prefork: mientras el padre precarga, los hilos no se arrancan (un lock tomado por un hilo
+# en el momento del fork quedaría bloqueado para siempre en el hijo); cada worker los arranca
+# después del fork con start_deferred_threads().
+_DEFERRED: Optional[List["WriteBehind"]] = None
+
+
+def defer_threads() -> None:
+    """Los WriteBehind creados a partir de ahora no arrancan su hilo hasta start_deferred_threads()."""
+    global _DEFERRED
+    if _DEFERRED is None:
+        _DEFERRED = []
+
+
+def start_deferred_threads() -> None:
+    """Arranca los hilos aplazados y vuelve al arranque inmediato."""
+    global _DEFERRED
+    pending, _DEFERRED = _DEFERRED or [], None
+    for writer in pending:
+        writer._start()
+
+
+class WriteBehind:
+    """Hilo daemon que llama a flush() cada `interval` segundos o cuando se le avisa."""
+
+    def __init__(self, flush, interval: float, name: str) -> None:
+        self._flush = flush
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        atexit.register(self.close)
+        if _DEFERRED is not None:
+            _DEFERRED.append(self)
+        else:
+            self._start()
+
+    def _start(self) -> None:
+        if not self._stop.is_set() and not self._thread.is_alive():
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self._flush()
+            except Exception as e:
+                log_error_event("store_flush_error", store=self._thread.name, error=str(e))
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        try:
+            self._flush()
+        except Exception as e:
+            log_error_event("store_flush_error", store=self._thread.name, error=str(e))
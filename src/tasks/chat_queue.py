@@ -0,0 +1,329 @@
+# chat_queue.py - Colas ordenadas por chat con procesamiento concurrente entre chats
+"""Programador de mensajes entrantes por chat (ChatScheduler).
+
+- Cada payload va a la cola FIFO de su chat (`group_id`, o el usuario en privados): los
+  mensajes de un chat se procesan de uno en uno y en orden de llegada, así que las
+  infracciones, los mutes y el antiflood ven la misma secuencia que en la plataforma.
+- Un pool de hilos atiende chats distintos en paralelo. Los chats con trabajo se sirven por
+  turnos (un mensaje por turno), así que un chat con ráfaga no acapara los workers.
+- Backpressure: la profundidad total está acotada (`max_depth`). Con la cola llena submit()
+  espera hasta `timeout` segundos y después lanza QueueFull (el webhook responde 503 y la
+  plataforma reintenta; el mensaje no se pierde).
+- Load shedding: con la cola cargada (`shed_depth` mensajes en total, o `chat_shed_depth`
+  pendientes en el mismo chat) se descarta primero la conversación: el mensaje se modera
+  igual, pero sin NLU ni respuesta (`{"type": "noop", "reason": "shed"}`). La moderación
+  nunca se descarta.
+- stats() expone profundidad total, por chat (los más cargados), procesados y descartados.
+- get_chat_scheduler() es la instancia del proceso: el webhook, /webhook/batch, la fachada async
+  de BotManager (Telegram, Discord) y WhatsApp pasan todos por ella, así que el orden por chat lo
+  garantiza un único mecanismo. Cada trabajo puede traer su propio handler.
+
+Variables de entorno: CHAT_QUEUE_WORKERS (por defecto min(32, CPUs + 4)), CHAT_QUEUE_MAX_DEPTH
+(10000), CHAT_QUEUE_SHED_DEPTH (la mitad de max_depth), CHAT_QUEUE_CHAT_SHED_DEPTH (50) y
+CHAT_QUEUE_WAIT_SECONDS (30: espera por sitio de process() cuando no se indica timeout).
+"""
+from __future__ import annotations
+import asyncio
+import heapq
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from src.utils.logging import log_event
+
+# handler(payload, converse) -> resultado; con converse=False solo debe moderar
+Handler = Callable[[Dict[str, Any], bool], Dict[str, Any]]
+
+
+class QueueFull(RuntimeError):
+    """La cola de entrada alcanzó su profundidad máxima."""
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class _Job:
+    __slots__ = ("payload", "handler", "future")
+
+    def __init__(self, payload: Dict[str, Any], handler: Optional[Handler]) -> None:
+        self.payload = payload
+        self.handler = handler
+        self.future: Future = Future()
+
+
+class ChatScheduler:
+    """Colas ordenadas por chat sobre un pool de hilos (ver docstring del módulo)."""
+
+    def __init__(
+        self,
+        handler: Optional[Handler] = None,
+        workers: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        shed_depth: Optional[int] = None,
+        chat_shed_depth: Optional[int] = None,
+        name: str = "chat-queue",
+    ) -> None:
+        self.handler = handler
+        self.workers = workers or _env_int("CHAT_QUEUE_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+        self.max_depth = max_depth or _env_int("CHAT_QUEUE_MAX_DEPTH", 10000)
+        self.shed_depth = shed_depth or _env_int("CHAT_QUEUE_SHED_DEPTH", max(1, self.max_depth // 2))
+        self.chat_shed_depth = chat_shed_depth or _env_int("CHAT_QUEUE_CHAT_SHED_DEPTH", 50)
+        self.wait_timeout = _env_float("CHAT_QUEUE_WAIT_SECONDS", 30.0)
+        self.name = name
+        self._queues: Dict[str, Deque[_Job]] = {}
+        # Chats con trabajo pendiente y sin worker asignado, en orden de turno
+        self._ready: Deque[str] = deque()
+        # Chats en _ready o en proceso: nunca dos workers con el mismo chat
+        self._scheduled: Set[str] = set()
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        # Esperas de submit_async(): (loop, future) que se resuelven al liberarse sitio
+        self._async_space: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._depth = 0
+        self._active = 0
+        self.peak_depth = 0
+        self.submitted = 0
+        self.processed = 0
+        self.shed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    @staticmethod
+    def chat_key(payload: Dict[str, Any]) -> str:
+        return str(payload.get("group_id") or payload.get("platform_user_id") or "")
+
+    def _start(self) -> None:
+        # Con el lock tomado. Los hilos se crean con el primer mensaje (o tras close()).
+        if self._threads:
+            return
+        self._stopping = False
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _enqueue(self, payloads: Sequence[Dict[str, Any]], handler: Optional[Handler]) -> Optional[List[Future]]:
+        # Con el lock tomado. Todo o nada: None si no caben todos los payloads.
+        if self._stopping:
+            raise QueueFull("Cola de entrada cerrándose")
+        if self._depth + len(payloads) > self.max_depth:
+            return None
+        self._start()
+        futures = []
+        for payload in payloads:
+            key = self.chat_key(payload)
+            job = _Job(payload, handler)
+            q = self._queues.get(key)
+            if q is None:
+                q = self._queues[key] = deque()
+            q.append(job)
+            self._depth += 1
+            self.submitted += 1
+            if key not in self._scheduled:
+                self._scheduled.add(key)
+                self._ready.append(key)
+                self._work.notify()
+            futures.append(job.future)
+        if self._depth > self.peak_depth:
+            self.peak_depth = self._depth
+        return futures
+
+    def _reject(self, payloads: Sequence[Dict[str, Any]]) -> QueueFull:
+        # Con el lock tomado
+        self.rejected += len(payloads)
+        log_event("chat_queue_full", depth=self._depth, size=len(payloads),
+                  chat=self.chat_key(payloads[0]) if payloads else "")
+        return QueueFull(f"Cola de entrada llena ({self.max_depth} mensajes)")
+
+    def submit_many(self, payloads: Sequence[Dict[str, Any]], timeout: float = 0.0,
+                    handler: Optional[Handler] = None) -> List[Future]:
+        """Encola los payloads en orden, cada uno en la cola de su chat, todos o ninguno. Cada Future
+        resuelve con el resultado de `handler` (o el del scheduler). Si no caben espera hasta
+        `timeout` segundos a que haya sitio y si no, lanza QueueFull.
+        """
+        payloads = list(payloads)
+        if len(payloads) > self.max_depth:
+            raise QueueFull(f"Lote mayor que la cola de entrada ({self.max_depth} mensajes)")
+        with self._lock:
+            futures = self._enqueue(payloads, handler)
+            if futures is None:
+                deadline = time.monotonic() + timeout
+                while futures is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject(payloads)
+                    self._space.wait(remaining)
+                    futures = self._enqueue(payloads, handler)
+            return futures
+
+    def submit(self, payload: Dict[str, Any], timeout: float = 0.0, handler: Optional[Handler] = None) -> Future:
+        """Encola el payload en la cola de su chat (ver submit_many)."""
+        return self.submit_many([payload], timeout, handler)[0]
+
+    async def submit_async(self, payloads: Sequence[Dict[str, Any]], timeout: Optional[float] = None,
+                           handler: Optional[Handler] = None) -> List[Future]:
+        """submit_many() desde un event loop: espera sitio hasta `timeout` segundos (por defecto
+        CHAT_QUEUE_WAIT_SECONDS; 0 = QueueFull al instante) sin bloquear el loop."""
+        payloads = list(payloads)
+        if len(payloads) > self.max_depth:
+            raise QueueFull(f"Lote mayor que la cola de entrada ({self.max_depth} mensajes)")
+        timeout = self.wait_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._lock:
+                futures = self._enqueue(payloads, handler)
+                if futures is not None:
+                    return futures
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise self._reject(payloads)
+                entry = (loop, loop.create_future())
+                self._async_space.append(entry)
+            try:
+                # Un worker la resuelve al sacar un mensaje; después se vuelve a intentar
+                await asyncio.wait((entry[1],), timeout=remaining)
+            finally:
+                with self._lock:
+                    if entry in self._async_space:
+                        self._async_space.remove(entry)
+
+    def _notify_space(self) -> None:
+        # Con el lock tomado: despierta a quien espera sitio (hilos y event loops)
+        self._space.notify()
+        waiters, self._async_space = self._async_space, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, fut)
+            except RuntimeError:
+                pass  # loop ya cerrado: nadie espera
+
+    @staticmethod
+    async def results(futures: Sequence[Future]) -> List[Dict[str, Any]]:
+        """Espera los resultados sin bloquear el loop. Si quien espera se cancela, los mensajes se
+        procesan igual (la moderación no se salta): solo se deja de esperar el resultado."""
+        return list(await asyncio.gather(*(asyncio.shield(asyncio.wrap_future(f)) for f in futures)))
+
+    async def process(self, payload: Dict[str, Any], timeout: Optional[float] = None,
+                      handler: Optional[Handler] = None) -> Dict[str, Any]:
+        """Encola desde un event loop (ver submit_async) y espera el resultado."""
+        return (await self.results(await self.submit_async([payload], timeout, handler)))[0]
+
+    async def process_many(self, payloads: Sequence[Dict[str, Any]], timeout: Optional[float] = None,
+                           handler: Optional[Handler] = None) -> List[Dict[str, Any]]:
+        """Como process() para un lote: resultados en el mismo orden que los payloads."""
+        return await self.results(await self.submit_async(payloads, timeout, handler))
+
+    def _overloaded(self, chat_pending: int) -> bool:
+        return self._depth >= self.shed_depth or chat_pending >= self.chat_shed_depth
+
+    def _worker(self) -> None:
+        while True:
+            with self._lock:
+                while not self._ready and not self._stopping:
+                    self._work.wait()
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                q = self._queues[key]
+                # La decisión se toma al sacar el mensaje: si la cola sigue cargada, no se conversa
+                converse = not self._overloaded(len(q))
+                job = q.popleft()
+                self._depth -= 1
+                self._active += 1
+                self._notify_space()
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result((job.handler or self.handler)(job.payload, converse))
+                except Exception as e:
+                    with self._lock:
+                        self.errors += 1
+                    job.future.set_exception(e)
+            with self._lock:
+                self._active -= 1
+                self.processed += 1
+                if not converse:
+                    self.shed += 1
+                if q:
+                    # Turno para el siguiente chat; este vuelve al final de la fila
+                    self._ready.append(key)
+                    self._work.notify()
+                else:
+                    del self._queues[key]
+                    self._scheduled.discard(key)
+
+    def depth(self, chat: Optional[str] = None) -> int:
+        """Mensajes pendientes en total o de un chat."""
+        with self._lock:
+            if chat is None:
+                return self._depth
+            q = self._queues.get(chat)
+            return len(q) if q else 0
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Procesa lo pendiente y detiene los workers (se vuelven a crear con el siguiente submit)."""
+        with self._lock:
+            self._stopping = True
+            self._work.notify_all()
+            self._space.notify_all()
+            self._notify_space()
+            threads, self._threads = self._threads, []
+        for t in threads:
+            t.join(timeout)
+        with self._lock:
+            self._stopping = False
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            busiest = heapq.nlargest(top, ((len(q), chat) for chat, q in self._queues.items()))
+            return {
+                "depth": self._depth,
+                "chats": len(self._queues),
+                "active": self._active,
+                "workers": self.workers,
+                "max_depth": self.max_depth,
+                "shed_depth": self.shed_depth,
+                "peak_depth": self.peak_depth,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "shed": self.shed,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "busiest_chats": {chat: n for n, chat in busiest},
+            }
+
+
+_scheduler: Optional[ChatScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_chat_scheduler() -> ChatScheduler:
+    """Scheduler de mensajes entrantes compartido por todo el proceso (configurado por entorno)."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ChatScheduler()
+    return _scheduler
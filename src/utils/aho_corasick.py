@@ -0,0 +1,128 @@
+"""Matcher multi-patrón (Aho-Corasick) en Python puro.
+
+Se construye una vez por lista de palabras (p. ej. banned_words + learning de un chat) y
+busca todas las palabras en una sola pasada sobre el texto: el coste por mensaje depende
+de la longitud del texto, no del número de palabras configuradas.
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Con pocas palabras, `w in texto` (implementado en C) es más rápido que recorrer el autómata
+_LINEAR_SCAN_MAX_TERMS = 16
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class AhoCorasickMatcher:
+    """Autómata Aho-Corasick sobre una lista de términos.
+
+    - whole_word=False: coincide como subcadena (mismo criterio que `w in texto`).
+    - whole_word=True: el término debe estar delimitado por caracteres que no sean de palabra
+      (solo se exige frontera en los extremos del término que son letras/dígitos/_).
+    Los términos se usan tal cual: normalizar (minúsculas, etc.) antes de construirlo.
+    """
+
+    __slots__ = ("terms", "whole_word", "_goto", "_fail", "_out", "_linear")
+
+    def __init__(self, terms: Iterable[str], whole_word: bool = False) -> None:
+        # Sin vacíos ni duplicados, preservando orden
+        self.terms: Tuple[str, ...] = tuple(dict.fromkeys(t for t in terms if t))
+        self.whole_word = bool(whole_word)
+        self._linear = (not self.whole_word) and len(self.terms) <= _LINEAR_SCAN_MAX_TERMS
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Por nodo: términos que terminan en él (incluye los heredados por enlaces de fallo)
+        self._out: List[Tuple[str, ...]] = [()]
+        if not self._linear:
+            self._build()
+
+    def _build(self) -> None:
+        goto, fail, out = self._goto, self._fail, self._out
+        own: List[List[str]] = [[]]
+        for term in self.terms:
+            node = 0
+            for ch in term:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    own.append([])
+                node = nxt
+            own[node].append(term)
+        out[:] = [()] * len(goto)
+        # BFS para calcular enlaces de fallo; los hijos de la raíz fallan a la raíz
+        queue: List[int] = []
+        for nxt in goto[0].values():
+            queue.append(nxt)
+            out[nxt] = tuple(own[nxt])
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                out[nxt] = tuple(own[nxt]) + out[fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _boundary_ok(self, text: str, start: int, end: int, term: str) -> bool:
+        if not self.whole_word:
+            return True
+        if _is_word_char(term[0]) and start > 0 and _is_word_char(text[start - 1]):
+            return False
+        if _is_word_char(term[-1]) and end < len(text) and _is_word_char(text[end]):
+            return False
+        return True
+
+    def iter_matches(self, text: str):
+        """Genera (inicio, término) en orden de aparición (por posición final)."""
+        if not text or not self.terms:
+            return
+        if self._linear:
+            found = []
+            for term in self.terms:
+                idx = text.find(term)
+                while idx != -1:
+                    found.append((idx + len(term), idx, term))
+                    idx = text.find(term, idx + 1)
+            for _end, start, term in sorted(found):
+                yield start, term
+            return
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                end = i + 1
+                for term in out[node]:
+                    start = end - len(term)
+                    if self._boundary_ok(text, start, end, term):
+                        yield start, term
+
+    def search(self, text: str) -> Optional[str]:
+        """Devuelve el primer término encontrado en el texto o None."""
+        if self._linear:
+            # Ruta rápida: basta con saber si alguno aparece
+            for term in self.terms:
+                if term in text:
+                    return term
+            return None
+        for _start, term in self.iter_matches(text):
+            return term
+        return None
+
+    def find_all(self, text: str) -> List[Tuple[int, str]]:
+        """Lista de (inicio, término) para todas las apariciones (incluye solapadas)."""
+        return list(self.iter_matches(text))
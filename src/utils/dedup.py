@@ -0,0 +1,249 @@
+"""Deduplicación de entregas repetidas (reintentos de webhooks, updates repetidos) por id de mensaje.
+
+- RecentIds recuerda los ids vistos durante `ttl` segundos, con como mucho `max_keys` entradas:
+  las claves se guardan en orden de llegada y en cada operación se descartan por el frente las
+  que ya vencieron (O(1) amortizado); si se supera el tope se expulsa la más antigua.
+  `on_expire` recibe cada clave que sale así (no las que se olvidan con forget()).
+- BloomFilter: pertenencia aproximada en memoria fija.
+- Deduplicator combina ambos (ver su docstring); get_update_dedup() es la instancia compartida
+  por BotManager y los conectores.
+"""
+from __future__ import annotations
+import hashlib
+import math
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class RecentIds:
+    """Conjunto exacto de ids recientes con expiración por tiempo y tope de tamaño."""
+
+    def __init__(self, ttl: float = 86400, max_keys: int = 100_000,
+                 on_expire: Optional[Callable[[Hashable, float], None]] = None) -> None:
+        self.ttl = float(ttl)
+        self.max_keys = int(max_keys)
+        self.on_expire = on_expire
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = Lock()
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.contains(key)
+
+    def contains(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            return key in self._seen
+
+    def _expire(self, now: float) -> None:
+        seen = self._seen
+        while seen:
+            key, ts = next(iter(seen.items()))
+            if ts + self.ttl > now:
+                break
+            del seen[key]
+            if self.on_expire is not None:
+                self.on_expire(key, now)
+
+    def seen_or_add(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """True si la clave ya se vio dentro del ttl (duplicado); si no, la registra y devuelve False."""
+        now = time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[key] = now
+            while len(self._seen) > self.max_keys > 0:
+                old, _ = self._seen.popitem(last=False)
+                if self.on_expire is not None:
+                    self.on_expire(old, now)
+            return False
+
+    def forget(self, key: Hashable) -> None:
+        """Olvida la clave (p. ej. si no se pudo procesar y se espera un reintento)."""
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"keys": len(self._seen), "duplicates": self.duplicates, "max_keys": self.max_keys}
+
+
+class BloomFilter:
+    """Filtro de Bloom: pertenencia aproximada (sin falsos negativos) en memoria fija.
+    Con `capacity` claves la tasa de falsos positivos es como mucho `error_rate`.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6) -> None:
+        self.capacity = max(1, int(capacity))
+        self.num_bits = max(8, math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Doble hashing (Kirsch-Mitzenmacher) sobre un único blake2b de 128 bits
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        bits = self._bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class _RotatingBloom:
+    """Dos generaciones de BloomFilter: una clave se recuerda al menos `ttl` segundos."""
+
+    def __init__(self, ttl: float, capacity: int, error_rate: float) -> None:
+        self.ttl = float(ttl)
+        self.capacity = int(capacity)
+        self.error_rate = error_rate
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous: Optional[BloomFilter] = None
+        self.started = time()
+
+    def _rotate(self, now: float) -> None:
+        if now - self.started >= self.ttl or self.current.count >= self.capacity:
+            self.previous = self.current if now - self.started < 2 * self.ttl else None
+            self.current = BloomFilter(self.capacity, self.error_rate)
+            self.started = now
+
+    def add(self, key: str, now: float) -> None:
+        self._rotate(now)
+        self.current.add(key)
+
+    def contains(self, key: str, now: float) -> bool:
+        self._rotate(now)
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+
+def _env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class Deduplicator:
+    """Deduplicación de updates por (plataforma, chat, id de mensaje), compartida por los conectores.
+
+    - Conjunto exacto de los ids recientes (`ttl` s, como mucho `max_keys`): cubre los reintentos
+      habituales, que llegan en segundos o minutos.
+    - Bloom filter rotativo (`bloom_ttl` s): recuerda en memoria fija los ids ya expulsados del
+      conjunto exacto, para reintentos tardíos. Solo entran al salir del conjunto exacto, así que
+      forget() de un id reciente es exacto. Un falso positivo descartaría un mensaje nuevo,
+      por eso `error_rate` es muy bajo por defecto (1e-6).
+    - Con un backend compartido (STATE_BACKEND=redis) la marca de la ventana exacta vive en Redis
+      (solo `ttl` s) y la ven todas las réplicas. El horizonte largo sigue en el Bloom local de cada
+      proceso: una clave por mensaje durante `bloom_ttl` llenaría Redis y, con volatile-ttl, haría
+      expulsar antes las ventanas de rate limit y antiflood.
+    """
+
+    def __init__(self, ttl: float = 600, max_keys: int = 100_000, bloom_ttl: float = 86400,
+                 bloom_capacity: int = 500_000, error_rate: float = 1e-6, backend: Any = None) -> None:
+        self.ttl = float(ttl)
+        self.bloom_ttl = float(bloom_ttl)
+        self.backend = backend
+        self._bloom = _RotatingBloom(bloom_ttl, bloom_capacity, error_rate) if bloom_ttl > 0 else None
+        self._recent = RecentIds(ttl=ttl, max_keys=max_keys,
+                                 on_expire=self._bloom.add if self._bloom is not None else None)
+        self._lock = Lock()
+        self.duplicates = 0
+
+    @staticmethod
+    def key(platform: str, chat: Any, message_id: Any) -> str:
+        return f"{platform}:{chat or ''}:{message_id}"
+
+    def _in_bloom(self, key: str, now: float) -> bool:
+        return self._bloom is not None and self._bloom.contains(key, now)
+
+    def _contains(self, key: str, now: float) -> bool:
+        if self.backend is not None:
+            if self.backend.is_claimed(key):
+                return True
+        elif self._recent.contains(key, now):
+            return True
+        return self._in_bloom(key, now)
+
+    def _add(self, key: str, now: float) -> bool:
+        if self.backend is not None:
+            if not self.backend.claim(key, self.ttl):
+                return False
+            # Copia local de lo reclamado: al salir de la ventana exacta pasa al Bloom
+            self._recent.seen_or_add(key, now)
+            return True
+        return not self._recent.seen_or_add(key, now)
+
+    def contains(self, platform: str, chat: Any, message_id: Any) -> bool:
+        """True si el update ya se registró (no lo registra)."""
+        with self._lock:
+            return self._contains(self.key(platform, chat, message_id), time())
+
+    def add(self, platform: str, chat: Any, message_id: Any) -> None:
+        """Registra el update como procesado."""
+        with self._lock:
+            self._add(self.key(platform, chat, message_id), time())
+
+    def seen(self, platform: str, chat: Any, message_id: Any) -> bool:
+        """Comprueba y registra en un paso: True si es un duplicado."""
+        key = self.key(platform, chat, message_id)
+        with self._lock:
+            now = time()
+            dup = self._in_bloom(key, now) or not self._add(key, now)
+            if dup:
+                self.duplicates += 1
+            return dup
+
+    def forget(self, platform: str, chat: Any, message_id: Any) -> None:
+        """Olvida el update (no se pudo procesar o encolar): el reintento se procesará."""
+        key = self.key(platform, chat, message_id)
+        with self._lock:
+            if self.backend is not None:
+                self.backend.release(key)
+            self._recent.forget(key)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"duplicates": self.duplicates, "shared": self.backend is not None,
+                               "recent": self._recent.stats()}
+        if self._bloom is not None:
+            out["bloom_keys"] = self._bloom.current.count
+        return out
+
+
+_dedup: Optional[Deduplicator] = None
+_dedup_lock = Lock()
+
+
+def get_update_dedup() -> Deduplicator:
+    """Deduplicador global de updates entrantes, configurado por entorno (DEDUP_*)."""
+    global _dedup
+    if _dedup is None:
+        with _dedup_lock:
+            if _dedup is None:
+                from src.storage.state_backend import get_state_backend
+                _dedup = Deduplicator(
+                    ttl=_env("DEDUP_TTL_SECONDS", 600),
+                    max_keys=int(_env("DEDUP_MAX_KEYS", 100_000)),
+                    bloom_ttl=_env("DEDUP_BLOOM_TTL_SECONDS", 86400),
+                    bloom_capacity=int(_env("DEDUP_BLOOM_CAPACITY", 500_000)),
+                    error_rate=_env("DEDUP_BLOOM_ERROR_RATE", 1e-6),
+                    backend=get_state_backend(),
+                )
+    return _dedup
@@ -1,17 +1,19 @@
 # rate_limiter.py - Limitador de mensajes para Bot Comunidad
 import time
 
+from src.utils.sliding_window import InMemoryWindowStore, SlidingWindowCounter, WindowStore
+
 class RateLimiter:
-    def __init__(self, max_messages, interval):
+    """Máximo `max_messages` por usuario cada `interval` segundos (ventana deslizante, O(1) amortizado).
+    Los mensajes rechazados no cuentan; los usuarios inactivos se olvidan solos.
+    """
+    def __init__(self, max_messages, interval, store: WindowStore = None):
         self.max_messages = max_messages
         self.interval = interval
-        self.user_timestamps = {}
+        self._counter = SlidingWindowCounter(
+            interval, limit=max_messages, store=store or InMemoryWindowStore(), count_rejected=False
+        )
     def allow(self, user_id):
-        now = time.time()
-        timestamps = self.user_timestamps.get(user_id, [])
-        timestamps = [t for t in timestamps if now - t < self.interval]
-        if len(timestamps) < self.max_messages:
-            timestamps.append(now)
-            self.user_timestamps[user_id] = timestamps
-            return True
-        return False
+        return self._counter.allow(user_id, time.time())
+    def stats(self):
+        return self._counter.stats()
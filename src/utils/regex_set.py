@@ -0,0 +1,105 @@
+"""Conjunto de regex compiladas una sola vez y evaluadas como una única alternancia.
+
+Los patrones compatibles se combinan en `(?P<_p0>...)|(?P<_p1>...)|...` para recorrer el texto
+una sola vez; los que no se pueden combinar (referencias a grupos, grupos con nombre, grupos
+condicionales o flags globales en línea) se evalúan por separado. `search` devuelve el patrón
+original que coincidió.
+
+Guardas: `re` no permite interrumpir una búsqueda, así que se limita el tamaño del patrón. El
+texto se analiza completo (recortarlo dejaría pasar lo que va después del corte) y las búsquedas
+lentas solo se registran (`regex_slow_scan`): nunca se desactiva un patrón en caliente. El
+conjunto no guarda estado mutable, así que reutilizarlo entre generaciones de reglas es seguro.
+"""
+from __future__ import annotations
+import re
+from time import perf_counter
+from typing import Iterable, List, Optional, Tuple
+
+from src.utils.logging import log_event, log_error_event
+
+DEFAULT_MAX_PATTERN_LENGTH = 512
+DEFAULT_SLOW_SCAN_MS = 50.0
+
+# Construcciones que rompen la numeración/nombres de grupos o que solo son válidas al inicio:
+# referencias (\1, (?P=n)), grupos con nombre, condicionales ((?(1)...)) y flags globales
+_NOT_COMBINABLE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?<[A-Za-z_]|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+class RegexSet:
+    __slots__ = (
+        "name", "flags", "slow_scan_ms", "patterns", "rejected",
+        "_combined", "_combined_sources", "_single",
+    )
+
+    def __init__(
+        self,
+        patterns: Iterable[str],
+        flags: int = re.IGNORECASE,
+        name: str = "",
+        max_pattern_length: int = DEFAULT_MAX_PATTERN_LENGTH,
+        slow_scan_ms: float = DEFAULT_SLOW_SCAN_MS,
+    ) -> None:
+        self.name = name
+        self.flags = flags
+        self.slow_scan_ms = float(slow_scan_ms)
+        self.rejected: List[Tuple[str, str]] = []
+        accepted: List[Tuple[str, "re.Pattern[str]"]] = []
+        for raw in patterns or []:
+            src = str(raw)
+            if not src.strip():
+                continue
+            if len(src) > max_pattern_length:
+                self._reject(src, f"patrón demasiado largo (>{max_pattern_length})")
+                continue
+            try:
+                accepted.append((src, re.compile(src, flags)))
+            except re.error as e:
+                self._reject(src, str(e))
+        self.patterns: Tuple[str, ...] = tuple(src for src, _ in accepted)
+        combinable = [(s, p) for s, p in accepted if not _NOT_COMBINABLE.search(s)]
+        self._single: List[Tuple[str, "re.Pattern[str]"]] = [(s, p) for s, p in accepted if _NOT_COMBINABLE.search(s)]
+        self._combined: Optional["re.Pattern[str]"] = None
+        self._combined_sources: Tuple[str, ...] = ()
+        if len(combinable) == 1:
+            self._single.insert(0, combinable[0])
+        elif combinable:
+            try:
+                self._combined = re.compile(
+                    "|".join(f"(?P<_p{i}>{s})" for i, (s, _) in enumerate(combinable)), flags
+                )
+                self._combined_sources = tuple(s for s, _ in combinable)
+            except re.error:
+                # Combinación inválida (caso raro): evaluar cada patrón por separado
+                self._single = combinable + self._single
+
+    def _reject(self, src: str, reason: str) -> None:
+        self.rejected.append((src, reason))
+        log_error_event("regex_pattern_invalid", chat_id=self.name, pattern=src, error=reason)
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def search(self, text: str) -> Optional[str]:
+        """Devuelve el patrón (texto original) que coincide o None."""
+        if not text or not self.patterns:
+            return None
+        if self._combined is not None:
+            t0 = perf_counter()
+            m = self._combined.search(text)
+            self._check_slow(t0, text, "combined")
+            if m is not None and m.lastgroup:
+                return self._combined_sources[int(m.lastgroup[2:])]
+        for src, pat in self._single:
+            t0 = perf_counter()
+            hit = pat.search(text) is not None
+            self._check_slow(t0, text, src)
+            if hit:
+                return src
+        return None
+
+    def _check_slow(self, t0: float, text: str, pattern: str) -> None:
+        # Solo aviso: desactivar el patrón abriría un hueco en la moderación a quien lo provoque
+        elapsed_ms = (perf_counter() - t0) * 1000.0
+        if elapsed_ms > self.slow_scan_ms:
+            log_event("regex_slow_scan", chat_id=self.name, pattern=pattern,
+                      ms=round(elapsed_ms, 1), text_length=len(text))
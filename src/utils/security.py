@@ -1,10 +1,14 @@
 # security.py - Seguridad básica para Bot Comunidad
 import re
 
+_TAG_RE = re.compile(r'<.*?>')
+_DANGEROUS_RE = re.compile(r'(script|onerror|onload)', re.IGNORECASE)
+
 def sanitizar_texto(texto):
-    # Elimina scripts y etiquetas peligrosas
-    texto = re.sub(r'<.*?>', '', texto)
-    texto = re.sub(r'(script|onerror|onload)', '', texto, flags=re.IGNORECASE)
+    # Elimina scripts y etiquetas peligrosas (sin '<' no puede haber etiquetas: se evita esa pasada)
+    if '<' in texto:
+        texto = _TAG_RE.sub('', texto)
+    texto = _DANGEROUS_RE.sub('', texto)
     return texto
 
 def validar_usuario(user_id):
@@ -0,0 +1,204 @@
+"""Contadores de ventana deslizante y token buckets por clave (antiflood, rate limiting).
+
+- SlidingWindowCounter: cuántos eventos tuvo una clave en los últimos `window` segundos.
+  Cada clave guarda un deque de timestamps; los viejos se descartan por la izquierda, así
+  que cada actualización es O(1) amortizado (cada timestamp entra y sale una sola vez).
+- TokenBucket: límite de tasa con ráfaga (`capacity`) y recarga continua (`rate` tokens/s), O(1).
+
+Las claves inactivas se expulsan solas: el almacén mantiene las claves en orden de último uso
+y en cada operación descarta por el frente las que ya no tienen eventos dentro de su ventana.
+`max_keys` acota la memoria expulsando la clave menos reciente.
+
+El almacenamiento es intercambiable: WindowStore define la interfaz (hit/count/reset) e
+InMemoryWindowStore es la implementación por proceso. Un backend compartido entre réplicas
+solo necesita implementar la misma interfaz (ver src/storage/state_backend.py).
+"""
+from __future__ import annotations
+from collections import OrderedDict, deque
+from threading import Lock
+from time import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class WindowStore:
+    """Interfaz de almacenamiento para SlidingWindowCounter."""
+
+    def hit(self, key: Hashable, window: float, now: float, limit: Optional[int] = None, count_rejected: bool = True) -> Tuple[int, bool]:
+        """Registra un evento y devuelve (eventos en la ventana, permitido).
+
+        Con limit, el evento solo se permite si la ventana tenía menos de `limit` eventos;
+        count_rejected=False no registra los eventos rechazados.
+        """
+        raise NotImplementedError
+
+    def count(self, key: Hashable, window: float, now: float) -> int:
+        raise NotImplementedError
+
+    def reset(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class _Window:
+    __slots__ = ("times", "window")
+
+    def __init__(self, window: float) -> None:
+        self.times: deque = deque()
+        self.window = window
+
+
+class InMemoryWindowStore(WindowStore):
+    """Ventanas en memoria del proceso, con expulsión de claves inactivas y tope de claves."""
+
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = int(max_keys)
+        self._data: "OrderedDict[Hashable, _Window]" = OrderedDict()
+        self._lock = Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evict_idle(self, now: float) -> None:
+        data = self._data
+        while data:
+            key, w = next(iter(data.items()))
+            if w.times and w.times[-1] + w.window > now:
+                break
+            del data[key]
+            self.expired += 1
+
+    def evict_idle(self, now: Optional[float] = None) -> None:
+        with self._lock:
+            self._evict_idle(time() if now is None else now)
+
+    def hit(self, key, window, now, limit=None, count_rejected=True):
+        with self._lock:
+            self._evict_idle(now)
+            w = self._data.get(key)
+            if w is None:
+                w = self._data[key] = _Window(window)
+                while len(self._data) > self.max_keys > 0:
+                    self._data.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._data.move_to_end(key)
+                w.window = window
+            times = w.times
+            cutoff = now - window
+            while times and times[0] <= cutoff:
+                times.popleft()
+            allowed = limit is None or len(times) < limit
+            if allowed or count_rejected:
+                times.append(now)
+            return len(times), allowed
+
+    def count(self, key, window, now):
+        with self._lock:
+            w = self._data.get(key)
+            if w is None:
+                return 0
+            cutoff = now - window
+            return sum(1 for t in w.times if t > cutoff)
+
+    def reset(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._data), "expired": self.expired, "evicted": self.evicted, "max_keys": self.max_keys}
+
+
+class SlidingWindowCounter:
+    """Eventos por clave en los últimos `window` segundos (un evento sale al cumplir `window` s)."""
+
+    def __init__(self, window: float, limit: Optional[int] = None, store: Optional[WindowStore] = None, count_rejected: bool = True) -> None:
+        self.window = float(window)
+        self.limit = limit
+        self.store = store if store is not None else InMemoryWindowStore()
+        self.count_rejected = count_rejected
+
+    def hit(self, key: Hashable, now: Optional[float] = None, window: Optional[float] = None) -> int:
+        """Registra un evento y devuelve cuántos hay en la ventana (incluido este)."""
+        n, _ = self.store.hit(key, self.window if window is None else float(window), time() if now is None else now, None, True)
+        return n
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """True si la clave no superó `limit` en la ventana (y registra el evento)."""
+        _, allowed = self.store.hit(key, self.window, time() if now is None else now, self.limit, self.count_rejected)
+        return allowed
+
+    def count(self, key: Hashable, now: Optional[float] = None) -> int:
+        return self.store.count(key, self.window, time() if now is None else now)
+
+    def reset(self, key: Hashable) -> None:
+        self.store.reset(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
+
+
+class _Bucket:
+    __slots__ = ("tokens", "last")
+
+    def __init__(self, tokens: float, last: float) -> None:
+        self.tokens = tokens
+        self.last = last
+
+
+class TokenBucket:
+    """Token bucket por clave: hasta `capacity` eventos en ráfaga y `rate` eventos/s sostenidos."""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 100_000) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_keys = int(max_keys)
+        self._buckets: "OrderedDict[Hashable, _Bucket]" = OrderedDict()
+        self._lock = Lock()
+        # Tras este tiempo sin uso un bucket vuelve a estar lleno: equivale a no tenerlo
+        self._idle = self.capacity / self.rate if self.rate > 0 else float("inf")
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict_idle(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            key, b = next(iter(buckets.items()))
+            if now - b.last < self._idle:
+                break
+            del buckets[key]
+
+    def allow(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> bool:
+        now = time() if now is None else now
+        with self._lock:
+            self._evict_idle(now)
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = _Bucket(self.capacity, now)
+                while len(self._buckets) > self.max_keys > 0:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                b.tokens = min(self.capacity, b.tokens + (now - b.last) * self.rate)
+                b.last = now
+            if b.tokens >= cost:
+                b.tokens -= cost
+                return True
+            return False
+
+    def wait_time(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> float:
+        """Segundos hasta que haya `cost` tokens disponibles (0 si ya los hay)."""
+        now = time() if now is None else now
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                return 0.0
+            tokens = min(self.capacity, b.tokens + (now - b.last) * self.rate)
+            if tokens >= cost:
+                return 0.0
+            return (cost - tokens) / self.rate if self.rate > 0 else float("inf")
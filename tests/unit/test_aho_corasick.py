@@ -0,0 +1,26 @@
+# test_aho_corasick.py - Prueba unitaria del matcher multi-patrón
+import unittest
+from src.utils.aho_corasick import AhoCorasickMatcher
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_subcadena_equivale_a_in(self):
+        terms = [f"palabra{i}" for i in range(100)] + ["spam", "he", "she", "hers"]
+        m = AhoCorasickMatcher(terms)
+        for texto in ["esto es spam", "ushers", "nada aqui", "xpalabra42y", ""]:
+            esperado = any(t in texto for t in terms)
+            self.assertEqual(m.search(texto) is not None, esperado, texto)
+        self.assertEqual([t for _, t in m.find_all("ushers")], ["she", "he", "hers"])
+
+    def test_palabra_completa(self):
+        m = AhoCorasickMatcher(["spam", "casino"] + [f"w{i}" for i in range(50)], whole_word=True)
+        self.assertIsNone(m.search("antispam"))
+        self.assertEqual(m.search("esto es spam!"), "spam")
+        self.assertEqual(m.search("casino_online casino"), "casino")
+
+    def test_lista_corta_reporta_termino(self):
+        m = AhoCorasickMatcher(["oferta", "spam"])
+        self.assertEqual(m.search("gran oferta"), "oferta")
+        self.assertIsNone(m.search("hola"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# test_audit_repository.py - Prueba unitaria de la auditoría (ring buffer, índices y segmentos en disco)
+import tempfile
+import unittest
+from pathlib import Path
+from src.storage.repository import AuditRepository
+
+class TestAuditRepository(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ring_buffer_e_indices_acotados(self):
+        audit = AuditRepository(max_records=5, log_dir="")
+        for i in range(8):
+            audit.add_action("bot", f"g{i % 2}", f"u{i % 3}", "warn", str(i))
+        self.assertEqual([r["reason"] for r in audit.records], ["3", "4", "5", "6", "7"])
+        stats = audit.stats()
+        self.assertEqual(stats["records"], 5)
+        # Los índices solo contienen lo que sigue en el ring buffer
+        self.assertEqual(sum(len(v) for v in audit._by_group.values()), 5)
+        self.assertEqual(sum(len(v) for v in audit._by_user.values()), 5)
+
+    def test_recent_actions(self):
+        audit = AuditRepository(max_records=100, log_dir="")
+        audit.add_action("bot", "g1", "u1", "warn", "a")
+        audit.add_action("bot", "g2", "u1", "mute", "b")
+        audit.add_action("bot", "g1", "u2", "ban", "c")
+        audit.add_action("bot", "g1", "u1", "kick", "d")
+        self.assertEqual([r["reason"] for r in audit.recent_actions(user_id="u1")], ["d", "b", "a"])
+        self.assertEqual([r["reason"] for r in audit.recent_actions(group_id="g1", user_id="u1")], ["d", "a"])
+        self.assertEqual([r["reason"] for r in audit.recent_actions(group_id="g1", limit=2)], ["d", "c"])
+        self.assertEqual([r["reason"] for r in audit.recent_actions(action="mute")], ["b"])
+        self.assertEqual(audit.recent_actions(user_id="nadie"), [])
+
+    def test_segmentos_y_recarga(self):
+        audit = AuditRepository(max_records=3, log_dir=self.tmp.name, segment_bytes=200, background=False)
+        for i in range(6):
+            audit.add_action("bot", "g", "u", "warn", str(i))
+            audit.flush()
+        self.assertGreater(len(list(Path(self.tmp.name).glob("audit-*.jsonl"))), 1)
+        self.assertEqual(audit.flush(), 0)
+        nuevo = AuditRepository(max_records=3, log_dir=self.tmp.name, background=False)
+        self.assertEqual([r["reason"] for r in nuevo.recent_actions(user_id="u")], ["5", "4", "3"])
+        nuevo.add_action("bot", "g", "u", "ban", "6")
+        nuevo.close()
+        otro = AuditRepository(max_records=10, log_dir=self.tmp.name, background=False)
+        self.assertEqual([r["reason"] for r in otro.records], [str(i) for i in range(7)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# test_chat_queue.py - Prueba unitaria de las colas ordenadas por chat (orden, paralelismo, backpressure y shedding)
+import asyncio
+import threading
+import time
+import unittest
+from src.bot_core.manager import BotManager
+from src.tasks.chat_queue import ChatScheduler, QueueFull
+
+
+class _Registro:
+    def __init__(self, pausa=None):
+        self.eventos = []
+        self.lock = threading.Lock()
+        self.pausa = pausa or {}
+
+    def __call__(self, payload, converse):
+        time.sleep(self.pausa.get(payload["group_id"], 0))
+        with self.lock:
+            self.eventos.append((payload["group_id"], payload["text"], converse))
+        return {"type": "noop", "text": payload["text"], "converse": converse}
+
+
+class TestChatScheduler(unittest.TestCase):
+    def tearDown(self):
+        self.sched.close(timeout=2)
+
+    def test_orden_por_chat_y_chats_en_paralelo(self):
+        reg = _Registro(pausa={"lento": 0.05})
+        self.sched = ChatScheduler(reg, workers=4, max_depth=100)
+        futs = [self.sched.submit({"group_id": "lento", "text": f"l{i}"}) for i in range(3)]
+        rapido = self.sched.submit({"group_id": "rapido", "text": "r"})
+        self.assertEqual(rapido.result(timeout=2)["text"], "r")
+        self.assertEqual([f.result(timeout=2)["text"] for f in futs], ["l0", "l1", "l2"])
+        self.assertEqual([t for g, t, _ in reg.eventos if g == "lento"], ["l0", "l1", "l2"])
+        self.assertEqual(reg.eventos[0][1], "r")
+        st = self.sched.stats()
+        self.assertEqual((st["depth"], st["chats"], st["processed"]), (0, 0, 4))
+
+    def test_cola_llena_rechaza(self):
+        liberar = threading.Event()
+        self.sched = ChatScheduler(lambda p, c: liberar.wait(2) and {}, workers=1, max_depth=2, shed_depth=2)
+        bloqueado = self.sched.submit({"group_id": "a", "text": "0"})
+        while self.sched.depth() > 0:
+            time.sleep(0.005)
+        self.sched.submit({"group_id": "a", "text": "1"})
+        self.sched.submit({"group_id": "b", "text": "2"})
+        self.assertEqual(self.sched.depth("a"), 1)
+        with self.assertRaises(QueueFull):
+            self.sched.submit({"group_id": "c", "text": "3"})
+        self.assertEqual(self.sched.stats()["rejected"], 1)
+        liberar.set()
+        bloqueado.result(timeout=2)
+        # Con timeout, submit espera a que se libere sitio
+        self.sched.submit({"group_id": "c", "text": "4"}, timeout=2).result(timeout=2)
+
+    def test_lote_entra_entero_o_no_entra(self):
+        liberar = threading.Event()
+        self.sched = ChatScheduler(lambda p, c: liberar.wait(2) and {}, workers=1, max_depth=3)
+        self.sched.submit({"group_id": "a", "text": "0"})
+        while self.sched.depth() > 0:
+            time.sleep(0.005)
+        with self.assertRaises(QueueFull):
+            self.sched.submit_many([{"group_id": "b", "text": str(i)} for i in range(4)])
+        self.assertEqual(self.sched.depth(), 0)
+        # Cada trabajo puede traer su propio handler
+        futs = self.sched.submit_many([{"group_id": "b", "text": "x"}], handler=lambda p, c: {"propio": p["text"]})
+        liberar.set()
+        self.assertEqual(futs[0].result(timeout=2), {"propio": "x"})
+
+    def test_submit_async_espera_sitio_sin_sondear(self):
+        liberar = threading.Event()
+        self.sched = ChatScheduler(lambda p, c: liberar.wait(2) and {"ok": p["text"]}, workers=1, max_depth=1)
+        self.sched.submit({"group_id": "a", "text": "0"})
+        while self.sched.depth() > 0:
+            time.sleep(0.005)
+        self.sched.submit({"group_id": "a", "text": "1"})
+
+        async def esperar():
+            tarea = asyncio.ensure_future(self.sched.process({"group_id": "b", "text": "2"}, timeout=2))
+            await asyncio.sleep(0.05)
+            # Esperando sitio: registrado una sola vez, sin reintentos periódicos
+            self.assertEqual(len(self.sched._async_space), 1)
+            liberar.set()
+            return await tarea
+
+        self.assertEqual(asyncio.run(esperar()), {"ok": "2"})
+        self.assertEqual(self.sched._async_space, [])
+        with self.assertRaises(QueueFull):
+            asyncio.run(self.sched.submit_async([{"group_id": "c", "text": str(i)} for i in range(2)]))
+
+    def test_shedding_de_respuestas_con_carga(self):
+        liberar = threading.Event()
+        reg = _Registro()
+
+        def handler(payload, converse):
+            if payload["text"] == "bloqueo":
+                liberar.wait(2)
+            return reg(payload, converse)
+
+        self.sched = ChatScheduler(handler, workers=1, max_depth=100, shed_depth=100, chat_shed_depth=3)
+        self.sched.submit({"group_id": "x", "text": "bloqueo"})
+        futs = [self.sched.submit({"group_id": "spam", "text": f"s{i}"}) for i in range(4)]
+        liberar.set()
+        res = [f.result(timeout=2) for f in futs]
+        # Mientras el chat acumula >= 3 pendientes solo se modera; los últimos ya conversan
+        self.assertEqual([r["converse"] for r in res], [False, False, True, True])
+        self.assertEqual(self.sched.stats()["shed"], 2)
+
+    def test_pipeline_real_solo_modera_al_descartar(self):
+        manager = BotManager(rate_limit_max=100)
+        self.sched = ChatScheduler(lambda p, c: manager.process_message(p, converse=c), workers=2)
+        base = {"platform": "telegram", "platform_user_id": "u-cq", "group_id": "g-cq"}
+        self.assertEqual(manager.process_message(dict(base, text="hola"), converse=False), {"type": "noop", "reason": "shed"})
+        res = asyncio.run(self.sched.process(dict(base, text="hola")))
+        self.assertEqual(res["type"], "reply")
+
+
+if __name__ == "__main__":
+    unittest.main()
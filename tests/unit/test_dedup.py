@@ -0,0 +1,94 @@
+# test_dedup.py - Prueba unitaria de la deduplicación por id de mensaje
+import unittest
+from unittest import mock
+from src.bot_core import manager as manager_mod
+from src.bot_core.manager import BotManager
+from src.utils.dedup import BloomFilter, Deduplicator, RecentIds
+
+class TestRecentIds(unittest.TestCase):
+    def test_duplicado_dentro_del_ttl(self):
+        ids = RecentIds(ttl=10)
+        self.assertFalse(ids.seen_or_add("a", now=100))
+        self.assertTrue(ids.seen_or_add("a", now=105))
+        self.assertFalse(ids.seen_or_add("a", now=111))
+        self.assertEqual(ids.stats()["duplicates"], 1)
+
+    def test_tope_y_forget(self):
+        ids = RecentIds(ttl=100, max_keys=2)
+        for k in ("a", "b", "c"):
+            ids.seen_or_add(k, now=1)
+        self.assertEqual(len(ids), 2)
+        self.assertFalse(ids.seen_or_add("a", now=2))
+        ids.forget("c")
+        self.assertFalse(ids.seen_or_add("c", now=3))
+
+class TestBloomFilter(unittest.TestCase):
+    def test_sin_falsos_negativos_y_pocos_positivos(self):
+        bf = BloomFilter(capacity=5000, error_rate=1e-3)
+        for i in range(5000):
+            bf.add(f"m{i}")
+        self.assertTrue(all(f"m{i}" in bf for i in range(5000)))
+        falsos = sum(1 for i in range(20000) if f"x{i}" in bf)
+        self.assertLess(falsos, 20000 * 5e-3)
+
+class TestDeduplicator(unittest.TestCase):
+    def test_bloom_recuerda_lo_expulsado_del_conjunto_exacto(self):
+        d = Deduplicator(ttl=600, max_keys=2, bloom_ttl=3600, bloom_capacity=1000)
+        for mid in ("1", "2", "3"):
+            self.assertFalse(d.seen("telegram", "g", mid))
+        self.assertTrue(d.seen("telegram", "g", "1"))
+        self.assertFalse(d.seen("telegram", "otro", "1"))
+        self.assertEqual(d.stats()["duplicates"], 1)
+
+    def test_contains_no_registra(self):
+        d = Deduplicator()
+        self.assertFalse(d.contains("whatsapp", None, "wamid.1"))
+        self.assertFalse(d.contains("whatsapp", None, "wamid.1"))
+        d.add("whatsapp", None, "wamid.1")
+        self.assertTrue(d.contains("whatsapp", None, "wamid.1"))
+
+    def test_forget_permite_el_reintento(self):
+        d = Deduplicator(ttl=600, max_keys=10, bloom_ttl=3600, bloom_capacity=1000)
+        self.assertFalse(d.seen("whatsapp", None, "wamid.f1"))
+        d.forget("whatsapp", None, "wamid.f1")
+        # El bloom solo recibe lo que sale del conjunto exacto: olvidar no deja rastro
+        self.assertFalse(d.contains("whatsapp", None, "wamid.f1"))
+        self.assertFalse(d.seen("whatsapp", None, "wamid.f1"))
+        self.assertTrue(d.seen("whatsapp", None, "wamid.f1"))
+
+    def test_backend_compartido_solo_guarda_la_ventana_exacta(self):
+        from src.storage.state_backend import InMemoryStateBackend
+        backend = InMemoryStateBackend()
+        d = Deduplicator(ttl=600, max_keys=1, bloom_ttl=86400, bloom_capacity=1000, backend=backend)
+        with mock.patch.object(backend, "claim", wraps=backend.claim) as claim:
+            self.assertFalse(d.seen("telegram", "g", "1"))
+            self.assertTrue(d.seen("telegram", "g", "1"))
+        self.assertEqual(claim.call_args_list[0].args[1], 600)
+        # Lo que sale de la ventana local pasa al Bloom, aunque la marca compartida ya no esté
+        self.assertFalse(d.seen("telegram", "g", "2"))
+        backend.release(Deduplicator.key("telegram", "g", "1"))
+        self.assertTrue(d.seen("telegram", "g", "1"))
+
+    def test_manager_no_procesa_dos_veces(self):
+        manager = BotManager()
+        payload = {"platform": "telegram", "platform_user_id": "u-dedup", "group_id": "g-dedup", "text": "hola", "message_id": 777}
+        self.assertNotEqual(manager.process_message(dict(payload)).get("reason"), "duplicate")
+        self.assertEqual(manager.process_message(dict(payload)), {"type": "noop", "reason": "duplicate"})
+        lote = manager.process_batch([dict(payload, message_id=778), dict(payload, message_id=778)])
+        self.assertEqual(lote[1], {"type": "noop", "reason": "duplicate"})
+        self.assertNotEqual(lote[0].get("reason"), "duplicate")
+
+    def test_fallo_al_procesar_permite_el_reintento(self):
+        manager = BotManager()
+        payload = {"platform": "telegram", "platform_user_id": "u-fallo", "group_id": "g-fallo", "text": "hola", "message_id": 901}
+        with mock.patch.object(manager_mod, "revisar_mensaje", side_effect=RuntimeError("db caída")):
+            with self.assertRaises(RuntimeError):
+                manager.process_message(dict(payload))
+            with self.assertRaises(RuntimeError):
+                manager.process_batch([dict(payload, message_id=902), dict(payload, message_id=903)])
+        for mid in (901, 902, 903):
+            self.assertNotEqual(manager.process_message(dict(payload, message_id=mid)).get("reason"), "duplicate")
+        self.assertEqual(manager.process_message(dict(payload, message_id=901)), {"type": "noop", "reason": "duplicate"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+# test_features.py - Prueba unitaria del análisis de mensaje compartido (MessageFeatures)
+import unittest
+from src.nlu.features import MessageFeatures
+
+class TestMessageFeatures(unittest.TestCase):
+    def test_rasgos_basicos(self):
+        f = MessageFeatures('HOLA a Todos, voten "¿Cuál color?" [rojo, azul] en https://Example.com')
+        self.assertEqual(f.normalized, 'hola a todos, voten "¿cual color?" [rojo, azul] en https://example.com')
+        self.assertEqual(f.length, len(f.normalized))
+        self.assertEqual(f.first_url, "https://example.com")
+        self.assertEqual(f.intent, "greeting")
+        self.assertEqual(f.entities["options"], ["rojo", "azul"])
+        self.assertIn("rojo", f.tokens)
+        self.assertNotIn("a", f.tokens)
+
+    def test_caps_ratio_y_memoizacion(self):
+        f = MessageFeatures("GRITO fuerte 123")
+        self.assertEqual(f.caps_ratio, 45)
+        self.assertIs(f.tokens, f.tokens)
+        self.assertEqual(MessageFeatures("123 !!").caps_ratio, 0)
+
+    def test_measure_acumula(self):
+        f = MessageFeatures("hola")
+        with f.measure("nlu"):
+            pass
+        with f.measure("nlu"):
+            pass
+        self.assertIn("nlu", f.timings)
+        self.assertGreaterEqual(f.timings["nlu"], 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# test_http_client.py - Prueba unitaria del cliente HTTP asíncrono (reintentos y envío a Telegram)
+import asyncio
+import unittest
+import httpx
+from src.connectors import http_client
+from src.connectors.dispatcher import enviar_respuesta_async
+
+def _cliente(respuestas, vistos):
+    def handler(request):
+        vistos.append(request)
+        r = respuestas.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+class TestHttpClient(unittest.IsolatedAsyncioTestCase):
+    async def test_reintenta_5xx_y_errores_de_red(self):
+        vistos = []
+        respuestas = [httpx.Response(502), httpx.ConnectError("caído"), httpx.Response(200, json={"ok": True})]
+        async with _cliente(respuestas, vistos) as client:
+            resp = await http_client.post_json_with_retries("https://x/api", {"a": 1}, retries=3, backoff=0, client=client)
+        self.assertEqual(resp.json(), {"ok": True})
+        self.assertEqual(len(vistos), 3)
+
+    async def test_no_reintenta_4xx(self):
+        vistos = []
+        async with _cliente([httpx.Response(400, text="bad"), httpx.Response(200)], vistos) as client:
+            with self.assertRaises(RuntimeError) as ctx:
+                await http_client.post_json_with_retries("https://x/api", {}, retries=3, backoff=0, client=client)
+        self.assertIn("HTTP 400", str(ctx.exception))
+        self.assertEqual(len(vistos), 1)
+
+    async def test_429_devuelve_retry_after_sin_reintentar(self):
+        vistos = []
+        respuestas = [httpx.Response(429, json={"ok": False, "parameters": {"retry_after": 7}}), httpx.Response(200)]
+        async with _cliente(respuestas, vistos) as client:
+            with self.assertRaises(http_client.RateLimited) as ctx:
+                await http_client.post_json_with_retries("https://x/api", {}, retries=3, backoff=0, client=client)
+        self.assertEqual(ctx.exception.retry_after, 7.0)
+        self.assertEqual(len(vistos), 1)
+
+    async def test_cliente_por_loop_y_envio_telegram(self):
+        vistos = []
+        client = _cliente([httpx.Response(200, json={"ok": True, "result": {}})], vistos)
+        http_client._clients[asyncio.get_running_loop()] = {"telegram": client}
+        self.assertIs(http_client.get_async_client("telegram"), client)
+        out = await enviar_respuesta_async("telegram", {"group_id": "-100", "platform_user_id": "u"}, {"text": "hola"})
+        self.assertEqual(out["result"]["ok"], True)
+        self.assertEqual(vistos[0].url.path.rsplit("/", 1)[-1], "sendMessage")
+        await http_client.close_async_client()
+        self.assertTrue(client.is_closed)
+
+if __name__ == "__main__":
+    unittest.main()
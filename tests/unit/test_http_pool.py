@@ -0,0 +1,54 @@
+# test_http_pool.py - Prueba unitaria de la reutilización de conexiones (sesiones compartidas y métricas)
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.connectors import http_client
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"ok": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestHttpPool(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/send"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    async def test_cliente_async_reutiliza_conexion(self):
+        for _ in range(5):
+            resp = await http_client.post_json_with_retries(self.url, {"x": 1}, platform="test-async")
+            self.assertEqual(resp.json(), {"ok": True})
+        stats = http_client.http_stats()["test-async"]["async"]
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reuse_ratio"], 0.8)
+        await http_client.close_async_client()
+
+    async def test_sesion_sync_compartida(self):
+        session = http_client.get_session("test-sync")
+        self.assertIs(http_client.get_session("test-sync"), session)
+        for _ in range(4):
+            self.assertEqual(session.post(self.url, json={}).status_code, 200)
+        stats = http_client.http_stats()["test-sync"]["sync"]
+        self.assertEqual((stats["requests"], stats["connections"]), (4, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+# test_language_utils.py - Prueba unitaria de la normalización compartida
+import unicodedata
+import unittest
+from src.nlu.language_utils import fold_text, strip_accents
+from src.ml.tokenizer import normalize
+
+def _nfd_strip(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+class TestNormalizacion(unittest.TestCase):
+    def test_strip_accents_equivale_a_nfd(self):
+        for t in ("rápido", "ÁÉÍÓÚ ñÑ üÜ", "ça va", "Ελληνικά ά", "tiếng Việt", "é", "ß ø ¡hola!", "plain"):
+            self.assertEqual(strip_accents(t), _nfd_strip(t))
+
+    def test_fold_text(self):
+        self.assertEqual(fold_text("  Hola   MUNDO\tcómo  "), "hola mundo como")
+        self.assertEqual(fold_text(""), "")
+        self.assertEqual(fold_text(None), "")
+        largo = "Árbol " * 50
+        self.assertEqual(fold_text(largo), ("arbol " * 50).strip())
+
+    def test_tokenizer_normalize(self):
+        self.assertEqual(normalize("¡Gana DINERO rápido!!"), "¡gana dinero rapido")
+
+if __name__ == "__main__":
+    unittest.main()
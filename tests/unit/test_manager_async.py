@@ -0,0 +1,67 @@
+# test_manager_async.py - Prueba unitaria de la fachada async de BotManager (cola por chat compartida)
+import asyncio
+import threading
+import time
+import unittest
+from src.bot_core.manager import BotManager
+
+class TestManagerAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_orden_por_chat_y_chats_en_paralelo(self):
+        manager = BotManager()
+        eventos = []
+        lock = threading.Lock()
+
+        def lento(payload, **kw):
+            if payload["group_id"] == "lento":
+                time.sleep(0.05)
+            with lock:
+                eventos.append(payload["text"])
+            return {"type": "noop", "hilo": threading.current_thread().name}
+
+        manager.process_message = lento
+        tareas = [
+            asyncio.create_task(manager.process_message_async({"group_id": "lento", "text": f"l{i}"}))
+            for i in range(3)
+        ]
+        rapido = asyncio.create_task(manager.process_message_async({"group_id": "rapido", "text": "r"}))
+        results = await asyncio.gather(*tareas, rapido)
+        self.assertEqual([e for e in eventos if e.startswith("l")], ["l0", "l1", "l2"])
+        self.assertEqual(eventos[0], "r")
+        self.assertTrue(all(r["hilo"].startswith("chat-queue") for r in results))
+
+    async def test_cancelar_la_espera_no_salta_la_moderacion(self):
+        manager = BotManager()
+        procesados = []
+        empezar = threading.Event()
+
+        def registrar(payload, **kw):
+            empezar.wait(2)
+            procesados.append(payload["text"])
+            return {"type": "noop"}
+
+        manager.process_message = registrar
+        tareas = [asyncio.create_task(manager.process_message_async({"group_id": "cancel", "text": t})) for t in "ab"]
+        await asyncio.sleep(0.05)
+        tareas[1].cancel()
+        empezar.set()
+        self.assertEqual(await tareas[0], {"type": "noop"})
+        with self.assertRaises(asyncio.CancelledError):
+            await tareas[1]
+        while len(procesados) < 2:
+            await asyncio.sleep(0.01)
+        self.assertEqual(procesados, ["a", "b"])
+
+    async def test_lote_por_la_cola_en_orden(self):
+        manager = BotManager(rate_limit_max=100)
+        base = {"platform": "telegram", "platform_user_id": "u-lote", "group_id": "g-lote"}
+        res = await manager.process_batch_async([dict(base, text="hola", message_id=1), dict(base, text="hola", message_id=1)])
+        self.assertEqual(res[1], {"type": "noop", "reason": "duplicate"})
+        self.assertNotEqual(res[0].get("reason"), "duplicate")
+
+    async def test_pipeline_real(self):
+        manager = BotManager()
+        res = await manager.process_message_async({"platform": "telegram", "platform_user_id": "u-async", "group_id": "g-async", "text": "hola"})
+        self.assertIn("type", res)
+
+if __name__ == "__main__":
+    unittest.main()
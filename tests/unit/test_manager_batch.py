@@ -0,0 +1,28 @@
+# test_manager_batch.py - Prueba unitaria de BotManager.process_batch
+import unittest
+from src.bot_core.manager import BotManager
+
+def _payload(user, group, text):
+    return {"platform": "web", "platform_user_id": user, "group_id": group, "text": text, "is_group": False}
+
+class TestProcessBatch(unittest.TestCase):
+    def test_batch_equivale_a_secuencial_y_respeta_orden(self):
+        payloads = [
+            _payload("u1", "default", "hola"),
+            _payload("u2", "otro", "quiero una encuesta"),
+            _payload("u3", "default", ""),
+            _payload("u4", "default", "sorteo (ana, luis)"),
+        ]
+        esperado = [BotManager(rate_limit_max=100).process_message(dict(p)) for p in payloads]
+        obtenido = BotManager(rate_limit_max=100).process_batch([dict(p) for p in payloads])
+        self.assertEqual(len(obtenido), len(payloads))
+        for e, o in zip(esperado, obtenido):
+            self.assertEqual(e.get("type"), o.get("type"))
+            if e.get("type") != "raffle":
+                self.assertEqual(e, o)
+
+    def test_batch_vacio(self):
+        self.assertEqual(BotManager().process_batch([]), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# test_ml_feedback.py - Prueba unitaria del aprendizaje incremental (feedback de admins)
+import os
+import tempfile
+import unittest
+from src.ml.feedback import FeedbackStore
+from src.ml.nb_text import NaiveBayesText
+from src.ml.runtime import Scorer
+
+TRAINING = {
+    "toxic": ["eres un idiota", "maldito imbecil"],
+    "spam": ["gana dinero rapido", "oferta limitada"],
+    "normal": ["hola como estas", "gracias por la ayuda"],
+}
+
+class TestFeedback(unittest.TestCase):
+    def test_partial_fit_equivale_a_reentrenar(self):
+        model = NaiveBayesText.train(TRAINING)
+        model.partial_fit(["dinero para la ayuda"], ["normal"])
+        extendido = {k: list(v) for k, v in TRAINING.items()}
+        extendido["normal"].append("dinero para la ayuda")
+        full = NaiveBayesText.train(extendido)
+        for t in ("dinero", "hola idiota", "zzz"):
+            for k, v in full.score(t).items():
+                self.assertAlmostEqual(v, model.score(t)[k], places=9)
+
+    def test_remove_deshace_add(self):
+        model = NaiveBayesText.train(TRAINING)
+        antes = model.score("oferta de ayuda")
+        model.add_document("oferta de ayuda", "normal")
+        self.assertTrue(model.remove_document("oferta de ayuda", "normal"))
+        for k, v in antes.items():
+            self.assertAlmostEqual(v, model.score("oferta de ayuda")[k], places=9)
+
+    def test_store_persiste_y_valida(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fb.jsonl")
+            store = FeedbackStore(path)
+            store.record("g1", "hola", "normal", "add", by="admin")
+            with self.assertRaises(ValueError):
+                store.record("g1", "hola", "odio", "add")
+            recargado = FeedbackStore(path)
+            self.assertTrue(recargado.has_feedback("g1"))
+            self.assertEqual(recargado.deltas_for("g1"), [("add", "normal", "hola")])
+            self.assertFalse(recargado.has_feedback("g2"))
+
+    def test_store_ve_lo_que_escriben_otros_procesos(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fb.jsonl")
+            lector = FeedbackStore(path, check_interval=0)
+            self.assertEqual(lector.count("g1"), 0)
+            FeedbackStore(path).record("g1", "hola", "normal", "add")
+            self.assertEqual(lector.count("g1"), 1)
+            lector.record("g1", "hola", "normal", "remove")
+            FeedbackStore(path).record("g1", "oferta", "spam", "add")
+            self.assertEqual(lector.deltas_for("g1"), [
+                ("add", "normal", "hola"), ("remove", "normal", "hola"), ("add", "spam", "oferta"),
+            ])
+
+    def test_scorer_sync_registra_si_cada_delta_cambio_el_modelo(self):
+        counts = NaiveBayesText.train({k: v for k, v in TRAINING.items() if k != "spam"})
+        scorer = Scorer(counts, counts=counts)
+        deltas = [("add", "normal", "hola"), ("remove", "spam", "oferta")]
+        scorer.sync(deltas[:1])
+        scorer.sync(deltas)
+        self.assertEqual(scorer.applied, 2)
+        self.assertTrue(scorer.outcome(0))
+        # Quitar de una clase sin ejemplos no cambia nada
+        self.assertFalse(scorer.outcome(1))
+        self.assertFalse(scorer.outcome(2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# test_ml_runtime.py - Prueba unitaria del caché de modelos ML
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from src.ml import runtime
+from src.ml.model_store import load_model, model_path
+from src.ml.runtime import ModelCache, Scorer, get_moderation_scorer, training_hash
+from src.ml.nb_text import NaiveBayesText, np
+
+ML_CFG = {"enabled": True, "training": {"toxic": ["idiota"], "spam": ["gana dinero"], "normal": ["hola"]}}
+
+class TestModelCache(unittest.TestCase):
+    def test_hash_independiente_del_orden_y_formato(self):
+        otro = {"training": {"toxic": [" IDIOTA "], "spam": ["gana dinero"], "normal": ["hola"]}}
+        self.assertEqual(training_hash(ML_CFG), training_hash(otro))
+        self.assertNotEqual(training_hash(ML_CFG), training_hash({"training": {"toxic": ["x"]}}))
+
+    def test_modelo_compartido_entre_chats(self):
+        a = get_moderation_scorer("chat-a", ML_CFG)
+        b = get_moderation_scorer("chat-b", ML_CFG, training_hash(ML_CFG))
+        self.assertIs(a, b)
+
+    def test_lru_expulsa_y_cuenta(self):
+        cache = ModelCache(max_entries=2)
+        scorer = Scorer(NaiveBayesText.train({"toxic": ["x"]}))
+        for k in ("a", "b", "c"):
+            cache.put((k, False), scorer)
+        self.assertIsNone(cache.get(("a", False)))
+        self.assertIs(cache.get(("c", False)), scorer)
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"], stats["hits"], stats["misses"]), (2, 1, 1, 1))
+
+@unittest.skipIf(np is None, "numpy no instalado")
+class TestLoadOrTrain(unittest.TestCase):
+    def test_archivo_corrupto_se_reentrena_y_sobrescribe(self):
+        h = training_hash(ML_CFG)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {"ML_MODEL_DIR": tmp}):
+            path = model_path(tmp, h)
+            entrenado = runtime._load_or_train(ML_CFG, h, vectorized=True)
+            for basura in (b"", b"CGNB\x01\x00" + b"\xff" * 64):
+                Path(path).write_bytes(basura)
+                modelo = runtime._load_or_train(ML_CFG, h, vectorized=True)
+                self.assertEqual(modelo.classes, entrenado.classes)
+                self.assertEqual(load_model(path, expected_hash=h).vocab, entrenado.vocab)
+            # Entrenado y cargado usan el mismo dtype y dan los mismos scores
+            cargado = runtime._load_or_train(ML_CFG, h, vectorized=True)
+            self.assertEqual(cargado.log_likelihood.dtype, entrenado.log_likelihood.dtype)
+            self.assertEqual(cargado.score("hola idiota"), entrenado.score("hola idiota"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+# test_model_store.py - Prueba unitaria de persistencia de modelos ML
+import tempfile
+import unittest
+from pathlib import Path
+from src.ml.nb_text import NaiveBayesText, ArrayNaiveBayes, np
+from src.ml.model_store import StaleModelError, load_model, model_path, save_model
+
+@unittest.skipIf(np is None, "numpy no instalado")
+class TestModelStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.hash = "0123456789abcdef0123456789abcdef"
+        base = NaiveBayesText.train({"toxic": ["eres un idiota"], "spam": ["gana dinero"], "normal": ["hola amigos"]})
+        self.model = ArrayNaiveBayes.from_model(base)
+        self.path = save_model(self.model, model_path(self.tmp.name, self.hash), self.hash)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ida_y_vuelta_mmap(self):
+        loaded = load_model(self.path, expected_hash=self.hash)
+        self.assertEqual(loaded.classes, self.model.classes)
+        self.assertEqual(loaded.vocab, self.model.vocab)
+        self.assertFalse(loaded.log_likelihood.flags.writeable)
+        for texto in ("hola idiota", "gana dinero ya", ""):
+            for k, v in self.model.score(texto).items():
+                self.assertAlmostEqual(v, loaded.score(texto)[k], places=5)
+
+    def test_hash_distinto_es_obsoleto(self):
+        with self.assertRaises(StaleModelError):
+            load_model(self.path, expected_hash="f" * 32)
+        Path(self.path).write_bytes(b"basura")
+        with self.assertRaises(StaleModelError):
+            load_model(self.path)
+
+if __name__ == "__main__":
+    unittest.main()
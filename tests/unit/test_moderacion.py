@@ -1,5 +1,11 @@
 # test_moderacion.py - Prueba unitaria para el handler de moderación
 import unittest
+from dataclasses import replace
+from types import MappingProxyType
+from unittest import mock
+from src.bot_core import manager as manager_mod
+from src.bot_core.manager import BotManager
+from src.config.rules_loader import get_moderation_plan
 from src.handlers.moderacion import revisar_mensaje
 
 class TestModeracion(unittest.TestCase):
@@ -12,6 +18,17 @@ class TestModeracion(unittest.TestCase):
         self.assertEqual(resultado.get("type"), "moderation")
         # Puede ser delete/warn/mute/kick/ban según thresholds; verificar claves base
         self.assertIn(resultado.get("action", "warn"), ["delete", "warn", "mute", "kick", "ban"])
+    def test_mayusculas_se_miden_sobre_el_texto_original(self):
+        # Por el BotManager el texto llega normalizado (minúsculas): el ratio sale del original
+        plan = get_moderation_plan("default")
+        gritos = replace(plan, config=MappingProxyType(dict(plan.config, caps_lock_threshold=70)))
+        manager = BotManager(rate_limit_max=100)
+        base = {"platform": "telegram", "platform_user_id": "u-caps", "group_id": "g-caps"}
+        with mock.patch.object(manager_mod, "get_moderation_plan", return_value=gritos):
+            resultado = manager.process_message(dict(base, text="ESTO ES UN GRITO ENORME"))
+            normal = manager.process_message(dict(base, text="Esto es un mensaje normal"))
+        self.assertEqual((resultado["type"], resultado["action"]), ("moderation", "warn"))
+        self.assertNotEqual(normal.get("type"), "moderation")
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,99 @@
+# test_moderation_repository.py - Prueba unitaria del repositorio de moderación (TTL, decay y tope)
+import unittest
+from src.storage.repository import ModerationRepository
+
+class _Reloj:
+    def __init__(self):
+        self.t = 1000.0
+    def __call__(self):
+        return self.t
+
+class TestModerationRepository(unittest.TestCase):
+    def setUp(self):
+        self.reloj = _Reloj()
+
+    def _repo(self, **kw):
+        repo = ModerationRepository(**kw)
+        repo._time = self.reloj
+        return repo
+
+    def test_compatibilidad_basica(self):
+        repo = self._repo(record_ttl=0)
+        self.assertEqual(repo.get_record("c", "u"), {"count": 0, "muted_until": None, "banned": False})
+        self.assertEqual(repo.add_violation("c", "u"), 1)
+        self.assertEqual(repo.add_violation("c", "u"), 2)
+        repo.set_muted("c", "u", 60)
+        self.assertTrue(repo.is_muted("c", "u"))
+        self.reloj.t += 61
+        self.assertFalse(repo.is_muted("c", "u"))
+        self.assertEqual(repo.get_record("c", "u")["count"], 2)
+        repo.reset("c", "u")
+        self.assertEqual(repo.get_record("c", "u")["count"], 0)
+
+    def test_expiracion_perezosa(self):
+        repo = self._repo(record_ttl=100)
+        repo.add_violation("c", "u1")
+        repo.set_muted("c", "u2", 500)
+        repo.set_banned("c", "u3", True)
+        for _ in range(3):
+            repo.register_message("c", "u4", 60)
+        self.reloj.t += 200
+        stats = repo.stats()
+        # u1 inactivo y ventana antiflood de u4 expiran; u2 sigue muteado y u3 baneado
+        self.assertEqual(stats["records"], 2)
+        self.assertEqual(stats["flood_windows"], 0)
+        self.reloj.t += 400
+        self.assertEqual(repo.stats()["records"], 1)
+
+    def test_decay_de_infracciones(self):
+        repo = self._repo(record_ttl=0, decay_seconds=60)
+        for _ in range(3):
+            repo.add_violation("c", "u")
+        self.reloj.t += 130
+        self.assertEqual(repo.get_record("c", "u")["count"], 1)
+        self.assertEqual(repo.add_violation("c", "u"), 2)
+        self.reloj.t += 121
+        self.assertEqual(repo.stats()["records"], 0)
+
+    def test_antiflood_y_tope_de_memoria(self):
+        repo = self._repo(max_records=2, record_ttl=0)
+        self.assertEqual(repo.register_message("c", "u", 60), 1)
+        self.reloj.t += 30
+        self.assertEqual(repo.register_message("c", "u", 60), 2)
+        self.reloj.t += 45
+        self.assertEqual(repo.register_message("c", "u", 60), 2)
+        for u in ("a", "b", "c"):
+            repo.add_violation("c", u)
+        stats = repo.stats()
+        self.assertEqual(stats["records"], 2)
+        self.assertEqual(stats["evicted"], 1)
+        self.assertEqual(repo.get_record("c", "a")["count"], 0)
+
+    def test_tope_no_expulsa_castigos_vigentes(self):
+        repo = self._repo(max_records=3, record_ttl=0)
+        repo.set_banned("c", "baneado")
+        repo.set_muted("c", "muteado", 600)
+        repo.add_violation("c", "infractor")
+        repo.register_message("c", "limpio", 60)
+        repo.get_record("c", "limpio")
+        # Sin registros limpios, se expulsa el infractor sin castigo vigente
+        repo.add_violation("c", "nuevo")
+        self.assertEqual(repo.get_record("c", "infractor")["count"], 0)
+        self.assertTrue(repo.get_record("c", "baneado")["banned"])
+        self.assertTrue(repo.is_muted("c", "muteado"))
+        # Con solo castigos vigentes se supera el tope antes que perder uno
+        repo.set_muted("c", "nuevo", 600)
+        repo.set_banned("c", "otro")
+        self.assertEqual(repo.stats()["records"], 4)
+        self.assertTrue(repo.is_muted("c", "nuevo"))
+        self.assertEqual([len(i) for i in repo._evictable], [0, 0])
+        # Los mutes vencidos vuelven a ser expulsables; los bans no
+        self.reloj.t += 601
+        repo.add_violation("c", "ultimo")
+        self.assertEqual(repo.stats()["records"], 3)
+        self.assertEqual(repo.get_record("c", "muteado")["muted_until"], None)
+        self.assertTrue(repo.get_record("c", "baneado")["banned"])
+        self.assertTrue(repo.get_record("c", "otro")["banned"])
+
+if __name__ == "__main__":
+    unittest.main()
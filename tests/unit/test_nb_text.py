@@ -0,0 +1,35 @@
+# test_nb_text.py - Prueba unitaria del modelo Naive Bayes (puro y vectorizado)
+import unittest
+from src.ml.nb_text import NaiveBayesText, ArrayNaiveBayes, np
+
+TRAINING = {
+    "toxic": ["eres un idiota", "maldito imbecil", "idiota total"],
+    "spam": ["gana dinero rapido", "haz clic aqui", "oferta limitada gana"],
+    "normal": ["hola como estas", "gracias por la ayuda", "buenos dias a todos"],
+}
+TEXTOS = ["hola idiota", "gana dinero ya", "", "palabras desconocidas zzz", "Gracias, ¡Rápido!"]
+
+@unittest.skipIf(np is None, "numpy no instalado")
+class TestArrayNaiveBayes(unittest.TestCase):
+    def setUp(self):
+        self.model = NaiveBayesText.train(TRAINING)
+        self.arr = ArrayNaiveBayes.from_model(self.model)
+
+    def test_score_equivale_al_modelo_puro(self):
+        for t in TEXTOS:
+            esperado = self.model.score(t)
+            obtenido = self.arr.score(t)
+            self.assertEqual(set(esperado), set(obtenido))
+            # Las tablas vectorizadas son float32
+            for k, v in esperado.items():
+                self.assertAlmostEqual(v, obtenido[k], places=6)
+
+    def test_score_batch_equivale_a_score(self):
+        batch = self.arr.score_batch(TEXTOS)
+        self.assertEqual(len(batch), len(TEXTOS))
+        for t, s in zip(TEXTOS, batch):
+            for k, v in self.arr.score(t).items():
+                self.assertAlmostEqual(v, s[k], places=9)
+
+if __name__ == "__main__":
+    unittest.main()
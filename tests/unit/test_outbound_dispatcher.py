@@ -0,0 +1,55 @@
+# test_outbound_dispatcher.py - Prueba unitaria de la cola de salida (prioridad, coalescing, 429, buckets)
+import asyncio
+import time
+import unittest
+from src.connectors.dispatcher import PRIORITY_MODERATION, PRIORITY_REPLY, OutboundDispatcher
+
+def _limits(**kw):
+    base = {"global_rate": 1000.0, "global_burst": 1000, "chat_rate": 1000.0, "chat_burst": 1000, "rate_limit_scope": "chat", "max_len": 4096}
+    base.update(kw)
+    return {"tg": base}
+
+class TestOutboundDispatcher(unittest.IsolatedAsyncioTestCase):
+    def _sender(self, enviados, chat, respuestas=None):
+        async def send(text):
+            enviados.append((chat, text, time.monotonic()))
+            if respuestas:
+                return respuestas.pop(0)
+            return {"ok": True}
+        return send
+
+    async def test_moderacion_antes_que_respuestas_y_coalescing(self):
+        d = OutboundDispatcher(_limits())
+        enviados = []
+        f1 = d.submit("tg", "c", "hola", self._sender(enviados, "c"), PRIORITY_REPLY)
+        f2 = d.submit("tg", "c", "qué tal", self._sender(enviados, "c"), PRIORITY_REPLY)
+        f3 = d.submit("tg", "c", "advertencia", self._sender(enviados, "c"), PRIORITY_MODERATION)
+        results = await asyncio.gather(f1, f2, f3)
+        self.assertEqual([t for _, t, _ in enviados], ["advertencia", "hola\n\nqué tal"])
+        self.assertTrue(all(r == {"ok": True} for r in results))
+        self.assertEqual(d.stats()["coalesced"], 1)
+        self.assertEqual(d.stats()["sent"], 2)
+
+    async def test_respeta_retry_after(self):
+        d = OutboundDispatcher(_limits())
+        enviados = []
+        send = self._sender(enviados, "c", [{"ok": False, "retry_after": 0.05}, {"ok": True}])
+        inicio = time.monotonic()
+        result = await d.submit("tg", "c", "x", send)
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(len(enviados), 2)
+        self.assertGreaterEqual(enviados[1][2] - inicio, 0.05)
+        self.assertEqual(d.stats()["rate_limited"], 1)
+
+    async def test_bucket_por_chat_no_frena_otros_chats(self):
+        d = OutboundDispatcher(_limits(chat_rate=10.0, chat_burst=1))
+        enviados = []
+        fa1 = d.submit("tg", "a", "1", self._sender(enviados, "a"), PRIORITY_MODERATION)
+        fa2 = d.submit("tg", "a", "2", self._sender(enviados, "a"), PRIORITY_REPLY)
+        fb = d.submit("tg", "b", "3", self._sender(enviados, "b"), PRIORITY_REPLY)
+        await asyncio.gather(fa1, fa2, fb)
+        self.assertEqual([t for _, t, _ in enviados], ["1", "3", "2"])
+        self.assertGreaterEqual(enviados[2][2] - enviados[0][2], 0.09)
+
+if __name__ == "__main__":
+    unittest.main()
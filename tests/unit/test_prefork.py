@@ -0,0 +1,95 @@
+# test_prefork.py - Prueba unitaria del modo prefork (precompilación, workers, recarga por SIGHUP)
+import gc
+import os
+import signal
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from src.app import prefork
+from src.config import rules_loader
+from src.config.rules_loader import warm_moderation_plans
+from src.storage import write_behind
+
+
+def _esperar(cond, timeout=5.0):
+    fin = time.monotonic() + timeout
+    while time.monotonic() < fin:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class TestPrefork(unittest.TestCase):
+    def test_precompila_planes_de_todos_los_chats(self):
+        claves = [p.chat_key for p in warm_moderation_plans()]
+        self.assertEqual(claves[0], "default")
+        self.assertIn("-123456789", claves)
+        self.assertEqual(len(claves), len(set(claves)))
+
+    def test_preload_congela_el_heap_sin_arrancar_hilos(self):
+        try:
+            app = prefork.preload()
+            self.assertEqual(app.title, "Comunidad Bot API")
+            self.assertGreater(gc.get_freeze_count(), 0)
+            # Hasta el fork los hilos de fondo quedan aplazados
+            writer = write_behind.WriteBehind(lambda: None, 60, "test-aplazado")
+            self.assertFalse(writer._thread.is_alive())
+        finally:
+            gc.unfreeze()
+            write_behind.start_deferred_threads()
+            rules_loader.defer_rules_watcher(False)
+        self.assertTrue(writer._thread.is_alive())
+        writer.close()
+
+    def test_backoff_de_workers_que_mueren_al_arrancar(self):
+        sup = prefork.Supervisor(lambda sock: None, None, workers=1, min_uptime=5, backoff=0.5, max_backoff=1.5)
+        delays = []
+        for _ in range(4):
+            sup._started[0] = time.monotonic()
+            delays.append(sup._schedule_respawn(0))
+        self.assertEqual(delays, [0.5, 1.0, 1.5, 1.5])
+        sup._respawn_due()
+        self.assertEqual(sup.children, {})
+        # Un worker que aguantó más de min_uptime se reemplaza al momento y reinicia la cuenta
+        sup._started[0] = time.monotonic() - 10
+        self.assertEqual(sup._schedule_respawn(0), 0.0)
+        self.assertNotIn(0, sup._failures)
+
+    @unittest.skipUnless(prefork.can_fork(), "requiere fork()")
+    def test_workers_recarga_y_reemplazo(self):
+        tmp = Path(tempfile.mkdtemp())
+
+        def target(sock):
+            log = tmp / str(os.getpid())
+
+            def escribir(evento):
+                with open(log, "a") as f:
+                    f.write(evento + "\n")
+
+            signal.signal(signal.SIGHUP, lambda *_: escribir("hup"))
+            escribir("up")
+            while True:
+                time.sleep(0.02)
+
+        sock = prefork.listen_socket("127.0.0.1", 0)
+        sup = prefork.Supervisor(target, sock, workers=2, stop_timeout=5)
+        try:
+            for slot in range(2):
+                sup._spawn(slot)
+            self.assertTrue(_esperar(lambda: len(list(tmp.iterdir())) == 2))
+            sup._signal(signal.SIGHUP)
+            self.assertTrue(_esperar(lambda: all("hup" in p.read_text() for p in tmp.iterdir())))
+            muerto = next(pid for pid, slot in sup.children.items() if slot == 1)
+            os.kill(muerto, signal.SIGKILL)
+            self.assertTrue(_esperar(lambda: sup._reap() == [1] or muerto not in sup.children))
+            self.assertEqual(sorted(sup.children.values()), [0])
+        finally:
+            sup.stop()
+            sock.close()
+        self.assertEqual(sup.children, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+# test_regex_set.py - Prueba unitaria del motor de regex combinadas
+import unittest
+from src.utils.regex_set import RegexSet
+
+class TestRegexSet(unittest.TestCase):
+    def test_reporta_patron_que_coincide(self):
+        rs = RegexSet([r"\bcasino\b", r"\bpalabrota\b", r"(\w)\1{3,}"])
+        self.assertEqual(rs.search("visita el CASINO"), r"\bcasino\b")
+        self.assertEqual(rs.search("holaaaa"), r"(\w)\1{3,}")
+        self.assertIsNone(rs.search("mensaje normal"))
+
+    def test_patrones_invalidos_y_largos_se_omiten(self):
+        rs = RegexSet(["(sin cerrar", "x" * 1000, "ok"], max_pattern_length=100)
+        self.assertEqual(rs.patterns, ("ok",))
+        self.assertEqual(len(rs.rejected), 2)
+        self.assertEqual(rs.search("todo ok"), "ok")
+
+    def test_condicionales_se_evaluan_por_separado(self):
+        rs = RegexSet([r"\bspam\b", r"(<)?\bpromo\b(?(1)>)"])
+        self.assertEqual(rs.search("<promo>"), r"(<)?\bpromo\b(?(1)>)")
+        self.assertEqual(rs.search("mucho spam"), r"\bspam\b")
+
+    def test_texto_largo_se_analiza_completo(self):
+        rs = RegexSet([r"\bcasino\b", r"\bapuestas\b"])
+        self.assertEqual(rs.search("a" * 20000 + " casino"), r"\bcasino\b")
+
+    def test_busquedas_lentas_no_desactivan_patrones(self):
+        rs = RegexSet([r"\bcasino\b", r"\bapuestas\b", r"(\w)\1{3,}"], slow_scan_ms=-1)
+        for _ in range(5):
+            self.assertEqual(rs.search("casino"), r"\bcasino\b")
+        self.assertEqual(len(rs.patterns), 3)
+        self.assertEqual(rs.rejected, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+# test_rules_loader.py - Prueba unitaria del plan de moderación compilado
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+import yaml
+from src.config import rules_loader
+from src.config.rules_loader import (
+    RulesError, RulesWatcher, get_moderation_plan, get_moderation_config, get_rules_generation, reload_rules_cache,
+)
+
+class TestModerationPlan(unittest.TestCase):
+    def test_plan_memoizado_por_generacion(self):
+        reload_rules_cache()
+        plan = get_moderation_plan("default")
+        self.assertIs(plan, get_moderation_plan("default"))
+        reload_rules_cache()
+        nuevo = get_moderation_plan("default")
+        self.assertIsNot(plan, nuevo)
+        self.assertGreater(nuevo.generation, plan.generation)
+
+    def test_plan_normaliza_palabras_y_regex(self):
+        plan = get_moderation_plan("default")
+        self.assertTrue(all(w == w.lower() and w.strip() for w in plan.banned_words))
+        self.assertEqual(len(plan.regex_set), len([p for p in plan.config["regex_patterns"] if str(p).strip()]))
+        self.assertEqual(plan.action_for_count(10**6), "ban")
+
+    def test_config_es_copia(self):
+        cfg = get_moderation_config("default")
+        cfg["enabled"] = "mutado"
+        cfg["thresholds"]["ban"] = -1
+        cfg["banned_words"].append("mutado")
+        otra = get_moderation_config("default")
+        self.assertNotEqual(otra["enabled"], "mutado")
+        self.assertNotEqual(otra["thresholds"]["ban"], -1)
+        self.assertNotIn("mutado", otra["banned_words"])
+        # Los conectores leen el config del plan sin copiarlo: es de solo lectura
+        with self.assertRaises(TypeError):
+            get_moderation_plan("default").config["enabled"] = "mutado"
+
+
+class TestRulesGeneration(unittest.TestCase):
+    """Recarga atómica: nueva generación completa o, si el YAML no es válido, la anterior."""
+
+    def setUp(self):
+        self.original = rules_loader.RULES_FILE
+        self.path = Path(tempfile.mkdtemp()) / "rules.yaml"
+        entorno = mock.patch.dict(os.environ, {"RULES_SNAPSHOT_DIR": str(self.path.parent)})
+        entorno.start()
+        self.addCleanup(entorno.stop)
+        self._escribir("default:\n  moderation:\n    banned_words: [uno]\n'42':\n  moderation:\n    banned_words: [dos]\n")
+        rules_loader.RULES_FILE = self.path
+        reload_rules_cache()
+
+    def tearDown(self):
+        rules_loader.RULES_FILE = self.original
+        reload_rules_cache()
+
+    def _escribir(self, texto):
+        self.path.write_text(texto, encoding="utf-8")
+        # mtime distinto aunque la escritura caiga en el mismo tick del reloj
+        st = self.path.stat()
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    def test_yaml_invalido_mantiene_la_generacion(self):
+        gen = get_rules_generation()
+        plan = get_moderation_plan("42")
+        self._escribir("default: [\n")
+        with self.assertRaises(Exception):
+            reload_rules_cache()
+        self._escribir("- solo\n- una lista\n")
+        with self.assertRaises(RulesError):
+            reload_rules_cache()
+        self.assertEqual(get_rules_generation(), gen)
+        self.assertIs(get_moderation_plan("42"), plan)
+        self.assertEqual(plan.banned_words, ("dos",))
+
+    def test_chats_sin_override_comparten_el_plan_default(self):
+        self.assertIs(get_moderation_plan("999"), get_moderation_plan("default"))
+        self.assertIsNot(get_moderation_plan("42"), get_moderation_plan("default"))
+
+    def test_reload_if_changed_no_reintenta_el_mismo_archivo_roto(self):
+        gen = get_rules_generation()
+        rules_loader._reload_if_changed()
+        self.assertEqual(get_rules_generation(), gen)
+        self._escribir("default: [\n")
+        rules_loader._reload_if_changed()
+        self.assertEqual(rules_loader._FAILED_SIGNATURE, rules_loader._file_signature(self.path))
+        self.assertEqual(get_rules_generation(), gen)
+        self._escribir("default:\n  moderation:\n    banned_words: [tres]\n")
+        rules_loader._reload_if_changed()
+        self.assertGreater(get_rules_generation(), gen)
+        self.assertEqual(get_moderation_plan("42").banned_words, ("tres",))
+
+    def test_schedule_rules_reload_recarga_en_el_hilo_watcher(self):
+        gen = get_rules_generation()
+        watcher = RulesWatcher(self.path, interval=60, debounce=0).start()
+        try:
+            with mock.patch.object(rules_loader, "_WATCHER", watcher):
+                rules_loader.schedule_rules_reload()
+                fin = time.monotonic() + 5
+                while get_rules_generation() == gen and time.monotonic() < fin:
+                    time.sleep(0.01)
+        finally:
+            watcher.stop()
+        # Recarga completa aunque el archivo no haya cambiado
+        self.assertGreater(get_rules_generation(), gen)
+        self.assertFalse(rules_loader._RELOAD_REQUESTED)
+
+    def test_snapshot_evita_reparsear_el_yaml(self):
+        snapshot = self.path.with_name(".rules.yaml.snapshot")
+        self.assertTrue(snapshot.exists())
+        plan = get_moderation_plan("42")
+        with mock.patch.object(rules_loader, "_parse_rules", side_effect=AssertionError("no debe parsear")):
+            reload_rules_cache()
+            self.assertEqual(get_moderation_plan("42").banned_words, plan.banned_words)
+            # Otro contenido: el snapshot ya no vale y se parsea
+            self._escribir("default:\n  moderation:\n    banned_words: [cinco]\n")
+            with self.assertRaises(AssertionError):
+                reload_rules_cache()
+
+    def test_snapshot_corrupto_se_ignora(self):
+        self.path.with_name(".rules.yaml.snapshot").write_bytes(b"basura")
+        reload_rules_cache()
+        self.assertEqual(get_moderation_plan("42").banned_words, ("dos",))
+
+    def test_snapshot_por_defecto_en_data(self):
+        with mock.patch.dict(os.environ, {"RULES_SNAPSHOT_DIR": ""}):
+            self.assertEqual(rules_loader._snapshot_path(self.path), rules_loader.SNAPSHOT_DIR / ".rules.yaml.snapshot")
+        # La carpeta se crea si no existe
+        destino = self.path.parent / "no-existe" / ".rules.yaml.snapshot"
+        rules_loader._write_snapshot(destino, ("k",), {}, {})
+        self.assertTrue(destino.exists())
+
+    def test_reutiliza_planes_sin_cambios(self):
+        default = get_moderation_plan("default")
+        self._escribir("default:\n  moderation:\n    banned_words: [uno]\n'42':\n  moderation:\n    banned_words: [seis]\n")
+        reload_rules_cache()
+        nuevo = get_moderation_plan("default")
+        self.assertGreater(nuevo.generation, default.generation)
+        self.assertIs(nuevo.word_matcher, default.word_matcher)
+        self.assertEqual(get_moderation_plan("42").banned_words, ("seis",))
+
+    @unittest.skipUnless(getattr(yaml, "__with_libyaml__", False), "libyaml no disponible")
+    def test_usa_el_loader_en_c(self):
+        self.assertIs(rules_loader._YAML_LOADER, yaml.CSafeLoader)
+
+    def test_watcher_publica_la_generacion_nueva(self):
+        watcher = RulesWatcher(self.path, interval=0.02, debounce=0.0).start()
+        try:
+            gen = get_rules_generation()
+            self._escribir("default:\n  moderation:\n    banned_words: [cuatro]\n")
+            fin = time.monotonic() + 5
+            while get_rules_generation() == gen and time.monotonic() < fin:
+                time.sleep(0.02)
+            self.assertEqual(get_moderation_plan("default").banned_words, ("cuatro",))
+        finally:
+            watcher.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
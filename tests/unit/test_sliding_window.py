@@ -0,0 +1,49 @@
+# test_sliding_window.py - Prueba unitaria de ventanas deslizantes y token buckets
+import unittest
+from src.utils.sliding_window import InMemoryWindowStore, SlidingWindowCounter, TokenBucket
+from src.utils.rate_limiter import RateLimiter
+
+class TestSlidingWindow(unittest.TestCase):
+    def test_hit_cuenta_en_ventana(self):
+        c = SlidingWindowCounter(10)
+        self.assertEqual(c.hit("u", now=0), 1)
+        self.assertEqual(c.hit("u", now=5), 2)
+        self.assertEqual(c.hit("u", now=10), 2)  # el evento de t=0 sale al cumplir 10 s
+        self.assertEqual(c.count("u", now=14), 2)
+        self.assertEqual(c.count("otro", now=14), 0)
+
+    def test_allow_no_cuenta_rechazados(self):
+        c = SlidingWindowCounter(10, limit=2, count_rejected=False)
+        self.assertTrue(c.allow("u", now=0))
+        self.assertTrue(c.allow("u", now=1))
+        self.assertFalse(c.allow("u", now=2))
+        self.assertTrue(c.allow("u", now=10))
+
+    def test_expulsion_de_inactivos_y_tope(self):
+        store = InMemoryWindowStore(max_keys=2)
+        c = SlidingWindowCounter(10, store=store)
+        for i, k in enumerate("abc"):
+            c.hit(k, now=i)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.stats()["evicted"], 1)
+        c.hit("d", now=100)
+        self.assertEqual(len(store), 1)
+
+    def test_rate_limiter(self):
+        rl = RateLimiter(3, 60)
+        self.assertEqual([rl.allow("u") for _ in range(4)], [True, True, True, False])
+        self.assertTrue(rl.allow("otro"))
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rafaga_y_recarga(self):
+        tb = TokenBucket(rate=1, capacity=2)
+        self.assertTrue(tb.allow("k", now=0))
+        self.assertTrue(tb.allow("k", now=0))
+        self.assertFalse(tb.allow("k", now=0.5))
+        self.assertAlmostEqual(tb.wait_time("k", now=0.5), 0.5)
+        self.assertTrue(tb.allow("k", now=1.0))
+        tb.allow("x", now=10)
+        self.assertEqual(len(tb), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# test_sql_store.py - Prueba unitaria del store SQL (write-behind + read-through) sobre SQLite
+import os
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import create_engine, func, select
+from src.storage.sql_store import SqlAuditRepository, SqlModerationRepository, moderation_audit
+
+class TestSqlStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmp.name, 'mod.db')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def _repo(self, **kw):
+        return SqlModerationRepository(engine=self.engine, background=False, record_ttl=0, **kw)
+
+    def test_estado_sobrevive_reinicio(self):
+        repo = self._repo()
+        repo.add_violation("c", "u")
+        self.assertEqual(repo.add_violation("c", "u"), 2)
+        repo.set_muted("c", "u", 600)
+        repo.set_banned("c", "b", True)
+        self.assertEqual(repo.stats()["pending_writes"], 2)
+        self.assertEqual(repo.flush(), 2)
+        nuevo = self._repo()
+        self.assertTrue(nuevo.is_muted("c", "u"))
+        self.assertEqual(nuevo.get_record("c", "u")["count"], 2)
+        self.assertTrue(nuevo.get_record("c", "b")["banned"])
+        self.assertEqual(nuevo.add_violation("c", "u"), 3)
+
+    def test_cache_negativa_y_reset(self):
+        repo = self._repo()
+        self.assertFalse(repo.is_muted("c", "x"))
+        self.assertFalse(repo.is_muted("c", "x"))
+        self.assertEqual(repo.stats()["db_reads"], 1)
+        repo.add_violation("c", "x")
+        repo.flush()
+        repo.reset("c", "x")
+        repo.flush()
+        self.assertEqual(self._repo().get_record("c", "x")["count"], 0)
+
+    def test_recarga_tras_expulsion_por_tope(self):
+        repo = self._repo(max_records=1)
+        repo.add_violation("c", "a")
+        repo.add_violation("c", "b")
+        repo.flush()
+        self.assertEqual(repo.add_violation("c", "a"), 2)
+
+    def test_caida_de_la_base_conserva_la_cache(self):
+        repo = self._repo(cache_ttl=10)
+        reloj = [1000.0]
+        repo._time = lambda: reloj[0]
+        repo.add_violation("c", "u")
+        repo.set_muted("c", "u", 600)
+        repo.flush()
+
+        def caida(key):
+            raise RuntimeError("base caída")
+
+        repo._fetch = caida
+        reloj[0] += 60
+        self.assertTrue(repo.is_muted("c", "u"))
+        self.assertEqual(repo.get_record("c", "u")["count"], 1)
+        self.assertEqual(repo.add_violation("c", "u"), 2)
+
+    def test_cache_vencida_se_renueva_en_segundo_plano(self):
+        repo = self._repo(cache_ttl=10)
+        # Sustituto del hilo write-behind: la renovación se lanza a mano
+        repo._writer = mock.Mock()
+        reloj = [1000.0]
+        repo._time = lambda: reloj[0]
+        repo.add_violation("c", "u")
+        repo.flush()
+        otra_replica = self._repo()
+        otra_replica.set_banned("c", "u", True)
+        otra_replica.flush()
+        reloj[0] += 60
+        lecturas = repo.stats()["db_reads"]
+        # Se sirve la caché vencida sin consultar la base en el camino del mensaje
+        self.assertFalse(repo.get_record("c", "u")["banned"])
+        self.assertFalse(repo.is_muted("c", "u"))
+        self.assertEqual(repo.stats()["db_reads"], lecturas)
+        self.assertEqual(repo.stats()["stale_reads"], 1)
+        repo._writer.notify.assert_called_once_with()
+        self.assertEqual(repo.refresh_stale(), 1)
+        self.assertTrue(repo.get_record("c", "u")["banned"])
+
+    def test_auditoria_por_lotes(self):
+        audit = SqlAuditRepository(engine=self.engine, background=False)
+        audit.add_action("bot", "g", "u", "warn", "manual")
+        audit.add_action("bot", "g", "u", "ban", "manual", by="admin")
+        self.assertEqual(audit.flush(), 2)
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(moderation_audit)).scalar(), 2)
+        nuevo = SqlAuditRepository(engine=self.engine, background=False)
+        self.assertEqual([r["action"] for r in nuevo.recent_actions(user_id="u")], ["ban", "warn"])
+
+if __name__ == "__main__":
+    unittest.main()
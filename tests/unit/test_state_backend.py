@@ -0,0 +1,133 @@
+# test_state_backend.py - Prueba unitaria del estado compartido entre réplicas (memoria y Redis)
+import unittest
+from src.storage.state_backend import InMemoryStateBackend, RedisStateBackend, SharedModerationRepository
+from src.utils.rate_limiter import RateLimiter
+
+try:
+    import fakeredis
+except Exception:  # pragma: no cover - dependencia opcional
+    fakeredis = None
+
+
+class _Reloj:
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def _replica(backend, reloj, **kw):
+    repo = SharedModerationRepository(backend, record_ttl=kw.pop("record_ttl", 3600), decay_seconds=kw.pop("decay_seconds", 0))
+    repo._time = reloj
+    return repo
+
+
+class _CasosComunes:
+    """Casos que deben cumplir todos los backends. Las subclases definen _backend()."""
+
+    def setUp(self):
+        self.reloj = _Reloj()
+        self.backend = self._backend()
+        self.a = _replica(self.backend, self.reloj)
+        self.b = _replica(self.backend, self.reloj)
+
+    def test_infracciones_y_mute_compartidos(self):
+        self.assertEqual(self.a.add_violation("c", "u"), 1)
+        self.assertEqual(self.b.add_violation("c", "u"), 2)
+        self.a.set_muted("c", "u", 60)
+        self.assertTrue(self.b.is_muted("c", "u"))
+        self.reloj.t += 61
+        self.assertFalse(self.b.is_muted("c", "u"))
+        self.assertEqual(self.b.get_record("c", "u")["count"], 2)
+        self.b.reset("c", "u")
+        self.assertEqual(self.a.get_record("c", "u"), {"count": 0, "muted_until": None, "banned": False})
+
+    def test_antiflood_entre_replicas(self):
+        for i in range(3):
+            self.a.register_message("c", "u")
+            self.reloj.t += 1
+        self.assertEqual(self.b.register_message("c", "u"), 4)
+        self.reloj.t += 60
+        self.assertEqual(self.a.register_message("c", "u"), 1)
+
+    def test_rate_limiter_compartido(self):
+        r1 = RateLimiter(2, 10, store=self.backend.window_store("ratelimit"))
+        r2 = RateLimiter(2, 10, store=self.backend.window_store("ratelimit"))
+        self.assertTrue(r1.allow("u"))
+        self.assertTrue(r2.allow("u"))
+        self.assertFalse(r1.allow("u"))
+        self.assertFalse(r2.allow("u"))
+        self.assertTrue(r2.allow("otro"))
+
+    def test_decay(self):
+        repo = _replica(self.backend, self.reloj, decay_seconds=100)
+        repo.add_violation("c", "d")
+        repo.add_violation("c", "d")
+        self.reloj.t += 150
+        self.assertEqual(repo.get_record("c", "d")["count"], 1)
+        self.assertEqual(repo.add_violation("c", "d"), 2)
+
+    def test_ban_no_expira(self):
+        repo = _replica(self.backend, self.reloj, record_ttl=10)
+        repo.add_violation("c", "x")
+        repo.set_banned("c", "b", True)
+        self.reloj.t += 20
+        self._avanzar(20)
+        self.assertEqual(repo.get_record("c", "x")["count"], 0)
+        self.assertTrue(repo.get_record("c", "b")["banned"])
+
+    def test_claim_para_deduplicar(self):
+        self.assertTrue(self.backend.claim("telegram:g:1", 60))
+        self.assertFalse(self.backend.claim("telegram:g:1", 60))
+        self.assertTrue(self.backend.is_claimed("telegram:g:1"))
+        self.assertFalse(self.backend.is_claimed("telegram:g:2"))
+        self.backend.release("telegram:g:1")
+        self.assertTrue(self.backend.claim("telegram:g:1", 60))
+
+    def _avanzar(self, segundos):
+        """Deja pasar tiempo real del lado del backend (TTL de Redis)."""
+
+
+class TestInMemoryStateBackend(_CasosComunes, unittest.TestCase):
+    def _backend(self):
+        return InMemoryStateBackend()
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis no instalado")
+class TestRedisStateBackend(_CasosComunes, unittest.TestCase):
+    def _backend(self):
+        self.server = fakeredis.FakeServer()
+        self.client = fakeredis.FakeRedis(server=self.server, decode_responses=True)
+        return RedisStateBackend(self.client)
+
+    def _avanzar(self, segundos):
+        # El TTL de Redis usa el reloj real: se comprueba que está fijado y se simula su vencimiento
+        for key in self.client.keys("cg:m:*"):
+            ttl = self.client.pttl(key)
+            if 0 <= ttl <= segundos * 1000:
+                self.client.delete(key)
+
+    def test_ttl_sigue_al_mute(self):
+        self.a.set_muted("c", "u", 7200)
+        self.assertGreater(self.client.pttl("cg:m:c:u"), 3600 * 1000)
+        self.a.set_banned("c", "u", True)
+        self.assertEqual(self.client.pttl("cg:m:c:u"), -1)
+
+    def test_sin_redis_sigue_con_estado_local(self):
+        self.server.connected = False
+        # Las infracciones siguen escalando (no se quedan en 1) y el mute se respeta
+        self.assertEqual([self.a.add_violation("c", "u") for _ in range(3)], [1, 2, 3])
+        self.a.set_muted("c", "u", 60)
+        self.assertTrue(self.a.is_muted("c", "u"))
+        self.assertEqual(self.a.register_message("c", "u"), 1)
+        limiter = RateLimiter(1, 10, store=self.backend.window_store("rl"))
+        self.assertTrue(limiter.allow("u"))
+        self.assertFalse(limiter.allow("u"))
+        self.assertTrue(self.backend.claim("telegram:g:9", 60))
+        self.assertFalse(self.backend.claim("telegram:g:9", 60))
+        self.assertGreater(self.backend.stats()["errors"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# test_whatsapp_inbound.py - Prueba unitaria del webhook de WhatsApp (idempotencia y modo ack-then-process)
+import asyncio
+import unittest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from src.app.server import app
+from src.connectors import whatsapp_connector as wa
+from src.tasks.chat_queue import QueueFull, get_chat_scheduler
+from src.utils.dedup import get_update_dedup
+
+def _payload(mid, texto="hola", numero="549111"):
+    value = {
+        "metadata": {"phone_number_id": "pn1"},
+        "messages": [{"id": mid, "from": numero, "type": "text", "text": {"body": texto}}],
+    }
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": value}]}]}
+
+class TestWhatsappInbound(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.procesados = []
+
+        async def procesar(mensajes, futuros):
+            await get_chat_scheduler().results(futuros)
+            self.procesados.extend(m["raw_payload"]["id"] for m in mensajes)
+        self.patch = patch.object(wa, "_procesar", procesar)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_reintento_de_meta_se_descarta(self):
+        for _ in range(3):
+            res = self.client.post("/webhooks/whatsapp/", json=_payload("wamid.dup1"))
+            self.assertEqual(res.json(), {"status": "ok"})
+        self.assertEqual(self.procesados, ["wamid.dup1"])
+
+    def test_modo_async_encola_y_responde(self):
+        with patch.object(wa, "WHATSAPP_ASYNC_MODE", True), TestClient(app) as client:
+            res = client.post("/webhooks/whatsapp/", json=_payload("wamid.async1"))
+            self.assertEqual(res.json(), {"status": "queued"})
+            client.portal.call(wa.inbound_pool.join)
+        self.assertEqual(self.procesados, ["wamid.async1"])
+
+    def test_entregas_simultaneas_se_procesan_una_vez(self):
+        mensajes = [wa.normalizar_mensaje_whatsapp(_payload("wamid.par1")["entry"][0]["changes"][0]["value"]) for _ in range(2)]
+        self.assertEqual(len(wa._sin_duplicados(mensajes[:1])), 1)
+        self.assertEqual(wa._sin_duplicados(mensajes[1:]), [])
+
+    def test_close_procesa_lo_encolado(self):
+        pool = wa._InboundPool()
+
+        async def escenario():
+            pool.submit([{"platform_user_id": "a", "raw_payload": {"id": "wamid.c1"}}])
+            pool.submit([{"platform_user_id": "b", "raw_payload": {"id": "wamid.c2"}}])
+            await pool.close(timeout=2)
+            await asyncio.sleep(0)
+            return pool._tasks
+
+        self.assertFalse(asyncio.run(escenario()))
+        self.assertEqual(sorted(self.procesados), ["wamid.c1", "wamid.c2"])
+
+    def test_cola_llena_responde_503_y_permite_reintento(self):
+        for modo in (True, False):
+            mid = f"wamid.full-{modo}"
+            with patch.object(wa, "WHATSAPP_ASYNC_MODE", modo), \
+                    patch.object(wa.manager, "submit_batch", side_effect=QueueFull("llena")):
+                res = self.client.post("/webhooks/whatsapp/", json=_payload(mid))
+            self.assertEqual(res.status_code, 503)
+            self.assertFalse(get_update_dedup().contains("whatsapp", None, mid))
+            self.assertEqual(self.client.post("/webhooks/whatsapp/", json=_payload(mid)).json(), {"status": "ok"})
+
+if __name__ == "__main__":
+    unittest.main()